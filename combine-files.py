@@ -111,13 +111,24 @@ def checkAllFilesUsed(directory: Path):
 
 # append all the individual files in the right order
 addFilteredFile(scriptDir / "colour.py")
+addFilteredFile(scriptDir / "metadata_cache.py")
 addFilteredFile(scriptDir / "utils.py")
+addFilteredFile(scriptDir / "file_digests.py")
 addFilteredFile(scriptDir / "mtree.py")
 addFilteredFile(scriptDir / "config/loader.py")
 addFilteredFile(scriptDir / "config/chericonfig.py")
 addFilteredFile(scriptDir / "config/defaultconfig.py")
 addFilteredFile(scriptDir / "targets.py")
+addFilteredFile(scriptDir / "copy_file.py")
+addFilteredFile(scriptDir / "strip_cache.py")
+addFilteredFile(scriptDir / "archive.py")
+addFilteredFile(scriptDir / "delete_tree.py")
+addFilteredFile(scriptDir / "sysroot.py")
 addFilteredFile(scriptDir / "filesystemutils.py")
+addFilteredFile(scriptDir / "artifact_cache.py")
+addFilteredFile(scriptDir / "build_dir_manager.py")
+addFilteredFile(scriptDir / "git_object_store.py")
+addFilteredFile(scriptDir / "git_update_state.py")
 addFilteredFile(scriptDir / "projects/project.py")
 
 # for now keep the original order
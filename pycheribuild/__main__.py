@@ -41,8 +41,10 @@ from .config.loader import JsonAndCommandLineConfigLoader, JsonAndCommandLineCon
 from .config.defaultconfig import DefaultCheriConfig, CheribuildAction
 from .utils import *
 from .utils import have_working_internet_connection
+from .git_object_store import GitObjectStore
+from .mtree import MtreeFile
 from .targets import targetManager
-from .projects.project import SimpleProject
+from .projects.project import SimpleProject, Project
 # noinspection PyUnresolvedReferences
 from .projects import *  # make sure all projects are loaded so that targetManager gets populated
 # noinspection PyUnresolvedReferences
@@ -107,6 +109,30 @@ def real_main():
     elif CheribuildAction.DUMP_CONFIGURATION in cheriConfig.action:
         print(cheriConfig.getOptionsJSON())
         sys.exit()
+    elif CheribuildAction.GIT_OBJECT_STORE_MAINTENANCE in cheriConfig.action:
+        if not cheriConfig.git_object_store:
+            fatalError("--git-object-store-maintenance requires --git-object-store to be set")
+        else:
+            GitObjectStore(cheriConfig.git_object_store).maintenance()
+        sys.exit()
+    elif CheribuildAction.ARTIFACT_CACHE_STATS in cheriConfig.action:
+        cheriConfig.artifact_cache.print_stats()
+        sys.exit()
+    elif CheribuildAction.ARTIFACT_CACHE_GC in cheriConfig.action:
+        removed, freed = cheriConfig.artifact_cache.gc()
+        statusUpdate("Removed", removed, "artifact cache entries, freed", freed // (1024 * 1024), "MiB")
+        sys.exit()
+    elif CheribuildAction.BUILD_DIR_USAGE in cheriConfig.action:
+        cheriConfig.build_dir_manager.print_usage()
+        sys.exit()
+    elif cheriConfig.diff_metalog:
+        old_metalog, new_metalog = map(Path, cheriConfig.diff_metalog)
+        for metalog in (old_metalog, new_metalog):
+            if not metalog.is_file():
+                fatalError("METALOG file", metalog, "does not exist")
+        diff = MtreeFile(old_metalog).diff(MtreeFile(new_metalog))
+        print("\n".join(diff.summary(max_entries=None if cheriConfig.verbose else 200)))
+        sys.exit()
     elif cheriConfig.getConfigOption:
         if cheriConfig.getConfigOption not in configLoader.options:
             fatalError("Unknown config key", cheriConfig.getConfigOption)
@@ -125,6 +151,12 @@ def real_main():
             if cheriConfig.verbose:
                 printCommand("mkdir", "-p", str(d))
             os.makedirs(str(d), exist_ok=True)
+    # Finish deleting the directories that were being removed when a previous run was interrupted (only the build and
+    # output roots since asyncCleanDirectory() is never used for sources). This only happens when building since we
+    # wait for the deletions to complete at the end of the build.
+    if CheribuildAction.BUILD in cheriConfig.action:
+        cheriConfig.deletion_service.reclaim_interrupted_deletions((cheriConfig.buildRoot, cheriConfig.outputRoot),
+                                                                   cheriConfig.FS._delete_directories_in_background)
 
     if cheriConfig.docker:
         cheribuild_dir = str(Path(__file__).absolute().parent.parent)
@@ -201,6 +233,11 @@ def real_main():
             print("Would run", target)
     if CheribuildAction.BUILD in cheriConfig.action:
         targetManager.run(cheriConfig)
+        if not cheriConfig.quiet:
+            cheriConfig.git_update_state.print_summary()
+        if cheriConfig.deletion_service.pending:
+            statusUpdate("Waiting for", cheriConfig.deletion_service.pending, "background deletions to complete")
+        cheriConfig.deletion_service.wait()
     if CheribuildAction.TEST in cheriConfig.action:
         for target in targetManager.get_all_chosen_targets(cheriConfig):
             target.run_tests(cheriConfig)
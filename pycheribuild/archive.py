@@ -0,0 +1,224 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .utils import *
+
+__all__ = ["create_archive", "archive_command", "archive_compression_for_name", "ARCHIVE_COMPRESSIONS"]  # no-combine
+
+# All files get the same timestamp so that archives with the same contents have the same hash (SOURCE_DATE_EPOCH
+# overrides it). Not 0 since GNU tar warns about "implausibly old time stamps" when extracting those.
+_DEFAULT_ARCHIVE_MTIME = 1514764800  # 2018-01-01
+
+
+def _gzip_block(data: bytes) -> bytes:
+    # Every block is a separate gzip member (the concatenation is a valid gzip file). wbits=31 writes a gzip header
+    # with mtime 0 so the output is reproducible.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _xz_block(data: bytes) -> bytes:
+    # xz also accepts concatenated streams
+    return lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64)
+
+
+# compression -> (file name suffixes, multi-threaded compressor command (in order of preference), in-process block
+# compression function (None if there is no fallback), block size)
+ARCHIVE_COMPRESSIONS = OrderedDict([
+    ("gzip", ((".gz", ".tgz"), [["pigz", "-n", "-c", "-p", "{jobs}"]], _gzip_block, 1024 * 1024)),
+    ("xz", ((".xz", ".txz"), [["xz", "-T", "{jobs}", "-c"]], _xz_block, 16 * 1024 * 1024)),
+    ("zstd", ((".zst", ".tzst"), [["zstd", "-q", "-c", "-T{jobs}", "--long"]], None, 0)),
+    ("none", ((".tar",), [], None, 0)),
+])
+# The GNU tar flag for each compression (used by archive_command())
+_TAR_COMPRESSION_FLAGS = {"gzip": ["--gzip"], "xz": ["--xz"], "zstd": ["--zstd"], "none": []}
+
+
+def archive_compression_for_name(name: "typing.Union[str, Path]") -> "typing.Optional[str]":
+    """:return: the compression implied by the suffix of name (e.g. gzip for foo.tar.gz) or None if unknown"""
+    for compression, (suffixes, _, _, _) in ARCHIVE_COMPRESSIONS.items():
+        if str(name).endswith(suffixes):
+            return compression
+    return None
+
+
+class _ParallelBlockCompressor(object):
+    """
+    A file-like object that compresses everything written to it in fixed size blocks on a thread pool and writes the
+    compressed blocks to output in order (zlib and lzma release the GIL so this scales with the number of cores).
+    """
+    def __init__(self, output: "typing.BinaryIO", compress_block: "typing.Callable[[bytes], bytes]", block_size: int,
+                 jobs: int):
+        self.output = output
+        self.compress_block = compress_block
+        self.block_size = block_size
+        self.jobs = jobs
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.wrote_block = False
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        self.pending.append(self.executor.submit(self.compress_block, block))
+        self.wrote_block = True
+        # Limit the memory usage by waiting for the oldest blocks
+        while len(self.pending) > 2 * self.jobs:
+            self.output.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.buffer or not self.wrote_block:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.output.write(self.pending.popleft().result())
+        self.executor.shutdown()
+
+
+class _CountingWriter(object):
+    def __init__(self, output):
+        self.output = output
+        self.bytes_written = 0
+
+    def write(self, data: bytes) -> int:
+        self.output.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+
+def _archive_members(root: str) -> "typing.List[str]":
+    """:return: all paths below root (relative to root) in a deterministic order"""
+    result = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        reldir = os.path.relpath(dirpath, root)
+        for name in sorted(dirnames + filenames):
+            result.append(os.path.normpath(os.path.join(reldir, name)))
+    return result
+
+
+def _write_tar(output, root: Path, arcname: str, mtime: int):
+    def reproducible(info: tarfile.TarInfo) -> tarfile.TarInfo:
+        info.mtime = mtime
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""  # same as tar --numeric-owner
+        return info
+
+    with tarfile.open(fileobj=output, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+        tar.add(str(root), arcname=arcname, recursive=False, filter=reproducible)
+        for member in _archive_members(str(root)):
+            tar.add(os.path.join(str(root), member), arcname=os.path.join(arcname, member), recursive=False,
+                    filter=reproducible)
+
+
+def archive_command(output: Path, root: Path, *, arcname: str = None, compression: str = None,
+                    mtime: int = None) -> "typing.List[str]":
+    """:return: a GNU tar command line that creates the same archive as create_archive() (printed with --pretend)"""
+    compression = compression or archive_compression_for_name(output) or "gzip"
+    if mtime is None:
+        mtime = int(os.getenv("SOURCE_DATE_EPOCH", _DEFAULT_ARCHIVE_MTIME))
+    arcname = root.name if arcname is None else arcname
+    command = ["tar", "--create"] + _TAR_COMPRESSION_FLAGS[compression] + [
+        "--sort=name", "--mtime=@" + str(mtime), "--owner=0", "--group=0", "--numeric-owner", "-f", str(output)]
+    if arcname == root.name:
+        return command + ["-C", str(root.parent), arcname]
+    if arcname != ".":
+        command.append("--transform=s,^\\.," + arcname + ",S")  # S: don't rename symlink targets
+    return command + ["-C", str(root), "."]
+
+
+def create_archive(output: Path, root: Path, *, arcname: str = None, compression: str = None, jobs: int = None,
+                   mtime: int = None) -> "OrderedDict[str, typing.Any]":
+    """
+    Create a reproducible tar archive of root (sorted entries, the same mtime for all files and owned by uid/gid 0).
+    The tar stream is piped into a multi-threaded compressor (pigz, xz -T or zstd -T --long) if it is installed,
+    otherwise gzip and xz blocks are compressed in-process on a thread pool.
+    :param arcname: the name of root inside the archive (defaults to root.name)
+    :param compression: gzip, xz, zstd or none (defaults to the one implied by the suffix of output)
+    :return: statistics: the compressor that was used, the uncompressed and compressed size and the time taken
+    """
+    compression = compression or archive_compression_for_name(output) or "gzip"
+    _, commands, compress_block, block_size = ARCHIVE_COMPRESSIONS[compression]
+    jobs = jobs or os.cpu_count() or 1
+    if mtime is None:
+        mtime = int(os.getenv("SOURCE_DATE_EPOCH", _DEFAULT_ARCHIVE_MTIME))
+    arcname = root.name if arcname is None else arcname
+    start = time.time()
+    tmp_output = output.with_name(output.name + ".tmp")
+    command = next((c for c in commands if shutil.which(c[0])), None)
+    try:
+        with tmp_output.open("wb") as f:
+            if compression == "none":
+                compressor_name = "none"
+                writer = _CountingWriter(f)
+                _write_tar(writer, root, arcname, mtime)
+            elif command is not None:
+                command = [arg.format(jobs=jobs) for arg in command]
+                compressor_name = command[0]
+                with subprocess.Popen(command, stdin=subprocess.PIPE, stdout=f) as proc:
+                    writer = _CountingWriter(proc.stdin)
+                    try:
+                        _write_tar(writer, root, arcname, mtime)
+                    finally:
+                        proc.stdin.close()
+                if proc.returncode != 0:
+                    raise subprocess.CalledProcessError(proc.returncode, command)
+            elif compress_block is not None:
+                compressor_name = "in-process " + compression
+                compressor = _ParallelBlockCompressor(f, compress_block, block_size, jobs)
+                writer = _CountingWriter(compressor)
+                _write_tar(writer, root, arcname, mtime)
+                compressor.close()
+            else:
+                fatalError("Cannot create", output, "since", compression, "is not installed")
+                return OrderedDict()
+        os.replace(str(tmp_output), str(output))
+    finally:
+        # Don't leave a partial archive behind if writing the tar stream or the compressor failed
+        if tmp_output.exists():
+            tmp_output.unlink()
+    return OrderedDict([("compressor", compressor_name), ("uncompressed_size", writer.bytes_written),
+                        ("compressed_size", output.stat().st_size), ("time", time.time() - start)])
@@ -0,0 +1,327 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import errno
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from .copy_file import copy_tree
+from .utils import *
+
+__all__ = ["ArtifactCache", "snapshot_install_tree"]  # no-combine
+
+# Bump this if the layout of the cache or the meaning of the key changes
+ARTIFACT_CACHE_FORMAT_VERSION = 1
+
+
+def snapshot_install_tree(root: Path) -> "typing.Dict[str, tuple]":
+    """
+    :return: a dict mapping all files and symlinks below root to (mtime_ns, ctime_ns, size, inode). This can only be
+    used for directories that contain nothing but the output of one target (e.g. the sysroot or the bootstrap tools)
+    since comparing snapshots misses files that `install -C` or an up-to-date install left untouched.
+    """
+    result = dict()
+    root = str(root)
+    if not os.path.isdir(root):
+        return result
+    for dirpath, dirnames, filenames in os.walk(root):
+        # os.walk() lists symlinks to directories in dirnames
+        for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            result[os.path.relpath(path, root)] = (st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino)
+    return result
+
+
+def _path_references(root: Path, files: "typing.List[str]", prefix: str) -> "typing.Optional[typing.List[str]]":
+    """
+    :return: the symlinks and text files in files that refer to prefix (e.g. scripts generated with the absolute
+    path of the build directory) or None if a binary file contains prefix (since that cannot be rewritten)
+    """
+    encoded_prefix = os.fsencode(prefix)
+    result = []
+    for relpath in files:
+        path = os.path.join(str(root), relpath)
+        if os.path.islink(path):
+            if prefix in os.readlink(path):
+                result.append(relpath)
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        if encoded_prefix in data:
+            if b"\0" in data:
+                return None
+            result.append(relpath)
+    return result
+
+
+def _relocate_files(root: Path, files: "typing.List[str]", old_prefix: str, new_prefix: str):
+    """Replace old_prefix with new_prefix in the symlinks and text files listed in files"""
+    for relpath in files:
+        path = os.path.join(str(root), relpath)
+        if os.path.islink(path):
+            target = os.readlink(path).replace(old_prefix, new_prefix)
+            os.unlink(path)
+            os.symlink(target, path)
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        # Write a new file instead of modifying it in-place since it may be a hardlink to the cache contents
+        tmpfile = path + ".cheribuild-relocate"
+        with open(tmpfile, "wb") as f:
+            f.write(data.replace(os.fsencode(old_prefix), os.fsencode(new_prefix)))
+        shutil.copymode(path, tmpfile)
+        os.replace(tmpfile, path)
+
+
+class ArtifactCache(object):
+    """
+    A local content-addressed store for the install trees of targets. Entries are stored under
+    objects/<key[:2]>/<key>/ with the files in tree/ and the metadata in info.json. The modification time of info.json
+    is used as the last-used timestamp for the LRU eviction.
+    """
+    def __init__(self, cache_dir: Path, *, max_size: int = None, allow_hardlinks=False, pretend=False):
+        self.cache_dir = cache_dir
+        self.objects_dir = cache_dir / "objects"
+        self.tmp_dir = cache_dir / "tmp"
+        self.stats_file = cache_dir / "stats.json"
+        self.max_size = max_size  # in bytes, None means unlimited
+        self.allow_hardlinks = allow_hardlinks
+        self.pretend = pretend
+
+    @staticmethod
+    def compute_key(inputs: "typing.Dict[str, typing.Any]") -> str:
+        inputs = OrderedDict(inputs)
+        inputs["cache-format-version"] = ARTIFACT_CACHE_FORMAT_VERSION
+        encoded = json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.objects_dir / key[:2] / key
+
+    def _read_info(self, entry: Path) -> "typing.Optional[dict]":
+        try:
+            with (entry / "info.json").open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _update_counters(self, **increments):
+        if self.pretend:
+            return
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        counters = self._read_counters()
+        for k, v in increments.items():
+            counters[k] = counters.get(k, 0) + v
+        tmpfile = self.tmp_dir / ("stats.json." + str(os.getpid()))
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump(counters, f, sort_keys=True, indent=4)
+        os.replace(str(tmpfile), str(self.stats_file))
+
+    def _read_counters(self) -> dict:
+        try:
+            with self.stats_file.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict()
+
+    def contains(self, key: str) -> bool:
+        return (self._entry_dir(key) / "info.json").is_file()
+
+    def lookup(self, key: str) -> "typing.Optional[dict]":
+        """:return: the metadata for key (and mark the entry as used) or None if key is not in the cache"""
+        entry = self._entry_dir(key)
+        info = self._read_info(entry)
+        if info is None:
+            self._update_counters(misses=1)
+            return None
+        if not self.pretend:
+            os.utime(str(entry / "info.json"))
+        self._update_counters(hits=1)
+        return info
+
+    def extract(self, key: str, dest_root: Path, *, relocatable_prefix: str = None) -> "typing.List[str]":
+        """
+        Install all files of the cache entry key into dest_root
+        :param relocatable_prefix: replaces the relocatable_prefix that was passed to store() in the extracted files
+        :return: the list of installed files (relative to dest_root)
+        """
+        entry = self._entry_dir(key)
+        info = self._read_info(entry)
+        assert info is not None, "extract() called for missing key " + key
+        files = info["files"]
+        statusUpdate("Installing", len(files), "files for", info["target"], "from artifact cache entry", key[:16],
+                     "to", dest_root)
+        if self.pretend:
+            return files
+        copy_tree(entry / "tree", dest_root, files, allow_hardlink=self.allow_hardlinks)
+        if relocatable_prefix is not None and info.get("relocatable_prefix") not in (None, relocatable_prefix):
+            _relocate_files(dest_root, info.get("relocations", []), info["relocatable_prefix"], relocatable_prefix)
+        self._update_counters(bytes_restored=info["size"])
+        return files
+
+    def store(self, key: str, root: Path, files: "typing.List[str]", *, target: str,
+              inputs: "typing.Dict[str, typing.Any]" = None, relocatable_prefix: str = None) -> bool:
+        """
+        Add the files (relative to root) to the cache under key.
+        :param relocatable_prefix: an absolute path that is not part of the key and is therefore replaced in the
+        symlinks and text files when extracting the entry. Entries containing binary files that refer to it are not
+        stored.
+        :return: False if the key already existed (or the files were not relocatable)
+        """
+        if self.pretend:
+            statusUpdate("Would store", len(files), "files for", target, "in artifact cache")
+            return True
+        entry = self._entry_dir(key)
+        if self.contains(key):
+            return False
+        relocations = []
+        if relocatable_prefix is not None:
+            relocations = _path_references(root, files, relocatable_prefix)
+            if relocations is None:
+                warningMessage("Not adding", target, "to the artifact cache since a binary file refers to",
+                               relocatable_prefix)
+                return False
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        staging = self.tmp_dir / (key + "." + str(os.getpid()))
+        if staging.exists():
+            shutil.rmtree(str(staging))
+        # Never hardlink the cache contents to the install tree since the project may modify it in-place later
+        copy_tree(root, staging / "tree", files, allow_hardlink=False)
+        total_size = sum(os.lstat(os.path.join(str(root), relpath)).st_size for relpath in files)
+        info = OrderedDict(target=target, key=key, created=time.time(), size=total_size, files=files,
+                           inputs=inputs or {})
+        if relocatable_prefix is not None:
+            info["relocatable_prefix"] = relocatable_prefix
+            info["relocations"] = relocations
+        with (staging / "info.json").open("w", encoding="utf-8") as f:
+            json.dump(info, f, indent=4, default=str)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(str(staging), str(entry))
+        except OSError as e:
+            # Another cheribuild instance stored the same key concurrently
+            shutil.rmtree(str(staging), ignore_errors=True)
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            return False
+        self._update_counters(stores=1, bytes_stored=total_size)
+        statusUpdate("Stored", len(files), "files (" + format_size(total_size) + ") for", target,
+                     "in artifact cache entry", key[:16])
+        if self.max_size is not None:
+            self.gc()
+        return True
+
+    def entries(self) -> "typing.List[typing.Tuple[Path, dict, float]]":
+        """:return: a list of (entry dir, metadata, last used time) sorted by the last used time (oldest first)"""
+        result = []
+        if not self.objects_dir.is_dir():
+            return result
+        for prefix in self.objects_dir.iterdir():
+            for entry in prefix.iterdir():
+                info = self._read_info(entry)
+                if info is None:
+                    continue
+                result.append((entry, info, (entry / "info.json").stat().st_mtime))
+        result.sort(key=lambda e: e[2])
+        return result
+
+    def gc(self, max_size: int = None) -> "typing.Tuple[int, int]":
+        """
+        Remove least recently used entries until the total size is below max_size (defaults to self.max_size)
+        Also removes the temporary directories of interrupted stores.
+        :return: the number of removed entries and the number of freed bytes
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if self.tmp_dir.is_dir():
+            for leftover in self.tmp_dir.iterdir():
+                if leftover.is_dir() and not leftover.name.endswith("." + str(os.getpid())):
+                    printCommand("rm", "-rf", leftover, printVerboseOnly=True)
+                    if not self.pretend:
+                        shutil.rmtree(str(leftover), ignore_errors=True)
+        entries = self.entries()
+        total = sum(info["size"] for _, info, _ in entries)
+        removed = 0
+        freed = 0
+        if max_size is None:
+            return removed, freed
+        for entry, info, last_used in entries:
+            if total <= max_size:
+                break
+            statusUpdate("Evicting artifact cache entry for", info["target"], "(" + format_size(info["size"]) + ")",
+                         "last used", time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used)))
+            if not self.pretend:
+                shutil.rmtree(str(entry), ignore_errors=True)
+            total -= info["size"]
+            freed += info["size"]
+            removed += 1
+        if removed:
+            self._update_counters(evictions=removed)
+        return removed, freed
+
+    def stats(self) -> "OrderedDict[str, typing.Any]":
+        entries = self.entries()
+        result = OrderedDict()
+        result["directory"] = str(self.cache_dir)
+        result["entries"] = len(entries)
+        result["size"] = sum(info["size"] for _, info, _ in entries)
+        result["max_size"] = self.max_size
+        per_target = OrderedDict()
+        for _, info, _ in entries:
+            count, size = per_target.get(info["target"], (0, 0))
+            per_target[info["target"]] = (count + 1, size + info["size"])
+        result["targets"] = OrderedDict(sorted(per_target.items()))
+        result.update(sorted(self._read_counters().items()))
+        return result
+
+    def print_stats(self):
+        stats = self.stats()
+        print("Artifact cache directory:", stats["directory"])
+        max_size = stats["max_size"]
+        print("Entries:", stats["entries"], "using", format_size(stats["size"]),
+              "of", format_size(max_size) if max_size is not None else "unlimited")
+        hits = stats.get("hits", 0)
+        misses = stats.get("misses", 0)
+        hit_rate = " ({:.1f}%)".format(100.0 * hits / (hits + misses)) if hits + misses else ""
+        print("Hits:", hits, "Misses:", str(misses) + hit_rate)
+        print("Stored:", stats.get("stores", 0), "entries (" + format_size(stats.get("bytes_stored", 0)) + ")",
+              "Restored:", format_size(stats.get("bytes_restored", 0)),
+              "Evicted:", stats.get("evictions", 0), "entries")
+        for target, (count, size) in stats["targets"].items():
+            print("   ", target + ":", count, "entries,", format_size(size))
+
@@ -0,0 +1,196 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from .delete_tree import deletion_temp_path
+from .utils import *
+
+__all__ = ["BuildDirectoryManager", "directory_size"]  # no-combine
+
+
+def directory_size(path: "typing.Union[str, os.PathLike]") -> int:
+    """:return: the number of bytes allocated for all files below path (symlinks are not followed)"""
+    total = 0
+    pending = [str(path)]
+    while pending:
+        try:
+            it = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                total += st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+    return total
+
+
+def _overlaps(a: str, b: str) -> bool:
+    return a == b or a.startswith(b.rstrip("/") + "/") or b.startswith(a.rstrip("/") + "/")
+
+
+def _is_ancestor_or_same(path: str, other: str) -> bool:
+    return other == path or other.startswith(path.rstrip("/") + "/")
+
+
+class BuildDirectoryManager(object):
+    """
+    Records the last use of the build and install directories of every target (in
+    <build-root>/.cheribuild-build-dirs.json) and evicts the least recently used build directories once the
+    recorded build directories use more than the quota. Only directories that were recorded as a build directory
+    by cheribuild are evicted. Install directories are only reported and never evicted since other targets depend
+    on them. Sizes are only computed when needed since walking e.g. the CheriBSD objdir is expensive.
+    """
+    def __init__(self, build_root: Path, *, quota: int = None, pretend=False,
+                 protected: "typing.Iterable[Path]" = ()):
+        self.build_root = build_root
+        self.database_file = build_root / ".cheribuild-build-dirs.json"
+        self.quota = quota  # in bytes, None means unlimited
+        self.pretend = pretend
+        # Directories that are never evicted and neither are any directories containing them (e.g. the source root)
+        self.protected = [str(p) for p in protected] + [str(build_root)]
+        self._lock = threading.Lock()
+
+    def _load(self) -> "OrderedDict[str, dict]":
+        try:
+            with self.database_file.open("r", encoding="utf-8") as f:
+                return json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError):
+            return OrderedDict()
+
+    def _save(self, entries: "typing.Dict[str, dict]"):
+        if self.pretend:
+            return
+        tmpfile = self.database_file.with_name(self.database_file.name + "." + str(os.getpid()))
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump(entries, f, sort_keys=True, indent=4)
+        os.replace(str(tmpfile), str(self.database_file))
+
+    def record_use(self, target: str, kind: str, path: Path):
+        """Mark path as used by target now"""
+        if self.pretend or not path.is_dir():
+            return
+        with self._lock:
+            entries = self._load()
+            info = entries.get(str(path), OrderedDict())
+            info["targets"] = sorted(set(info.get("targets", [])) | {target})
+            info["kind"] = kind
+            info["last_used"] = time.time()
+            entries[str(path)] = info
+            self._save(entries)
+
+    def entries(self) -> "typing.List[typing.Tuple[str, dict]]":
+        """:return: all recorded directories that still exist sorted by the last use (oldest first)"""
+        result = [(path, info) for path, info in self._load().items() if os.path.isdir(path)]
+        result.sort(key=lambda e: e[1]["last_used"])
+        return result
+
+    def evict(self, keep: "typing.Iterable[Path]", delete_function: "typing.Callable[[Path], None]",
+              quota: int = None) -> "typing.Tuple[int, int]":
+        """
+        Remove the least recently used build directories below the build root until the total size is below quota
+        (defaults to self.quota). Directories that overlap with any of the paths in keep are never evicted.
+        :param delete_function: called with the renamed directory to delete it (e.g. in the background)
+        :return: the number of evicted directories and the number of freed bytes
+        """
+        if quota is None:
+            quota = self.quota
+        if quota is None:
+            return 0, 0
+        with self._lock:
+            below_root = [(p, info) for p, info in self.entries()
+                          if info["kind"] == "build" and _overlaps(p, str(self.build_root))]
+            sizes = {p: directory_size(p) for p, _ in below_root}
+            keep = [str(p) for p in keep]
+            total = sum(sizes.values())
+            removed = 0
+            freed = 0
+            evicted = []
+            for path, info in below_root:
+                if total <= quota:
+                    break
+                if any(_overlaps(path, k) for k in keep) or any(_is_ancestor_or_same(path, p) for p in self.protected):
+                    continue
+                statusUpdate("Evicting build directory", path, "(" + format_size(sizes[path]) + ", last used",
+                             time.strftime("%Y-%m-%d %H:%M", time.localtime(info["last_used"])) + ")")
+                if not self.pretend:
+                    # Use the same name as asyncCleanDirectory() so that an interrupted deletion is resumed next time
+                    # (but don't fail if an earlier deletion of this directory is still pending)
+                    tempdir = deletion_temp_path(path, unique=True)
+                    try:
+                        os.rename(path, tempdir)
+                    except OSError as e:
+                        warningMessage("Could not evict", path, "->", e)
+                        continue
+                    delete_function(Path(tempdir))
+                evicted.append(path)
+                total -= sizes[path]
+                freed += sizes[path]
+                removed += 1
+            if total > quota:
+                warningMessage("Build directories still use", format_size(total), "which is more than the quota of",
+                               format_size(quota), "(the remaining ones are needed for the current build)")
+            if evicted:
+                database = self._load()
+                for path in evicted:
+                    database.pop(path, None)
+                self._save(database)
+        return removed, freed
+
+    def usage(self) -> "OrderedDict[str, typing.List[typing.Tuple[str, str, int, float]]]":
+        """:return: a mapping from target name to a list of (kind, path, size, last used time)"""
+        result = OrderedDict()
+        for path, info in self.entries():
+            size = directory_size(path)
+            for target in info["targets"] or ["<unknown>"]:
+                result.setdefault(target, []).append((info["kind"], path, size, info["last_used"]))
+        return OrderedDict(sorted(result.items()))
+
+    def print_usage(self):
+        entries = self.entries()
+        total = sum(directory_size(path) for path, _ in entries)
+        print("Build directory database:", self.database_file)
+        print(len(entries), "directories using", format_size(total), "(quota:",
+              (format_size(self.quota) if self.quota is not None else "unlimited") + ")")
+        for target, dirs in self.usage().items():
+            print("   ", target + ":", format_size(sum(d[2] for d in dirs)))
+            for kind, path, size, last_used in dirs:
+                print("       ", kind, path, format_size(size), "last used",
+                      time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used)))
+
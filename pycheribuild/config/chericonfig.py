@@ -201,9 +201,50 @@ class CheriConfig(object):
                                                  help="The SSH key to used to connect to the QEMU instance when running"
                                                       " tests on CheriBSD", group=loader.testsGroup)
 
+        self.git_object_store = loader.addPathOption("git-object-store", group=loader.pathGroup,
+            help="Fetch all repositories into a shared bare git repository in this directory and clone new "
+                 "repositories with --reference to it. This avoids duplicating the objects of related repositories "
+                 "(e.g. cheribsd and freebsd) and of checkouts in different source roots.")
+        self.git_clone_mode = loader.addOption("git-clone-mode", default="shallow",
+            choices=("shallow", "full", "blobless", "treeless"),
+            help="How to clone missing repositories: shallow (--depth 1), full, blobless (--filter=blob:none, file "
+                 "contents are fetched on demand) or treeless (--filter=tree:0, trees and file contents are fetched "
+                 "on demand). Can be overridden with --<target>/git-clone-mode. Ignored with --git-object-store.")
+
+        # Artifact cache options:
+        self.use_artifact_cache = loader.addBoolOption("artifact-cache", group=loader.artifactCacheGroup,
+            help="Install targets that support it (e.g. cheribsd-sysroot and libcxx) from the local artifact cache "
+                 "if they have already been built with the same source revision, local changes, options and "
+                 "dependencies. Lookups are skipped with --clean but results are still stored.")
+        self.artifact_cache_dir = loader.addPathOption("artifact-cache-dir", group=loader.artifactCacheGroup,
+            default=Path(os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "cheribuild/artifacts"),
+            help="The directory used for the artifact cache (shared by all source/output roots)")
+        self.artifact_cache_max_size = loader.addOption("artifact-cache-max-size", type=int, default=50,
+            metavar="GB", group=loader.artifactCacheGroup,
+            help="Evict the least recently used artifact cache entries once the cache is larger than GB gigabytes")
+        self.artifact_cache_hardlinks = loader.addBoolOption("artifact-cache-hardlinks", group=loader.artifactCacheGroup,
+            help="Hardlink files from the artifact cache instead of copying them if reflinks are not supported. "
+                 "Only safe if the installed files are never modified in-place.")
+        self._artifact_cache = None
+        self.background_delete_jobs = loader.addOption("background-delete-jobs", type=int, default=2,
+            help="The maximum number of directories that are deleted in the background at the same time (e.g. old "
+                 "build directories when using --clean). Background deletion runs with the lowest I/O priority.")
+        self._deletion_service = None
+        self.delete_jobs = loader.addOption("delete-jobs", type=int, metavar="N",
+            help="Delete directories in-process with N threads instead of running rm -rf. This may be faster on "
+                 "network file systems but was slower than rm -rf on a single local disk.")
+        self.build_dir_quota = loader.addOption("build-dir-quota", type=int, metavar="GB",
+            help="Before building evict the least recently used build directories below the build root (using "
+                 "background deletion) until they use less than GB gigabytes. Only build directories that were "
+                 "recorded by an earlier build are considered. Directories needed by the targets that are being "
+                 "built are never evicted.")
+        self._build_dir_manager = None
+        self._git_update_state = None
+
         self.targets = None  # type: list
         self.FS = None  # type: FileSystemUtils
-        self.__optionalProperties = []
+        self.__optionalProperties = ["_artifact_cache", "_deletion_service", "_build_dir_manager",
+                                     "_git_update_state"]
 
     def load(self):
         self.loader.load()
@@ -252,6 +293,39 @@ class CheriConfig(object):
         os.environ["CHERI_BITS"] = self.cheriBitsStr
         self.sysrootArchiveName = "cheri-sysroot" + self.cheriBitsStr + ".tar.gz"
 
+    @property
+    def artifact_cache(self) -> "ArtifactCache":
+        if self._artifact_cache is None:
+            from ..artifact_cache import ArtifactCache
+            max_size = self.artifact_cache_max_size * 1024 * 1024 * 1024 if self.artifact_cache_max_size else None
+            self._artifact_cache = ArtifactCache(self.artifact_cache_dir, max_size=max_size, pretend=self.pretend,
+                                                 allow_hardlinks=self.artifact_cache_hardlinks)
+        return self._artifact_cache
+
+    @property
+    def build_dir_manager(self) -> "BuildDirectoryManager":
+        if self._build_dir_manager is None:
+            from ..build_dir_manager import BuildDirectoryManager
+            quota = self.build_dir_quota * 1024 * 1024 * 1024 if self.build_dir_quota is not None else None
+            self._build_dir_manager = BuildDirectoryManager(self.buildRoot, quota=quota, pretend=self.pretend,
+                                                            protected=(self.sourceRoot, self.outputRoot))
+        return self._build_dir_manager
+
+    @property
+    def git_update_state(self) -> "GitUpdateState":
+        if self._git_update_state is None:
+            from ..git_update_state import GitUpdateState
+            self._git_update_state = GitUpdateState(self.buildRoot, pretend=self.pretend)
+        return self._git_update_state
+
+    @property
+    def deletion_service(self) -> "DeletionService":
+        if self._deletion_service is None:
+            from ..delete_tree import DeletionService
+            self._deletion_service = DeletionService(max_workers=max(1, self.background_delete_jobs),
+                                                     verbose=self.verbose)
+        return self._deletion_service
+
     @property
     def makeJFlag(self):
         return "-j" + str(self.makeJobs)
@@ -45,6 +45,13 @@ class CheribuildAction(Enum):
     PRINT_CHOSEN_TARGETS = ("--print-chosen-targets", "List all the targets that would be built")
     DUMP_CONFIGURATION = ("--dump-configuration", "Print the current configuration as JSON. This can be saved to "
                                                   "~/.config/cheribuild.json to make it persistent")
+    GIT_OBJECT_STORE_MAINTENANCE = ("--git-object-store-maintenance", "Fetch all remotes in the shared git object "
+                                    "store (--git-object-store), repack it and exit")
+    ARTIFACT_CACHE_STATS = ("--artifact-cache-stats", "Print statistics about the local artifact cache and exit")
+    ARTIFACT_CACHE_GC = ("--artifact-cache-gc", "Evict least recently used entries from the local artifact cache until "
+                                                "it is smaller than --artifact-cache-max-size and exit")
+    BUILD_DIR_USAGE = ("--build-dir-usage", "Print the size and last use of the build and install directories of all "
+                                            "targets and exit")
 
     def __init__(self, option_name, help_message, altname=None, actions=None):
         self.option_name = option_name
@@ -63,6 +70,10 @@ class DefaultCheriConfig(CheriConfig):
         # The run mode:
         self.getConfigOption = loader.addOption("get-config-option", type=str, metavar="KEY", group=loader.actionGroup,
                                                 help="Print the value of config option KEY and exit")
+        self.diff_metalog = loader.addCommandLineOnlyOption("diff-metalog", type=list, nargs=2, metavar=("OLD", "NEW"),
+                                                            group=loader.actionGroup,
+                                                            help="Print the files that were added, removed or changed "
+                                                                 "between two METALOG files (mtree manifests) and exit")
         # boolean flags
         self.quiet = loader.addBoolOption("quiet", "q", help="Don't show stdout of the commands that are executed")
         self.verbose = loader.addBoolOption("verbose", "v", help="Print all commmands that are executed")
@@ -0,0 +1,245 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import errno
+import fcntl
+import os
+import stat
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["copy_file", "copy_tree", "default_copy_tree_jobs"]  # no-combine
+
+# Linux ioctl to create a copy-on-write clone of a file (btrfs, xfs)
+_FICLONE = 0x40049409
+# Large chunks for copy_file_range()/sendfile() since the data never has to be copied to user space
+_COPY_CHUNK_SIZE = 64 * 1024 * 1024
+_READ_WRITE_CHUNK_SIZE = 1024 * 1024
+# These errors mean that the method is not supported for this pair of files (e.g. EXDEV before Linux 5.3) and that
+# the next method should be tried instead
+_COPY_FALLBACK_ERRNOS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY)
+
+_HAVE_FICLONE = sys.platform.startswith("linux")
+# (source device, destination device) pairs for which FICLONE failed (don't try again for every single file)
+_FICLONE_UNSUPPORTED = set()
+
+
+def _copy_file_range_chunk(src_fd: int, dest_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dest_fd, min(count, _COPY_CHUNK_SIZE), offset, offset)
+
+
+def _sendfile_chunk(src_fd: int, dest_fd: int, offset: int, count: int) -> int:
+    os.lseek(dest_fd, offset, os.SEEK_SET)
+    return os.sendfile(dest_fd, src_fd, offset, min(count, _COPY_CHUNK_SIZE))
+
+
+def _read_write_chunk(src_fd: int, dest_fd: int, offset: int, count: int) -> int:
+    data = os.pread(src_fd, min(count, _READ_WRITE_CHUNK_SIZE), offset)
+    written = 0
+    while written < len(data):
+        written += os.pwrite(dest_fd, data[written:], offset + written)
+    return len(data)
+
+
+# The in-kernel copy methods in order of preference (copy_file_range() was added in Python 3.8 and sendfile() only
+# works for regular files as the output on Linux)
+_CHUNK_COPY_METHODS = []
+if hasattr(os, "copy_file_range"):
+    _CHUNK_COPY_METHODS.append(_copy_file_range_chunk)
+if sys.platform.startswith("linux") and hasattr(os, "sendfile"):
+    _CHUNK_COPY_METHODS.append(_sendfile_chunk)
+_CHUNK_COPY_METHODS.append(_read_write_chunk)
+# Methods that failed with ENOSYS (not supported by the kernel). This is only ever added to (which is safe without a
+# lock) so that _CHUNK_COPY_METHODS is never modified while other threads are iterating over it.
+_UNSUPPORTED_CHUNK_COPY_METHODS = set()
+
+
+def default_copy_tree_jobs() -> int:
+    return min(8, 2 * (os.cpu_count() or 1))
+
+
+def _data_segments(fd: int, st: os.stat_result) -> "typing.List[typing.Tuple[int, int]]":
+    """:return: (start, end) for all regions of the file that are not holes"""
+    size = st.st_size
+    # Only look for holes if the file uses less space than its size (most files are not sparse)
+    if not hasattr(os, "SEEK_DATA") or not hasattr(st, "st_blocks") or st.st_blocks * 512 >= size:
+        return [(0, size)]
+    result = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    break  # no more data after offset
+                raise
+            offset = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            result.append((start, offset))
+    except OSError:
+        return [(0, size)]  # SEEK_DATA is not supported by the file system
+    return result
+
+
+def _copy_range(src_fd: int, dest_fd: int, offset: int, end: int):
+    for method in _CHUNK_COPY_METHODS:
+        if method in _UNSUPPORTED_CHUNK_COPY_METHODS:
+            continue
+        try:
+            while offset < end:
+                copied = method(src_fd, dest_fd, offset, end - offset)
+                if copied == 0:
+                    break  # either the file was truncated or this method doesn't work for it (e.g. files in /proc)
+                offset += copied
+            if offset >= end:
+                return
+        except OSError as e:
+            if method is _read_write_chunk or e.errno not in _COPY_FALLBACK_ERRNOS:
+                raise
+            if e.errno == errno.ENOSYS:
+                _UNSUPPORTED_CHUNK_COPY_METHODS.add(method)  # not supported by the kernel -> don't try it again
+
+
+def _clone_file(src_fd: int, dest_fd: int, devices: tuple = None) -> bool:
+    if not _HAVE_FICLONE or devices in _FICLONE_UNSUPPORTED:
+        return False
+    try:
+        fcntl.ioctl(dest_fd, _FICLONE, src_fd)
+        return True
+    except OSError as e:
+        # Not supported by the filesystem (or different filesystems) -> fall back to copying
+        if devices is not None and e.errno in _COPY_FALLBACK_ERRNOS:
+            _FICLONE_UNSUPPORTED.add(devices)
+        return False
+
+
+def _create_copy(src: str, src_fd: int, st: os.stat_result, dest: str, allow_hardlink: bool,
+                 preserve_timestamps: bool):
+    dest_fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        cloned = _clone_file(src_fd, dest_fd, (st.st_dev, os.fstat(dest_fd).st_dev))
+        if not cloned and allow_hardlink:
+            os.close(dest_fd)
+            dest_fd = None
+            os.unlink(dest)
+            try:
+                os.link(src, dest)
+                return
+            except OSError:
+                # e.g. EXDEV -> fall back to copying
+                dest_fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        if not cloned:
+            segments = _data_segments(src_fd, st)
+            for start, end in segments:
+                _copy_range(src_fd, dest_fd, start, end)
+            if not segments or segments[-1][1] != st.st_size:
+                os.ftruncate(dest_fd, st.st_size)  # create the trailing hole
+        os.fchmod(dest_fd, stat.S_IMODE(st.st_mode))
+        if preserve_timestamps:
+            os.utime(dest_fd if os.utime in os.supports_fd else dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+    except BaseException:
+        if dest_fd is not None:
+            os.close(dest_fd)
+            os.unlink(dest)
+        raise
+    os.close(dest_fd)
+
+
+def copy_file(src: "typing.Union[str, os.PathLike]", dest: "typing.Union[str, os.PathLike]", *,
+              allow_hardlink=False, preserve_timestamps=False, follow_symlinks=False) -> None:
+    """
+    Copy src to dest (which must not be a directory) using the fastest available method: a copy-on-write reflink
+    (FICLONE), a hardlink (only if allow_hardlink is set), copy_file_range()/sendfile() and finally read()+write().
+    Holes in sparse files (e.g. disk images) are preserved. Like shutil.copy() the permission bits are copied, and
+    with preserve_timestamps also the access and modification times.
+    An existing dest is replaced and not modified in-place (so files that are hardlinked elsewhere are not changed).
+    """
+    src = str(src)
+    dest = str(dest)
+    if not follow_symlinks and os.path.islink(src):
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        os.symlink(os.readlink(src), dest)
+        return
+    if os.path.lexists(dest):
+        os.unlink(dest)
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        _create_copy(src, src_fd, os.fstat(src_fd), dest, allow_hardlink, preserve_timestamps)
+    finally:
+        os.close(src_fd)
+
+
+def _list_tree(root: str) -> "typing.Tuple[typing.List[str], typing.List[str]]":
+    """:return: all subdirectories and all other entries below root (relative to root)"""
+    dirs = []
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(dirpath, root)
+        for name in dirnames:
+            path = os.path.normpath(os.path.join(reldir, name))
+            # os.walk() lists symlinks to directories in dirnames but doesn't descend into them
+            (files if os.path.islink(os.path.join(dirpath, name)) else dirs).append(path)
+        files.extend(os.path.normpath(os.path.join(reldir, name)) for name in filenames)
+    return dirs, files
+
+
+def copy_tree(src_root: "typing.Union[str, os.PathLike]", dest_root: "typing.Union[str, os.PathLike]",
+              files: "typing.Iterable[str]" = None, *, jobs: int = None, allow_hardlink=False,
+              preserve_timestamps=True) -> "typing.List[str]":
+    """
+    Copy the files (relative to src_root, all files and symlinks below src_root by default) to dest_root using
+    copy_file() on multiple threads. Copying many small files is dominated by the per-file system calls so this is
+    significantly faster than a sequential copy (especially on network file systems).
+    :return: the list of copied files
+    :raises OSError: the first error encountered (after all other files have been copied)
+    """
+    src_root = str(src_root)
+    dest_root = str(dest_root)
+    if files is None:
+        dirs, files = _list_tree(src_root)
+    else:
+        files = list(files)
+        dirs = []
+    # Create all directories first so that the worker threads don't race creating the same parent directories
+    needed_dirs = {os.path.dirname(f) for f in files}
+    needed_dirs.update(dirs)
+    for d in sorted(needed_dirs):
+        os.makedirs(os.path.join(dest_root, d), exist_ok=True)
+
+    def copy_one(relpath: str):
+        copy_file(os.path.join(src_root, relpath), os.path.join(dest_root, relpath), allow_hardlink=allow_hardlink,
+                  preserve_timestamps=preserve_timestamps)
+
+    with ThreadPoolExecutor(max_workers=jobs or default_copy_tree_jobs()) as executor:
+        futures = [executor.submit(copy_one, f) for f in files]
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        raise errors[0]
+    return files
@@ -0,0 +1,335 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import ctypes
+import ctypes.util
+import os
+import platform
+import stat
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .colour import statusUpdate, warningMessage
+
+__all__ = ["delete_tree", "default_delete_tree_jobs", "DeletionService", "find_interrupted_deletions",  # no-combine
+           "set_low_io_priority", "deletion_temp_path", "INTERRUPTED_DELETION_MARKER"]  # no-combine
+
+# asyncCleanDirectory() renames directories to <name>.delete-me-pls before deleting them in the background
+INTERRUPTED_DELETION_MARKER = ".delete-me-pls"
+
+
+def deletion_temp_path(path: "os.PathLike", *, unique=False) -> str:
+    """
+    :return: the name that path is renamed to before deleting it in the background (<path>.delete-me-pls)
+    :param unique: append a number if that name already exists (e.g. since an earlier deletion was interrupted)
+    """
+    result = str(path) + INTERRUPTED_DELETION_MARKER
+    counter = 1
+    while unique and os.path.lexists(result + ("-" + str(counter) if counter > 1 else "")):
+        counter += 1
+    return result + ("-" + str(counter) if counter > 1 else "")
+
+# Use file descriptor relative unlink() calls to avoid resolving the full path for every single file
+_DELETE_TREE_USE_DIR_FD = hasattr(os, "O_DIRECTORY") and all(f in os.supports_dir_fd for f in (os.open, os.unlink,
+                                                                                               os.stat))
+# os.scandir() was added in Python 3.5 but only accepts a file descriptor since 3.7
+_DELETE_TREE_SCANDIR_FD = hasattr(os, "scandir") and os.scandir in os.supports_fd
+
+
+def default_delete_tree_jobs() -> int:
+    # Deleting is mostly limited by the file system metadata operations and not by the CPU, but more threads than
+    # that usually don't make it any faster
+    return min(16, 2 * (os.cpu_count() or 1))
+
+
+def _list_directory(path: str, fd: int) -> "typing.List[typing.Tuple[str, bool]]":
+    """:return: (name, is_directory) for every entry in path (fd is an open descriptor for it or None)"""
+    if fd is not None and _DELETE_TREE_SCANDIR_FD:
+        with os.scandir(fd) as it:
+            return [(e.name, e.is_dir(follow_symlinks=False)) for e in it]
+    if fd is None and hasattr(os, "scandir"):
+        return [(e.name, e.is_dir(follow_symlinks=False)) for e in os.scandir(path)]
+    result = []
+    for name in os.listdir(path if fd is None else fd):
+        if fd is None:
+            mode = os.lstat(os.path.join(path, name)).st_mode
+        else:
+            mode = os.stat(name, dir_fd=fd, follow_symlinks=False).st_mode
+        result.append((name, stat.S_ISDIR(mode)))
+    return result
+
+
+class _DirectoryToDelete(object):
+    __slots__ = ("path", "parent", "pending")
+
+    def __init__(self, path: str, parent: "_DirectoryToDelete"):
+        self.path = path
+        self.parent = parent
+        self.pending = 1  # the scan of this directory + one for each subdirectory once it has been found
+
+
+class _ParallelTreeDeleter(object):
+    """
+    Removes all files in a directory and submits a new job for every subdirectory. Once the last file of a
+    directory and all its subdirectories have been removed the directory itself is removed (without having to
+    block any of the worker threads).
+    """
+    def __init__(self, jobs: int):
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.errors = []  # type: typing.List[BaseException]
+
+    def run(self, root: str):
+        try:
+            self.executor.submit(self._process, _DirectoryToDelete(root, None))
+            self.finished.wait()
+        finally:
+            self.executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+    def _delete_files(self, path: str) -> "typing.List[str]":
+        """Remove all non-directory entries in path
+        :return: the names of the subdirectories
+        """
+        fd = None
+        if _DELETE_TREE_USE_DIR_FD:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY | getattr(os, "O_NOFOLLOW", 0))
+        try:
+            subdirs = []
+            for name, is_dir in _list_directory(path, fd):
+                if is_dir:
+                    subdirs.append(name)
+                    continue
+                try:
+                    if fd is not None:
+                        os.unlink(name, dir_fd=fd)
+                    else:
+                        os.unlink(os.path.join(path, name))
+                except FileNotFoundError:
+                    pass
+            return subdirs
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _process(self, directory: _DirectoryToDelete):
+        try:
+            try:
+                subdirs = self._delete_files(directory.path)
+            except FileNotFoundError:
+                subdirs = []  # already removed by someone else (e.g. another cheribuild instance)
+            with self.lock:
+                directory.pending += len(subdirs)
+            for name in subdirs:
+                self.executor.submit(self._process, _DirectoryToDelete(os.path.join(directory.path, name), directory))
+        except BaseException as e:
+            self.errors.append(e)
+        self._done(directory)
+
+    def _done(self, directory: _DirectoryToDelete):
+        while directory is not None:
+            with self.lock:
+                directory.pending -= 1
+                if directory.pending > 0:
+                    return
+            # All files and subdirectories are gone -> remove the now empty directory and notify the parent
+            try:
+                os.rmdir(directory.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.errors.append(e)
+            if directory.parent is None:
+                self.finished.set()
+            directory = directory.parent
+
+
+def delete_tree(path: "typing.Union[str, os.PathLike]", jobs: int = None) -> None:
+    """
+    Equivalent to rm -rf path but deletes the files in different subdirectories in parallel.
+    :raises OSError: if any file could not be removed (the remaining files are left in place)
+    """
+    path = str(path)
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISDIR(mode):
+        os.unlink(path)
+        return
+    _ParallelTreeDeleter(jobs or default_delete_tree_jobs()).run(path)
+
+
+# ioprio_set() has no wrapper in glibc so we have to use syscall() with the per-architecture number
+_IOPRIO_SET_SYSCALLS = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "riscv64": 30, "armv7l": 314,
+                        "ppc64": 273, "ppc64le": 273, "s390x": 282}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_CLASS_BE = 2
+_IOPRIO_LOWEST_BE_LEVEL = 7
+
+
+def set_low_io_priority() -> bool:
+    """
+    Set the I/O priority of the calling thread to the lowest best-effort level (same as ionice -c 2 -n 7). Threads
+    created by this thread afterwards inherit the priority.
+    :return: True if the priority was changed
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    syscall_number = _IOPRIO_SET_SYSCALLS.get(platform.machine())
+    libc_name = ctypes.util.find_library("c")
+    if syscall_number is None or not libc_name:
+        return False
+    try:
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        # who=0 means the calling thread
+        ioprio = (_IOPRIO_CLASS_BE << _IOPRIO_CLASS_SHIFT) | _IOPRIO_LOWEST_BE_LEVEL
+        return libc.syscall(syscall_number, _IOPRIO_WHO_PROCESS, 0, ioprio) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def find_interrupted_deletions(roots: "typing.Iterable[os.PathLike]", max_depth: int = 2) -> "typing.List[str]":
+    """
+    :return: all directories below roots whose name contains INTERRUPTED_DELETION_MARKER (i.e. the ones that were
+    left behind when cheribuild was killed while deleting them in the background)
+    """
+    result = []
+    pending = [(str(root), 1) for root in roots]
+    while pending:
+        directory, depth = pending.pop()
+        try:
+            entries = _list_directory(directory, None)
+        except OSError:
+            continue
+        for name, is_dir in sorted(entries):
+            if not is_dir:
+                continue
+            path = os.path.join(directory, name)
+            if INTERRUPTED_DELETION_MARKER in name:
+                result.append(path)
+            elif depth < max_depth:
+                pending.append((path, depth + 1))
+    return sorted(result)
+
+
+def _delete_tree_single_thread(path: "os.PathLike"):
+    delete_tree(path, jobs=1)
+
+
+class DeletionService(object):
+    """
+    Deletes directories in the background on a bounded number of threads. The threads run with the lowest
+    best-effort I/O priority so that deleting e.g. an old cheribsd build directory does not slow down the build
+    that is running at the same time. Each directory is deleted on a single thread (delete_tree() with jobs=1 unless
+    a different delete_function is passed) so that at most max_workers threads are deleting files.
+    """
+    def __init__(self, max_workers: int = 2, low_io_priority: bool = True, verbose: bool = False):
+        self.max_workers = max_workers
+        self.low_io_priority = low_io_priority
+        self.verbose = verbose
+        self._executor = None  # type: ThreadPoolExecutor
+        self._lock = threading.Lock()
+        self._futures = []
+
+    def submit(self, path: "os.PathLike", delete_function: "typing.Callable[[os.PathLike], None]" = None):
+        """
+        Delete path (using delete_function instead of delete_tree if set) on one of the worker threads
+        :return: a concurrent.futures.Future that completes once path has been removed
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            future = self._executor.submit(self._delete, path, delete_function or _delete_tree_single_thread)
+            self._futures.append(future)
+            return future
+
+    def _delete(self, path: "os.PathLike", delete_function: "typing.Callable[[os.PathLike], None]"):
+        if self.low_io_priority:
+            set_low_io_priority()
+        try:
+            if self.verbose:
+                statusUpdate("Deleting", path, "asynchronously")
+            delete_function(path)
+            if self.verbose:
+                statusUpdate("Async delete of", path, "finished")
+        except Exception as e:
+            warningMessage("Could not remove directory", path, e)
+
+    def job(self, path: "os.PathLike", delete_function: "typing.Callable[[os.PathLike], None]" = None):
+        """:return: a job that can be passed to ThreadJoiner (the deletion starts when entering the with block)"""
+        return _DeletionJob(self, path, delete_function)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            return len(self._futures)
+
+    def wait(self):
+        """Wait until all submitted directories have been deleted"""
+        with self._lock:
+            futures = self._futures
+            self._futures = []
+        for future in futures:
+            future.result()
+
+    def reclaim_interrupted_deletions(self, roots: "typing.Iterable[os.PathLike]",
+                                      delete_function: "typing.Callable[[os.PathLike], None]" = None):
+        """Find all directories that were left behind by a previous interrupted run and delete them in the background
+        :return: the list of directories that will be deleted
+        """
+        leftovers = find_interrupted_deletions(roots)
+        for path in leftovers:
+            statusUpdate("Removing", path, "left behind by an interrupted cheribuild run in the background")
+            self.submit(path, delete_function)
+        return leftovers
+
+
+class _DeletionJob(object):
+    """Same interface as threading.Thread (as far as ThreadJoiner is concerned) but runs on a DeletionService"""
+    def __init__(self, service: DeletionService, path: "os.PathLike", delete_function):
+        self.name = "Deleting " + str(path)
+        self.service = service
+        self.path = path
+        self.delete_function = delete_function
+        self._future = None
+
+    def start(self):
+        self._future = self.service.submit(self.path, self.delete_function)
+
+    def is_alive(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def join(self):
+        if self._future is not None:
+            self._future.result()
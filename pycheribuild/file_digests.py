@@ -0,0 +1,135 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .utils import *
+
+__all__ = ["FileDigestCache", "file_sha256", "compute_file_digests"]  # no-combine
+
+_DIGEST_READ_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        # hashlib releases the GIL for large buffers so this scales with the number of threads
+        for chunk in iter(lambda: f.read(_DIGEST_READ_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FileDigestCache(object):
+    """
+    Persistent cache of file digests keyed by (device, inode, size, mtime in ns). This means that unchanged files
+    (and all hardlinks to them) only need to be read once even if the rootfs is installed again (install(1) only
+    replaces files that changed when using -C/-S).
+    """
+    # Entries that were not used by the last run are dropped once the cache grows larger than this
+    MAX_ENTRIES = 1000000
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = dict()  # type: typing.Dict[str, str]
+        self._used = set()  # type: typing.Set[str]
+        self.hits = 0
+        self.misses = 0
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == 1:
+                self._entries = data["entries"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    @staticmethod
+    def _key(st: os.stat_result) -> str:
+        return "{}:{}:{}:{}".format(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def digest(self, path: str, st: os.stat_result=None) -> "typing.Tuple[int, str]":
+        """:return: the size and the sha256 digest of path"""
+        if st is None:
+            st = os.stat(path)
+        key = self._key(st)
+        digest = self._entries.get(key)
+        if digest is None:
+            digest = file_sha256(path)
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = digest
+                self._used.add(key)
+        else:
+            with self._lock:
+                self.hits += 1
+                self._used.add(key)
+        return st.st_size, digest
+
+    def save(self):
+        if self.misses == 0 and len(self._entries) <= self.MAX_ENTRIES:
+            return  # nothing new
+        entries = self._entries
+        if len(entries) > self.MAX_ENTRIES:
+            entries = {k: v for k, v in entries.items() if k in self._used}
+        tmpfile = self.path.with_name(self.path.name + "." + str(os.getpid()))
+        with tmpfile.open("w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": entries}, f)
+        os.replace(str(tmpfile), str(self.path))
+
+
+def compute_file_digests(paths: "typing.Iterable[str]", *, cache: FileDigestCache=None,
+                         jobs: int=None) -> "typing.Dict[str, typing.Tuple[int, str]]":
+    """
+    Compute the size and sha256 digest of all paths using a thread pool. Files that can't be read are not included
+    in the result.
+    """
+    if cache is None:
+        def digest(path):
+            return os.stat(path).st_size, file_sha256(path)
+    else:
+        digest = cache.digest
+
+    def digest_or_none(path):
+        try:
+            return digest(path)
+        except OSError as e:
+            warningMessage("Could not compute digest of", path, e)
+            return None
+
+    paths = list(paths)
+    if jobs is None:
+        jobs = min(32, (os.cpu_count() or 1) + 4)  # the same default as ThreadPoolExecutor in Python 3.8
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = executor.map(digest_or_none, paths)
+        return {path: result for path, result in zip(paths, results) if result is not None}
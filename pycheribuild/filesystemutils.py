@@ -28,13 +28,16 @@
 # SUCH DAMAGE.
 #
 
+import errno
 import os
-import threading
 import shutil
+import threading
 import subprocess
 
 from pathlib import Path
 from .config.chericonfig import CheriConfig
+from .copy_file import copy_file
+from .delete_tree import delete_tree, deletion_temp_path
 from .utils import *
 
 
@@ -45,12 +48,32 @@ class FileSystemUtils(object):
     def makedirs(self, path: Path):
         if not self.config.pretend and not path.is_dir():
             printCommand("mkdir", "-p", path, printVerboseOnly=True)
+            invalidate_cached_metadata(path)
             os.makedirs(str(path), exist_ok=True)
 
-    def _deleteDirectories(self, *dirs):
+    def _deleteDirectories(self, *dirs, jobs: int=None):
         # http://stackoverflow.com/questions/5470939/why-is-shutil-rmtree-so-slow
         # shutil.rmtree(path) # this is slooooooooooooooooow for big trees
-        runCmd("rm", "-rf", *dirs)
+        # rm -rf is a lot faster. It only uses a single thread, but deleting the subdirectories in parallel with
+        # delete_tree() (--delete-jobs) was not faster on a local disk so it is only used if requested.
+        printCommand("rm", "-rf", *dirs)
+        if self.config.pretend:
+            return
+        invalidate_cached_metadata(*dirs)
+        if not self.config.delete_jobs:
+            runCmd("rm", "-rf", *dirs, no_print=True)
+            return
+        for d in dirs:
+            try:
+                delete_tree(d, jobs=jobs or self.config.delete_jobs)
+            except OSError as e:
+                warningMessage("Could not delete", d, "(" + str(e) + "), falling back to rm -rf")
+                runCmd("rm", "-rf", d, no_print=True)
+
+    def _delete_directories_in_background(self, *dirs):
+        # The deletion service already deletes multiple directories at the same time with a low I/O priority, so only
+        # use one thread for each of them
+        self._deleteDirectories(*dirs, jobs=1)
 
     def cleanDirectory(self, path: Path, keepRoot=False) -> None:
         """ After calling this function path will be an empty directory
@@ -64,22 +87,6 @@ class FileSystemUtils(object):
         # always make sure the path exists
         self.makedirs(path)
 
-    class DeleterThread(threading.Thread):
-        def __init__(self, parent: "FileSystemUtils", path: Path):
-            super().__init__(name="Deleting " + str(path))
-            self.path = path
-            self.parent = parent
-
-        def run(self):
-            try:
-                if self.parent.config.verbose:
-                    statusUpdate("Deleting", self.path, "asynchronously")
-                self.parent._deleteDirectories(self.path)
-                if self.parent.config.verbose:
-                    statusUpdate("Async delete of", self.path, "finished")
-            except Exception as e:
-                warningMessage("Could not remove directory", self.path, e)
-
     def asyncCleanDirectory(self, path: Path, *, keepRoot=False, keep_dirs: list=None) -> ThreadJoiner:
         """
         Delete a directory in the background (e.g. deleting the cheribsd build directory delays the build
@@ -92,7 +99,7 @@ class FileSystemUtils(object):
         :return:
         """
         deleterThread = None
-        tempdir = path.with_suffix(".delete-me-pls")
+        tempdir = Path(deletion_temp_path(path))
         if not path.is_dir():
             self.makedirs(path)
         elif len(list(path.iterdir())) == 0:
@@ -118,18 +125,25 @@ class FileSystemUtils(object):
                     all_entries = all_entries_new
                 all_entries = list(map(str, all_entries))
                 if all_entries:
-                    runCmd(["mv"] + all_entries + [tempdir], printVerboseOnly=True)
+                    printCommand(["mv"] + all_entries + [tempdir], printVerboseOnly=True)
+                    if not self.config.pretend:
+                        invalidate_cached_metadata(path, tempdir)
+                        for entry in all_entries:
+                            os.rename(entry, str(tempdir / os.path.basename(entry)))
             else:
                 # rename the directory, create a new dir and then delete it in a background thread
-                runCmd("mv", path, tempdir)
+                printCommand("mv", path, tempdir)
+                if not self.config.pretend:
+                    invalidate_cached_metadata(path, tempdir)
+                    os.rename(str(path), str(tempdir))
                 self.makedirs(path)
         if not self.config.pretend:
             assert path.is_dir()
             if not (keep_dirs and keepRoot):
                 assert len(list(path.iterdir())) == 0, list(path.iterdir())
         if tempdir.is_dir() or self.config.pretend:
-            # we now have an empty directory, start background deleter and return to caller
-            deleterThread = FileSystemUtils.DeleterThread(self, tempdir)
+            # we now have an empty directory, let the deletion service remove tempdir and return to caller
+            deleterThread = self.config.deletion_service.job(tempdir, self._delete_directories_in_background)
         return ThreadJoiner(deleterThread)
 
     def deleteFile(self, file: Path, printVerboseOnly=False):
@@ -138,11 +152,12 @@ class FileSystemUtils(object):
         printCommand("rm", "-f", file, printVerboseOnly=printVerboseOnly)
         if self.config.pretend:
             return
+        invalidate_cached_metadata(file)
         file.unlink()
 
     def copyRemoteFile(self, remotePath: str, targetFile: Path):
         # if we have rsync we can skip the copy if file is already up-to-date
-        if shutil.which("rsync"):
+        if cached_which("rsync"):
             try:
                 runCmd("rsync", "-aviu", "--progress", remotePath, targetFile)
             except subprocess.CalledProcessError as err:
@@ -176,6 +191,7 @@ class FileSystemUtils(object):
         if not overwrite and file.exists():
             fatalError("File", file, "already exists!")
         self.makedirs(file.parent)
+        invalidate_cached_metadata(file)
         with file.open("w", encoding="utf-8") as f:
             f.write(contents)
         if mode:
@@ -190,17 +206,63 @@ class FileSystemUtils(object):
                 src = os.path.relpath(str(src), str(dest.parent if dest.is_absolute() else cwd))
             if cwd is not None and cwd.is_dir():
                 dest = dest.relative_to(cwd)
-            runCmd("ln", "-fsn", src, dest, cwd=cwd, printVerboseOnly=True)
-        else:
-            runCmd("ln", "-fsn", src, dest, cwd=cwd, printVerboseOnly=True)
+        self.create_symlinks([(src, dest)], cwd=cwd)
 
-    def moveFile(self, src: Path, dest: Path, force=False, createDirs=True):
-        if not src.exists():
-            fatalError(src, "doesn't exist")
+    @staticmethod
+    def _replace_with_symlink(target: str, link: str):
+        if os.path.isdir(link) and not os.path.islink(link):
+            # Same as ln: create the symlink inside existing directories
+            link = os.path.join(link, os.path.basename(target))
+        # Create the symlink with a temporary name first so that link always exists (e.g. for concurrent builds
+        # that use the SDK) and is replaced atomically
+        tmp = os.path.join(os.path.dirname(link), "." + os.path.basename(link) + ".tmp-" + str(os.getpid()) + "-" +
+                           str(threading.get_ident()))
+        os.symlink(target, tmp)
+        try:
+            os.replace(tmp, link)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def create_symlinks(links: "typing.Iterable[typing.Tuple[typing.Union[str, Path], typing.Union[str, Path]]]", *,
+                        cwd: Path = None, printVerboseOnly=True):
+        """
+        Create or replace all the (target, link) symlinks without starting any processes (same as running
+        `ln -fsn target link` in cwd for every pair)
+        :param cwd: the directory that relative link paths are resolved against
+        """
+        config = get_global_config()
+        for target, link in links:
+            printCommand("ln", "-fsn", target, link, cwd=cwd, printVerboseOnly=printVerboseOnly)
+            if config.pretend:
+                continue
+            link_path = os.path.join(str(cwd), str(link)) if cwd is not None else str(link)
+            invalidate_cached_metadata(link_path)
+            try:
+                FileSystemUtils._replace_with_symlink(str(target), link_path)
+            except OSError as e:
+                fatalError("Could not create symlink", link_path, "->", target, ":", e)
+
+    def moveFile(self, src: Path, dest: Path, force=False, createDirs=True, printVerboseOnly=False):
         cmd = ["mv", "-f"] if force else ["mv"]
+        printCommand(cmd + [src, dest], printVerboseOnly=printVerboseOnly)
+        if self.config.pretend:
+            return
+        if not src.exists() and not src.is_symlink():
+            fatalError(src, "doesn't exist")
         if createDirs and not dest.parent.exists():
             self.makedirs(dest.parent)
-        runCmd(cmd + [src, dest])
+        if dest.is_dir() and not dest.is_symlink():
+            dest = dest / src.name
+        invalidate_cached_metadata(src, dest)
+        try:
+            os.replace(str(src), str(dest))
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # rename() doesn't work across file systems -> copy and delete
+            shutil.move(str(src), str(dest))
 
     def installFile(self, src: Path, dest: Path, *, force=False, createDirs=True, printVerboseOnly=True):
         if force:
@@ -209,16 +271,18 @@ class FileSystemUtils(object):
             printCommand("cp", src, dest, printVerboseOnly=printVerboseOnly)
         if self.config.pretend:
             return
+        invalidate_cached_metadata(dest)
         if (dest.is_symlink() or dest.exists()) and force:
             dest.unlink()
         if not src.exists():
             fatalError("Required file", src, "does not exist")
         if createDirs and not dest.parent.exists():
             self.makedirs(dest.parent)
-        if dest.is_symlink():
-            dest.unlink()
-        # noinspection PyArgumentList
-        shutil.copy(str(src), str(dest), follow_symlinks=False)
+        if dest.is_dir() and not dest.is_symlink():
+            dest = dest / src.name
+            invalidate_cached_metadata(dest)
+        # uses reflinks or copy_file_range() if possible (a lot faster for large files such as disk images)
+        copy_file(src, dest)
 
     @staticmethod
     def createBuildtoolTargetSymlinks(tool: Path, toolName: str = None, createUnprefixedLink: bool = False,
@@ -240,9 +304,10 @@ class FileSystemUtils(object):
             fatalError("Attempting to create symlink to non-existent build tool:", tool)
 
         # a prefixed tool was installed -> create link such as mips4-unknown-freebsd-ld -> ld
+        links = []
         if createUnprefixedLink:
             assert tool.name != toolName
-            runCmd("ln", "-fsn", tool.name, toolName, cwd=cwd, printVerboseOnly=True)
+            links.append((tool.name, toolName))
 
         for target in ("mips4-unknown-freebsd-", "cheri-unknown-freebsd-", "mips64-unknown-freebsd-"):
             link = tool.parent / (target + toolName)  # type: Path
@@ -250,4 +315,5 @@ class FileSystemUtils(object):
                 # if self.config.verbose:
                 #    print(coloured(AnsiColour.yellow, "Not overwriting", link, "because it is the target"))
                 continue
-            runCmd("ln", "-fsn", tool.name, target + toolName, cwd=cwd, printVerboseOnly=True)
+            links.append((tool.name, target + toolName))
+        FileSystemUtils.create_symlinks(links, cwd=cwd)
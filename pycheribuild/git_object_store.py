@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import hashlib
+import re
+from pathlib import Path
+
+from .utils import *
+
+__all__ = ["GitObjectStore"]  # no-combine
+
+
+class GitObjectStore(object):
+    """
+    A single bare repository that contains the objects of all repositories cloned by cheribuild. Every remote URL
+    is added as a separate remote so that related repositories (e.g. cheribsd and freebsd or the different LLVM
+    forks) share their common history. New clones use the store with --reference (i.e. git alternates) so that
+    only objects missing from the store are downloaded and stored in the clone.
+
+    Note: Since clones depend on the objects in the store, unreachable objects must never be pruned from it. We
+    therefore set gc.auto=0 and only repack with --keep-unreachable.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+
+    @staticmethod
+    def remote_name(url: str) -> str:
+        readable = re.sub(r"[^A-Za-z0-9]+", "-", re.sub(r"^[a-z+]+://", "", url)).strip("-")[-40:]
+        return readable + "-" + hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
+
+    def _git(self, *args, **kwargs):
+        return runCmd(("git", "--git-dir", self.path) + args, printVerboseOnly=True, **kwargs)
+
+    def exists(self) -> bool:
+        return (self.path / "objects").is_dir()
+
+    def ensure_exists(self):
+        if self.exists():
+            return
+        runCmd("git", "init", "--bare", "--quiet", self.path)
+        # Clones use the objects via alternates -> an automatic gc must never prune anything
+        self._git("config", "gc.auto", "0")
+        self._git("config", "gc.pruneExpire", "never")
+
+    def remotes(self) -> "typing.Dict[str, str]":
+        """:return: a dict mapping the remote names to their URLs"""
+        if not self.exists():
+            return dict()
+        output = self._git("remote", "-v", captureOutput=True, runInPretendMode=True, no_print=True)
+        result = dict()
+        for line in output.stdout.decode("utf-8").splitlines():
+            name, url, kind = line.rsplit(None, 2)
+            if kind == "(fetch)":
+                result[name] = url
+        return result
+
+    def add_remote(self, url: str) -> str:
+        self.ensure_exists()
+        name = self.remote_name(url)
+        if name not in self.remotes():
+            self._git("remote", "add", name, url)
+            # Don't fetch tags, they would clash between the different remotes
+            self._git("config", "remote." + name + ".tagOpt", "--no-tags")
+        return name
+
+    def fetch(self, url: str):
+        """Add url as a remote (if needed) and fetch all its branches into the store"""
+        name = self.add_remote(url)
+        statusUpdate("Fetching", url, "into shared git object store", self.path)
+        # never pass --prune: other clones may still refer to objects from deleted branches
+        self._git("fetch", "--quiet", name)
+
+    def clone_args(self) -> "typing.List[str]":
+        """:return: the arguments to pass to git clone to borrow objects from this store"""
+        return ["--reference", str(self.path)]
+
+    def is_used_by(self, repo: Path) -> bool:
+        """:return: True if repo borrows objects from this store (i.e. has it in objects/info/alternates)"""
+        alternates = repo / ".git/objects/info/alternates"
+        if not alternates.is_file():
+            return False
+        store_objects = str((self.path / "objects").resolve())
+        for line in alternates.read_text(encoding="utf-8").splitlines():
+            if line and str(Path(line).resolve()) == store_objects:
+                return True
+        return False
+
+    def maintenance(self):
+        """Fetch all remotes and repack the store into a single pack (without pruning unreachable objects)"""
+        if not self.exists():
+            statusUpdate("Shared git object store", self.path, "does not exist yet, nothing to do")
+            return
+        for name, url in sorted(self.remotes().items()):
+            statusUpdate("Fetching", url, "into shared git object store")
+            self._git("fetch", "--quiet", name)
+        statusUpdate("Repacking shared git object store", self.path)
+        self._git("repack", "-a", "-d", "--keep-unreachable", "--quiet")
+        self._git("prune-packed", "--quiet")
+        self._git("pack-refs", "--all")
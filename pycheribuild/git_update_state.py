@@ -0,0 +1,91 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import json
+import os
+import threading
+from pathlib import Path
+
+from .utils import *
+
+__all__ = ["GitUpdateState"]  # no-combine
+
+
+class GitUpdateState(object):
+    """
+    The state of the git update fast path (see Project._updateGitRepo()) for one cheribuild invocation: the branches
+    of every remote URL (so that git ls-remote only runs once per URL), the number of repositories that did not need
+    an update and the duration of the last full update of every repository. The durations are stored in
+    <build-root>/.cheribuild-git-updates.json and not in the repositories since they are only used for the summary.
+    """
+    def __init__(self, build_root: Path, *, pretend=False):
+        self.durations_file = build_root / ".cheribuild-git-updates.json"
+        self.pretend = pretend
+        self.remote_heads = dict()  # type: typing.Dict[str, typing.Dict[str, str]]
+        self.checked = 0
+        self.skipped = 0
+        self.time_saved = 0.0
+        self._lock = threading.Lock()
+
+    def _load_durations(self) -> "typing.Dict[str, float]":
+        try:
+            with self.durations_file.open("r", encoding="utf-8") as f:
+                result = json.load(f)
+            return result if isinstance(result, dict) else dict()
+        except (OSError, ValueError):
+            return dict()
+
+    def last_update_duration(self, source_dir: Path) -> float:
+        """:return: the time the last full update of source_dir took (0 if it is not known)"""
+        value = self._load_durations().get(str(source_dir), 0.0)
+        return float(value) if isinstance(value, (int, float)) else 0.0
+
+    def record_update_duration(self, source_dir: Path, duration: float):
+        if self.pretend:
+            return
+        with self._lock:
+            durations = self._load_durations()
+            durations[str(source_dir)] = round(duration, 2)
+            self.durations_file.parent.mkdir(parents=True, exist_ok=True)
+            tmpfile = self.durations_file.with_name(self.durations_file.name + "." + str(os.getpid()))
+            with tmpfile.open("w", encoding="utf-8") as f:
+                json.dump(durations, f, sort_keys=True, indent=4)
+            os.replace(str(tmpfile), str(self.durations_file))
+
+    def record_skipped_update(self, source_dir: Path, duration: float):
+        """Called when source_dir was not updated since the check showed that there are no upstream changes"""
+        self.skipped += 1
+        self.time_saved += max(0.0, self.last_update_duration(source_dir) - duration)
+
+    def print_summary(self):
+        # The upstream check is skipped with --pretend so every repository would be reported as updated
+        if not self.checked or self.pretend:
+            return
+        statusUpdate("Skipped updating", self.skipped, "of", self.checked, "git repositories without upstream "
+                     "changes (saved about %.1f seconds)" % self.time_saved)
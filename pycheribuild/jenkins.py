@@ -36,6 +36,7 @@ import pprint
 
 from pathlib import Path
 
+from .archive import create_archive, archive_command, archive_compression_for_name
 from .config.loader import ConfigLoaderBase, CommandLineConfigOption
 from .config.jenkinsconfig import JenkinsConfig, CrossCompileTarget, JenkinsAction
 from .projects.project import SimpleProject, Project
@@ -260,12 +261,17 @@ def _jenkins_main():
             target.execute(cheriConfig)
 
     if JenkinsAction.CREATE_TARBALL in cheriConfig.action:
-        if IS_LINUX:
-            owner_flags = ["--owner=0", "--group=0", "--numeric-owner"]
-        else:
-            owner_flags = ["--uid=0", "--gid=0", "--numeric-owner"]
         statusUpdate("Creating tarball", cheriConfig.tarball_name)
-        runCmd(["tar", "--create", "--xz"] + owner_flags + ["-f", cheriConfig.tarball_name, "-C", "tarball", "."])
+        compression = archive_compression_for_name(cheriConfig.tarball_name) or "xz"
+        if cheriConfig.pretend:
+            printCommand(archive_command(Path(cheriConfig.tarball_name).absolute(), Path("tarball").absolute(),
+                                         arcname=".", compression=compression))
+        else:
+            stats = create_archive(Path(cheriConfig.tarball_name).absolute(), Path("tarball").absolute(), arcname=".",
+                                   compression=compression)
+            statusUpdate("Compressed", stats["uncompressed_size"] // (1024 * 1024), "MiB to",
+                         stats["compressed_size"] // (1024 * 1024), "MiB using", stats["compressor"], "in",
+                         "{:.2f}s".format(stats["time"]))
 
 
 def jenkins_main():
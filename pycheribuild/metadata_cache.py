@@ -0,0 +1,163 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import os
+import shutil
+import stat
+import threading
+from collections import Counter
+
+__all__ = ["metadata_cache", "cached_stat", "cached_exists", "cached_is_dir", "cached_is_file",  # no-combine
+           "cached_listdir", "cached_which", "invalidate_cached_metadata"]  # no-combine
+
+
+class FileSystemMetadataCache(object):
+    """
+    Caches stat(), listdir() and which() results for the duration of one cheribuild invocation. Project constructors
+    and the planning phase check the same paths and look up the same programs over and over again (which is slow on
+    NFS home directories).
+
+    FileSystemUtils invalidates the paths that it modifies and runCmd() drops the whole cache after running a command
+    since that could have changed anything. In pretend mode nothing is modified so the cache is never invalidated.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stat = dict()  # path -> os.stat_result or None if it doesn't exist
+        self._listdir = dict()  # path -> frozenset of names or None if it is not a directory
+        self._which = dict()  # (program, $PATH) -> absolute path or None
+        self.statistics = Counter()
+
+    @staticmethod
+    def _key(path) -> str:
+        path = str(path)
+        return path if os.path.isabs(path) else os.path.abspath(path)
+
+    def _lookup(self, cache: dict, key, compute):
+        with self._lock:
+            if key in cache:
+                self.statistics["hits"] += 1
+                return cache[key]
+            self.statistics["misses"] += 1
+        result = compute()
+        with self._lock:
+            cache[key] = result
+        return result
+
+    def stat(self, path: "typing.Union[str, os.PathLike]") -> "typing.Optional[os.stat_result]":
+        """:return: the result of stat() (following symlinks) or None if path does not exist"""
+        def do_stat():
+            try:
+                return os.stat(key)
+            except (OSError, ValueError):
+                return None
+        key = self._key(path)
+        return self._lookup(self._stat, key, do_stat)
+
+    def exists(self, path) -> bool:
+        return self.stat(path) is not None
+
+    def is_dir(self, path) -> bool:
+        st = self.stat(path)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def is_file(self, path) -> bool:
+        st = self.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def listdir(self, path) -> "typing.Optional[typing.List[str]]":
+        """:return: the sorted names of all entries in path or None if it is not a directory"""
+        key = self._key(path)
+        result = self._lookup(self._listdir, key, lambda: self._listdir_or_none(key))
+        return None if result is None else sorted(result)
+
+    def which(self, program: "typing.Union[str, os.PathLike]") -> "typing.Optional[str]":
+        """
+        Same as shutil.which(program) but instead of checking every $PATH entry for every program this lists each
+        $PATH directory once (most lookups during planning are for programs that are not installed)
+        """
+        program = str(program)
+        path = os.getenv("PATH", os.defpath)
+        return self._lookup(self._which, (program, path), lambda: self._which_uncached(program, path))
+
+    def _which_uncached(self, program: str, path: str) -> "typing.Optional[str]":
+        if os.path.dirname(program):
+            return shutil.which(program)
+        for directory in path.split(os.pathsep):
+            entries = self._lookup(self._listdir, self._key(directory or os.curdir),
+                                   lambda: self._listdir_or_none(directory or os.curdir))
+            if entries is None or program not in entries:
+                continue
+            candidate = os.path.join(directory, program)
+            if os.access(candidate, os.X_OK) and not os.path.isdir(candidate):
+                return candidate
+        return None
+
+    @staticmethod
+    def _listdir_or_none(path: str) -> "typing.Optional[typing.FrozenSet[str]]":
+        try:
+            return frozenset(os.listdir(path))
+        except OSError:
+            return None
+
+    def invalidate(self, *paths):
+        """Forget everything about paths, the files below them and their parent directories"""
+        with self._lock:
+            self.statistics["invalidations"] += 1
+            # Creating or deleting a program can change the result of which() for any program name
+            self._which.clear()
+            for path in paths:
+                key = self._key(path)
+                prefix = key.rstrip("/") + "/"
+                # Also forget the parent directories (their contents changed and makedirs() might have created them)
+                parents = []
+                parent = os.path.dirname(key)
+                while parent not in parents and parent != key:
+                    parents.append(parent)
+                    parent = os.path.dirname(parent)
+                for cache in (self._stat, self._listdir):
+                    for k in [k for k in cache if k == key or k.startswith(prefix)] + parents:
+                        cache.pop(k, None)
+
+    def clear(self):
+        with self._lock:
+            self.statistics["clears"] += 1
+            self._stat.clear()
+            self._listdir.clear()
+            self._which.clear()
+
+
+metadata_cache = FileSystemMetadataCache()
+cached_stat = metadata_cache.stat
+cached_exists = metadata_cache.exists
+cached_is_dir = metadata_cache.is_dir
+cached_is_file = metadata_cache.is_file
+cached_listdir = metadata_cache.listdir
+cached_which = metadata_cache.which
+invalidate_cached_metadata = metadata_cache.invalidate
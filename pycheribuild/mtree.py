@@ -29,18 +29,181 @@
 #
 
 from .utils import *
+from .file_digests import FileDigestCache, compute_file_digests
 from pathlib import Path
 from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+import array
+import hashlib
+import mmap
 import os
+import re
 import shlex
 import stat
+import struct
 import sys
 
+# Separators used by mtree(5) (and shlex) -- str.split() would also split on non-ASCII whitespace such as U+00A0
+_MTREE_FIELD_RE = re.compile(r"[^ \t\r\n]+")
+_MTREE_ESCAPED_FIELD_RE = re.compile(r"(?:[^ \t\r\n\\]|\\.)+|\\$", re.DOTALL)
+_MTREE_ESCAPE_RE = re.compile(br"\\([0-7]{3}|.)", re.DOTALL)
+# Characters that must be written as \ooo octal escapes (whitespace, control and non-ASCII characters, \ and #)
+_MTREE_NEEDS_ESCAPE_RE = re.compile(r"[^\x21-\x7e]|[\\#]")
+
+
+def _mtree_unescape_char(match) -> bytes:
+    escaped = match.group(1)
+    if len(escaped) == 3:
+        return bytes((int(escaped, 8) & 0xff,))
+    return escaped
+
+
+def mtree_split(line: str) -> "typing.List[str]":
+    """
+    Split a line of an mtree file into fields and decode the escape sequences (\\ooo octal escapes as written by
+    mtree/vis(3) and backslash followed by any other character, e.g. "\\ "). This is a lot faster than shlex.split()
+    and handles octal escapes correctly.
+    """
+    if "'" in line or '"' in line:
+        return shlex.split(line)  # quotes are not part of mtree(5) but we used to accept them
+    if "\\" not in line:
+        return _MTREE_FIELD_RE.findall(line)
+    result = []
+    for field in _MTREE_ESCAPED_FIELD_RE.findall(line):
+        if field == "\\":
+            raise ValueError("No escaped character")
+        # Octal escapes are bytes (e.g. UTF-8 encoded file names) -> decode the whole field afterwards
+        raw = _MTREE_ESCAPE_RE.sub(_mtree_unescape_char, field.encode("utf-8", errors="surrogateescape"))
+        result.append(raw.decode("utf-8", errors="surrogateescape"))
+    return result
+
+
+def mtree_escape(value: str) -> str:
+    """The inverse of the decoding done by mtree_split(): encode special characters like vis(3) with VIS_OCTAL"""
+    if not _MTREE_NEEDS_ESCAPE_RE.search(value):
+        return value
+    result = []
+    for c in value.encode("utf-8", errors="surrogateescape"):
+        if c < 0x21 or c > 0x7e or c in b"\\#":
+            result.append("\\{:03o}".format(c))
+        else:
+            result.append(chr(c))
+    return "".join(result)
+
+
+# Almost all entries start with these attributes and share the values (type=file uname=root gname=wheel mode=0444)
+_MTREE_COMMON_KEYS = ("type", "uname", "gname", "mode")
+_mtree_common_values = dict()  # type: typing.Dict[typing.Tuple[str, ...], typing.Tuple[str, ...]]
+_MTREE_IGNORED_KEYS = frozenset(("tags", "time"))
+# Plain dicts preserve insertion order since Python 3.7 and use less memory than an OrderedDict
+_MtreeDict = dict if sys.version_info >= (3, 7) else OrderedDict
+
+
+def _shared_common_values(values: "typing.Tuple[str, ...]") -> "typing.Tuple[str, ...]":
+    result = _mtree_common_values.get(values)
+    if result is None:
+        result = _mtree_common_values.setdefault(values, tuple(sys.intern(v) for v in values))
+    return result
+
+
+class MtreeAttributes(MutableMapping):
+    """
+    Ordered view of the attributes of an MtreeEntry. Changes are written back to the entry.
+    """
+    __slots__ = ("_entry",)
+
+    def __init__(self, entry: "MtreeEntry"):
+        self._entry = entry
+
+    def __getitem__(self, key: str) -> str:
+        entry = self._entry
+        common = entry._common
+        for i, value in enumerate(common):
+            if _MTREE_COMMON_KEYS[i] == key:
+                return value
+        for k, v in entry._extra:
+            if k == key:
+                return v
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        # Avoid the exception in MutableMapping.get() since this is called for every entry
+        entry = self._entry
+        try:
+            i = _MTREE_COMMON_KEYS.index(key)
+            if i < len(entry._common):
+                return entry._common[i]
+        except ValueError:
+            pass
+        for k, v in entry._extra:
+            if k == key:
+                return v
+        return default
+
+    def __iter__(self):
+        return iter(k for k, _ in self.items())
+
+    def __len__(self):
+        return len(self._entry._common) + len(self._entry._extra)
+
+    def items(self):
+        entry = self._entry
+        return list(zip(_MTREE_COMMON_KEYS, entry._common)) + list(entry._extra)
+
+    def __setitem__(self, key: str, value: str):
+        pairs = self.items()
+        for i, (k, _) in enumerate(pairs):
+            if k == key:
+                pairs[i] = (k, value)
+                break
+        else:
+            pairs.append((key, value))
+        self._entry._set_attributes(pairs)
+
+    def __delitem__(self, key: str):
+        pairs = self.items()
+        remaining = [(k, v) for k, v in pairs if k != key]
+        if len(remaining) == len(pairs):
+            raise KeyError(key)
+        self._entry._set_attributes(remaining)
+
+    def __eq__(self, other):
+        if isinstance(other, Mapping):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return "MtreeAttributes(" + repr(OrderedDict(self.items())) + ")"
+
 
 class MtreeEntry(object):
+    # A METALOG can have hundreds of thousands of entries -> avoid a __dict__ and a dict of attributes per entry.
+    # The leading type/uname/gname/mode attributes are stored as a shared tuple and the remaining ones (e.g.
+    # contents=, link=, size=) as a tuple of (key, value) pairs.
+    __slots__ = ("path", "_common", "_extra")
+
     def __init__(self, path: str, attributes: "typing.Dict[str, str]"):
         self.path = path
-        self.attributes = attributes
+        self._set_attributes(attributes.items())
+
+    def _set_attributes(self, pairs: "typing.Iterable[typing.Tuple[str, str]]"):
+        common = []
+        extra = []
+        for k, v in pairs:
+            if not extra and len(common) < len(_MTREE_COMMON_KEYS) and k == _MTREE_COMMON_KEYS[len(common)]:
+                common.append(v)
+            else:
+                extra.append((sys.intern(k), v))
+        self._common = _shared_common_values(tuple(common))
+        self._extra = tuple(extra)
+
+    @property
+    def attributes(self) -> "MtreeAttributes":
+        return MtreeAttributes(self)
+
+    @attributes.setter
+    def attributes(self, value: "typing.Dict[str, str]"):
+        self._set_attributes(value.items())
 
     def is_dir(self):
         return self.attributes.get("type") == "dir"
@@ -50,7 +213,7 @@ class MtreeEntry(object):
 
     @classmethod
     def parse(cls, line: str, contents_root: Path=None) -> "MtreeEntry":
-        elements = shlex.split(line)
+        elements = mtree_split(line)
         path = elements[0]
         # Ensure that the path is normalized:
         if path != ".":
@@ -58,26 +221,29 @@ class MtreeEntry(object):
             assert path[:2] == "./"
             path = path[:2] + os.path.normpath(path[2:])
             # print("After:", path)
-        attrDict = OrderedDict()  # keep them in insertion order
-        for k,v in map(lambda s: s.split(sep="=", maxsplit=1), elements[1:]):
+        attributes = []  # keep them in insertion order
+        for k, v in map(lambda s: s.split(sep="=", maxsplit=1), elements[1:]):
             # ignore some tags that makefs doesn't like
             # sometimes there will be time with nanoseconds in the manifest, makefs can't handle that
             # also the tags= key is not supported
-            if k in ("tags", "time"):
+            if k in _MTREE_IGNORED_KEYS:
                 continue
             # convert relative contents=keys to absolute ones
             if contents_root and k == "contents":
                 if not os.path.isabs(v):
                     v = str(contents_root / v)
-            attrDict[k] = v
-        return MtreeEntry(path, attrDict)
+            attributes.append((k, v))
+        result = cls.__new__(cls)
+        result.path = path
+        result._set_attributes(attributes)
+        return result
         # FIXME: use contents=
 
     @classmethod
     def parseAllDirsInMtree(cls, mtreeFile: Path) -> "typing.List[MtreeEntry]":
         with mtreeFile.open("r", encoding="utf-8") as f:
             result = []
-            for line in f.readlines():
+            for line in f:
                 if " type=dir" in line:
                     try:
                         result.append(MtreeEntry.parse(line))
@@ -86,38 +252,144 @@ class MtreeEntry(object):
             return result
 
     def __str__(self):
-        return self.path + " " + " ".join(k + "=" + v for k, v in self.attributes.items())
+        attributes = [k + "=" + v for k, v in zip(_MTREE_COMMON_KEYS, self._common)]
+        attributes.extend(k + "=" + (mtree_escape(v) if k in ("link", "contents") else v) for k, v in self._extra)
+        return mtree_escape(self.path) + " " + " ".join(attributes)
 
     def __repr__(self):
         return "<MTREE entry: " + str(self) + ">"
 
+    def __eq__(self, other):
+        if not isinstance(other, MtreeEntry):
+            return NotImplemented
+        return self.path == other.path and self._common == other._common and self._extra == other._extra
+
+    def __hash__(self):
+        return hash((self.path, self._common, self._extra))
+
+
+class MtreeDiff(object):
+    """
+    The differences between two mtree files: entries that were added, removed or changed. Changed entries are
+    stored as (old, new, names of the changed attributes).
+    """
+    # contents= only says where makefs should read the file from (which differs between two rootfs directories)
+    IGNORED_ATTRIBUTES = frozenset(("contents",))
+    # The categories used for the summary (all digest keywords are treated as "digest")
+    CATEGORIES = ("type", "mode", "size", "digest", "link", "owner", "other")
+    _DIGEST_KEYWORDS = frozenset(("cksum", "md5", "md5digest", "sha1", "sha1digest", "sha256", "sha256digest",
+                                  "sha384", "sha384digest", "sha512", "sha512digest", "rmd160", "rmd160digest",
+                                  "ripemd160digest"))
+
+    def __init__(self):
+        self.added = []  # type: typing.List[MtreeEntry]
+        self.removed = []  # type: typing.List[MtreeEntry]
+        self.changed = []  # type: typing.List[typing.Tuple[MtreeEntry, MtreeEntry, typing.List[str]]]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    @classmethod
+    def changed_attributes(cls, old: MtreeEntry, new: MtreeEntry) -> "typing.List[str]":
+        if old._common == new._common and old._extra == new._extra:
+            return []  # fast path (the common attributes tuples are shared)
+        old_attributes = dict(old.attributes.items())
+        new_attributes = dict(new.attributes.items())
+        result = []
+        for key in sorted(set(old_attributes) | set(new_attributes)):
+            if key not in cls.IGNORED_ATTRIBUTES and old_attributes.get(key) != new_attributes.get(key):
+                result.append(key)
+        return result
+
+    @classmethod
+    def category(cls, attribute: str) -> str:
+        if attribute in cls._DIGEST_KEYWORDS:
+            return "digest"
+        if attribute in ("uname", "gname", "uid", "gid"):
+            return "owner"
+        if attribute in cls.CATEGORIES:
+            return attribute
+        return "other"
+
+    def categories(self) -> "typing.Dict[str, int]":
+        """The number of changed entries for each category (an entry can be counted in more than one)"""
+        result = OrderedDict((c, 0) for c in self.CATEGORIES)
+        for _, _, attributes in self.changed:
+            for category in set(map(self.category, attributes)):
+                result[category] += 1
+        return result
+
+    @staticmethod
+    def _describe(entry: MtreeEntry) -> str:
+        kind = entry.attributes.get("type", "unknown type")
+        if kind == "link":
+            return entry.path + " (link to " + entry.attributes.get("link", "?") + ")"
+        return entry.path + " (" + kind + ")"
+
+    def summary(self, max_entries=None) -> "typing.List[str]":
+        lines = ["{} added, {} removed, {} changed".format(len(self.added), len(self.removed), len(self.changed))]
+        categories = ", ".join(k + ": " + str(v) for k, v in self.categories().items() if v)
+        if categories:
+            lines[0] += " (" + categories + ")"
+        details = ["+ " + self._describe(e) for e in self.added]
+        details.extend("- " + self._describe(e) for e in self.removed)
+        for old, new, attributes in self.changed:
+            changes = []
+            for attribute in attributes:
+                if self.category(attribute) == "digest":
+                    changes.append(attribute + " changed")
+                else:
+                    changes.append("{} {} -> {}".format(attribute, old.attributes.get(attribute, "<unset>"),
+                                                        new.attributes.get(attribute, "<unset>")))
+            details.append("M " + new.path + ": " + ", ".join(changes))
+        if max_entries is not None and len(details) > max_entries:
+            details = details[:max_entries] + ["... and {} more".format(len(details) - max_entries)]
+        return lines + details
+
 
 class MtreeFile(object):
     def __init__(self, file: "typing.Union[io.StringIO,Path,typing.IO]"=None, contents_root: Path=None):
-        self._mtree = OrderedDict()  # type: typing.Dict[str, MtreeEntry]
+        self._mtree = _MtreeDict()  # type: typing.Dict[str, MtreeEntry]
+        # The keys of _mtree in sorted order plus the keys that were added since the last write() (which are then
+        # merged into _sorted_paths instead of sorting all keys again)
+        self._sorted_paths = []  # type: typing.List[str]
+        self._unsorted_paths = []  # type: typing.List[str]
         if file:
             self.load(file, contents_root)
 
     def load(self, file: "typing.Union[io.StringIO,Path,typing.IO]", contents_root: Path=None):
+        self._mtree.clear()
+        self._sorted_paths = []
+        self._unsorted_paths = []
+        for entry in self.iter_entries(file, contents_root):
+            key = entry.path
+            assert key == "." or os.path.normpath(key[2:]) == key[2:]
+            if key in self._mtree:
+                warningMessage("Found duplicate definition for", entry.path)
+            self._add_entry(key, entry)
+
+    @staticmethod
+    def iter_entries(file: "typing.Union[io.StringIO,Path,typing.IO]",
+                     contents_root: Path=None) -> "typing.Iterator[MtreeEntry]":
+        """Parse the entries of an mtree file one line at a time without keeping the whole file in memory"""
         if isinstance(file, Path):
             with file.open("r") as f:
-                self.load(f)
+                yield from MtreeFile.iter_entries(f, contents_root)
                 return
-        self._mtree.clear()
-        for line in file.readlines():
+        for line in file:
             line = line.strip()
             if not line or line.startswith("#"):
                 continue
             try:
-                entry = MtreeEntry.parse(line, contents_root)
-                key = str(entry.path)
-                assert key == "." or os.path.normpath(key[2:]) == key[2:]
-                if key in self._mtree:
-                    warningMessage("Found duplicate definition for", entry.path)
-                self._mtree[key] = entry
+                yield MtreeEntry.parse(line, contents_root)
             except Exception as e:
                 warningMessage("Could not parse line", line, "in mtree file", file, ":", e)
 
+    def _add_entry(self, mtree_path: str, entry: MtreeEntry):
+        if mtree_path not in self._mtree:
+            self._unsorted_paths.append(mtree_path)
+        self._mtree[mtree_path] = entry
+
     @staticmethod
     def _ensure_mtree_mode_fmt(mode: "typing.Union[str, int]") -> str:
         if not isinstance(mode, str):
@@ -130,16 +402,20 @@ class MtreeFile(object):
         # The path in mtree always starts with ./
         assert not path.endswith("/")
         assert path, "PATH WAS EMPTY?"
-        mtree_path = path
-        if mtree_path != ".":
-            # ensure we normalize paths to avoid conflicting duplicates:
-            mtree_path = "./" + os.path.normpath(path)
-        return mtree_path
+        if path == ".":
+            return path
+        # ensure we normalize paths to avoid conflicting duplicates (but only call normpath() if it could change
+        # the path since this is called for every file that is added to the image):
+        if "//" in path or "/." in path or path[0] == ".":
+            return "./" + os.path.normpath(path)
+        return "./" + path
 
     @staticmethod
-    def infer_mode_string(path: Path, should_be_dir):
+    def infer_mode_string(path: Path, should_be_dir, st: os.stat_result=None):
         try:
-            result = "0{0:o}".format(stat.S_IMODE(path.lstat().st_mode))  # format as octal with leading 0 prefix
+            if st is None:
+                st = path.lstat()
+            result = "0{0:o}".format(stat.S_IMODE(st.st_mode))  # format as octal with leading 0 prefix
         except IOError as e:
             default = "0755" if should_be_dir else "0644"
             warningMessage("Failed to stat", path, "assuming mode",  default, e)
@@ -154,19 +430,26 @@ class MtreeFile(object):
         return result
 
     def add_file(self, file: Path, path_in_image, mode=None, uname="root", gname="wheel", print_status=True,
-                 parent_dir_mode=None):
+                 parent_dir_mode=None, st: os.stat_result=None):
         if isinstance(path_in_image, Path):
             path_in_image = str(path_in_image)
         assert not path_in_image.startswith("/")
         assert not path_in_image.startswith("./") and not path_in_image.startswith("..")
+        if st is None:
+            try:
+                st = file.lstat()
+            except OSError:
+                pass  # infer_mode_string() will warn about this
         if mode is None:
-            mode = self.infer_mode_string(file, False)
+            mode = self.infer_mode_string(file, False, st)
         mode = self._ensure_mtree_mode_fmt(mode)
         mtree_path = self._ensure_mtree_path_fmt(path_in_image)
         assert mtree_path != ".", "files should not have name ."
-        self.add_dir(str(Path(path_in_image).parent), mode=parent_dir_mode, uname=uname, gname=gname,
-                     reference_dir=file.parent, print_status=print_status)
-        if file.is_symlink():
+        parent = mtree_path.rpartition("/")[0]
+        if parent not in self._mtree:
+            self._add_dirs(parent, parent_dir_mode, uname, gname, print_status=print_status,
+                           reference_dir=file.parent)
+        if st is not None and stat.S_ISLNK(st.st_mode):
             mtree_type = "link"
             last_attrib = ("link", os.readlink(str(file)))
         else:
@@ -175,10 +458,9 @@ class MtreeFile(object):
             contents_path = str(file.absolute())
             assert shlex.quote(contents_path) == contents_path, "Invalid special chars: " + contents_path
             last_attrib = ("contents", contents_path)
-        attribs = OrderedDict([("type", mtree_type), ("uname", uname), ("gname", gname), ("mode", mode), last_attrib])
         if print_status:
             statusUpdate("Adding file", file, "to mtree as", mtree_path, file=sys.stderr)
-        self._mtree[mtree_path] = MtreeEntry(mtree_path, attribs)
+        self._add_entry(mtree_path, self._new_entry(mtree_path, (mtree_type, uname, gname, mode), last_attrib))
 
     def add_dir(self, path, mode=None, uname="root", gname="wheel", print_status=True, reference_dir=None):
         assert not path.startswith("/"), path
@@ -186,44 +468,495 @@ class MtreeFile(object):
         mtree_path = self._ensure_mtree_path_fmt(path)
         if mtree_path in self._mtree:
             return
-        if mode is None:
-            if reference_dir is None or mtree_path == ".":
-                mode = "0755"
-            else:
+        self._add_dirs(mtree_path, mode, uname, gname, print_status=print_status, reference_dir=reference_dir)
+
+    def _add_dirs(self, mtree_path: str, mode, uname: str, gname: str, *, print_status: bool, reference_dir: Path):
+        # Find all parent directories that don't exist yet (walking up the path string instead of recursing with
+        # Path objects). Usually all parent directories already exist so this only needs a single dict lookup.
+        missing = [mtree_path]
+        while missing[-1] != ".":
+            parent = missing[-1].rpartition("/")[0]
+            if parent in self._mtree:
+                break
+            missing.append(parent)
+        if mode is not None:
+            mode = self._ensure_mtree_mode_fmt(mode)
+        references = [reference_dir]
+        if reference_dir is not None:
+            while len(references) < len(missing):
+                references.append(references[-1].parent)
+        # Now add the directories starting with the outermost one. If we have a reference_dir, the modes of the
+        # parent directories are inferred from the parents of the reference_dir, otherwise they use the same mode.
+        for depth in range(len(missing) - 1, -1, -1):
+            path = missing[depth]
+            dir_mode = mode if depth == 0 or reference_dir is None else None
+            if dir_mode is None:
+                if reference_dir is None or path == ".":
+                    dir_mode = "0755"
+                else:
+                    dir_reference = references[depth]
+                    if print_status:
+                        statusUpdate("Inferring permissions for", path, "from", dir_reference, file=sys.stderr)
+                    dir_mode = self.infer_mode_string(dir_reference, True)
+            if print_status:
+                statusUpdate("Adding dir", path, "to mtree", file=sys.stderr)
+            self._add_entry(path, self._new_entry(path, ("dir", uname, gname, dir_mode)))
+
+    @staticmethod
+    def _new_entry(mtree_path: str, common: "typing.Tuple[str, str, str, str]", *extra) -> MtreeEntry:
+        result = MtreeEntry.__new__(MtreeEntry)
+        result.path = mtree_path
+        result._common = _shared_common_values(common)
+        result._extra = extra
+        return result
+
+    def add_directory(self, directory: Path, path_in_image, uname="root", gname="wheel", print_status=True):
+        """
+        Add the host directory and all files, symlinks and directories below it as path_in_image. This only needs
+        a single lstat() per file (instead of the separate calls made by add_file()/add_dir()).
+        """
+        if isinstance(path_in_image, Path):
+            path_in_image = str(path_in_image)
+        path_in_image = path_in_image.rstrip("/") or "."
+        self.add_dir(path_in_image, uname=uname, gname=gname, print_status=print_status, reference_dir=directory)
+        pending = [(str(directory.absolute()), self._ensure_mtree_path_fmt(path_in_image))]
+        while pending:
+            host_dir, mtree_dir = pending.pop()
+            entries = sorted(os.scandir(host_dir), key=lambda e: e.name)
+            ssh_dir = host_dir.endswith("/.ssh")
+            for entry in entries:
+                st = entry.stat(follow_symlinks=False)
+                mtree_path = mtree_dir + "/" + entry.name
+                mode = "0{0:o}".format(stat.S_IMODE(st.st_mode))
+                if entry.name == ".ssh" or ssh_dir and not entry.name.endswith(".pub"):
+                    mode = self.infer_mode_string(Path(entry.path), False, st)  # prints the warning
+                if stat.S_ISDIR(st.st_mode):
+                    if mtree_path not in self._mtree:
+                        if print_status:
+                            statusUpdate("Adding dir", mtree_path, "to mtree", file=sys.stderr)
+                        self._add_entry(mtree_path, self._new_entry(mtree_path, ("dir", uname, gname, mode)))
+                    pending.append((entry.path, mtree_path))
+                    continue
+                if stat.S_ISLNK(st.st_mode):
+                    last_attrib = ("link", os.readlink(entry.path))
+                    common = ("link", uname, gname, mode)
+                else:
+                    assert shlex.quote(entry.path) == entry.path, "Invalid special chars: " + entry.path
+                    last_attrib = ("contents", entry.path)
+                    common = ("file", uname, gname, mode)
                 if print_status:
-                    statusUpdate("Inferring permissions for", path, "from", reference_dir, file=sys.stderr)
-                mode = self.infer_mode_string(reference_dir, True)
-        mode = self._ensure_mtree_mode_fmt(mode)
-        # recursively add all parent dirs that don't exist yet
-        parent = str(Path(path).parent)
-        if parent != path:  # avoid recursion for path == "."
-            # print("adding parent", parent, file=sys.stderr)
-            if reference_dir is not None:
-                self.add_dir(parent, None, uname, gname, print_status=print_status, reference_dir=reference_dir.parent)
-            else:
-                self.add_dir(parent, mode, uname, gname, print_status=print_status, reference_dir=None)
-        # now add the actual entry
-        attribs = OrderedDict([("type", "dir"), ("uname", uname), ("gname", gname), ("mode", mode)])
-        if print_status:
-            statusUpdate("Adding dir", path, "to mtree", file=sys.stderr)
-        self._mtree[mtree_path] = MtreeEntry(mtree_path, attribs)
+                    statusUpdate("Adding file", entry.path, "to mtree as", mtree_path, file=sys.stderr)
+                self._add_entry(mtree_path, self._new_entry(mtree_path, common, last_attrib))
 
     def __contains__(self, item):
         mtree_path = self._ensure_mtree_path_fmt(str(item))
         return mtree_path in self._mtree
 
+    def __iter__(self) -> "typing.Iterator[MtreeEntry]":
+        return iter(self._mtree.values())
+
+    def __len__(self):
+        return len(self._mtree)
+
     def __repr__(self):
         import pprint
         return "<MTREE: " + pprint.pformat(self._mtree) + ">"
 
-    def write(self, output: "typing.Union[io.StringIO,Path,typing.IO]"):
+    @staticmethod
+    def _contents_path(entry: MtreeEntry, root: str) -> str:
+        contents = entry.attributes.get("contents")
+        if contents is None:
+            return os.path.join(root, entry.path[2:])
+        return os.path.join(root, contents)  # no-op for absolute paths
+
+    def deduplicate_files(self, root: Path, *, subtrees: "typing.Iterable[str]"=None, cache: FileDigestCache=None,
+                          jobs: int=None) -> "typing.Tuple[typing.List[typing.List[MtreeEntry]], int]":
+        """
+        Find regular files with identical contents and attributes and change contents= of all of them to the same
+        file so that makefs stores them as hardlinks (makefs only does this if that file has a link count > 1).
+        Hardlinks share all inode attributes, so entries are only merged if all keywords apart from contents=, size=
+        and the digests are the same (e.g. not if only flags= or uid= differs).
+        If subtrees is set only files below these paths in the image are considered.
+        :return: the groups of identical entries (the first entry is the one whose file is used by all of them) and
+        the number of bytes saved
+        """
+        if subtrees:
+            prefixes = tuple(self._ensure_mtree_path_fmt(p.strip("/")) + "/" for p in subtrees)
+            entries = [e for path, e in self._mtree.items() if path.startswith(prefixes) and e.is_file()]
+        else:
+            entries = [e for e in self._mtree.values() if e.is_file()]
+        root_str = str(root)
+        # Only files with the same attributes and size can be identical -> avoid reading all the others
+        ignored_keys = MtreeDiff.IGNORED_ATTRIBUTES | MtreeDiff._DIGEST_KEYWORDS | {"size"}
+        candidates = dict()  # type: typing.Dict[tuple, typing.List[typing.Tuple[MtreeEntry, str, os.stat_result]]]
+        for entry in entries:
+            path = self._contents_path(entry, root_str)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size == 0:
+                continue
+            key = (st.st_size,) + tuple(sorted(kv for kv in entry.attributes.items() if kv[0] not in ignored_keys))
+            candidates.setdefault(key, []).append((entry, path, st))
+        candidates = [c for c in candidates.values() if len(c) > 1]
+        digests = compute_file_digests([path for c in candidates for _, path, _ in c], cache=cache, jobs=jobs)
+        groups = []
+        saved = 0
+        for candidate_group in candidates:
+            identical = dict()
+            for entry, path, st in candidate_group:
+                if path in digests:
+                    identical.setdefault(digests[path][1], []).append((entry, path, st))
+            for files in identical.values():
+                if len(files) < 2:
+                    continue
+                files.sort(key=lambda f: f[0].path)
+                _, canonical_path, canonical_st = files[0]
+                inodes = {(canonical_st.st_dev, canonical_st.st_ino)}
+                for entry, _, st in files[1:]:
+                    entry.attributes["contents"] = canonical_path
+                    if (st.st_dev, st.st_ino) not in inodes:
+                        inodes.add((st.st_dev, st.st_ino))
+                        saved += st.st_size
+                groups.append([f[0] for f in files])
+        groups.sort(key=lambda g: g[0].path)
+        return groups, saved
+
+    def add_digests(self, root: Path, *, cache: FileDigestCache=None, jobs: int=None) -> int:
+        """
+        Add size= and sha256digest= to all file entries. The file contents are read from contents= or (for entries
+        without contents=, e.g. in a METALOG created by installworld) from the path relative to root.
+        :return: the number of entries that were updated
+        """
+        entries = [e for e in self._mtree.values() if e.is_file()]
+        paths = [self._contents_path(e, str(root)) for e in entries]
+        digests = compute_file_digests(paths, cache=cache, jobs=jobs)
+        updated = 0
+        for entry, path in zip(entries, paths):
+            result = digests.get(path)
+            if result is None:
+                continue
+            attributes = OrderedDict(entry.attributes.items())
+            attributes["size"] = str(result[0])
+            attributes["sha256digest"] = result[1]
+            entry.attributes = attributes
+            updated += 1
+        return updated
+
+    def fingerprint(self, root: Path, *, ignore_contents: "typing.Iterable[str]"=(), cache: FileDigestCache=None,
+                    jobs: int=None) -> "typing.Dict[str, str]":
+        """
+        :return: a short hash for every entry that covers its attributes and the digest of the file contents. The
+        contents= path itself is not included since it can refer to a temporary directory.
+        :param ignore_contents: paths of files where only the attributes matter (e.g. random seed files)
+        """
+        ignored = set(self._ensure_mtree_path_fmt(p) for p in ignore_contents)
+        paths = dict()  # type: typing.Dict[str, str]
+        for key, entry in self._mtree.items():
+            if key not in ignored and entry.is_file():
+                paths[key] = self._contents_path(entry, str(root))
+        digests = compute_file_digests(set(paths.values()), cache=cache, jobs=jobs)
+        result = dict()
+        for key in self._sorted_keys():
+            attributes = " ".join(k + "=" + v for k, v in self._mtree[key].attributes.items() if k != "contents")
+            digest = ""
+            if key in paths:
+                digest = digests.get(paths[key], (0, "missing"))[1]
+            result[key] = hashlib.sha256((attributes + "\0" + digest).encode("utf-8",
+                                                                          errors="surrogateescape")).hexdigest()[:16]
+        return result
+
+    def _remove_entry(self, mtree_path: str):
+        del self._mtree[mtree_path]
+        # Removing from the middle of the sorted list is O(n) -> just sort again on the next write()
+        self._sorted_paths = []
+        self._unsorted_paths = []
+
+    def diff(self, other: "MtreeFile") -> MtreeDiff:
+        """Compare this manifest to other (the newer one). This is linear in the number of entries."""
+        result = MtreeDiff()
+        for path, new in other._mtree.items():
+            old = self._mtree.get(path)
+            if old is None:
+                result.added.append(new)
+                continue
+            attributes = MtreeDiff.changed_attributes(old, new)
+            if attributes:
+                result.changed.append((old, new, attributes))
+        result.removed = [e for path, e in self._mtree.items() if path not in other._mtree]
+        # Only sort the differences instead of all entries
+        result.added.sort(key=lambda e: e.path)
+        result.removed.sort(key=lambda e: e.path)
+        result.changed.sort(key=lambda c: c[1].path)
+        return result
+
+    def merge(self, overlay: "MtreeFile", base: "MtreeFile"=None) -> "typing.List[str]":
+        """
+        Add all entries from overlay to this manifest (replacing existing ones). If base is set, this is a
+        three-way merge: base is the manifest that both this one and overlay were derived from and entries that
+        were removed in overlay are also removed here. Returns the paths that were changed in both manifests
+        (the overlay entry is used for those unless it was removed in overlay).
+        """
+        conflicts = []
+        for path, entry in overlay._mtree.items():
+            current = self._mtree.get(path)
+            if base is not None:
+                original = base._mtree.get(path)
+                if original is not None and original == entry:
+                    continue  # not changed in overlay -> keep our version (or keep it removed)
+                if current is None:
+                    if original is not None:
+                        conflicts.append(path)  # removed here but modified in overlay
+                elif MtreeDiff.changed_attributes(current, entry) and (
+                        original is None or MtreeDiff.changed_attributes(original, current)):
+                    conflicts.append(path)
+            # Don't share the entries since the attributes can be modified
+            self._add_entry(path, self._new_entry(path, entry._common, *entry._extra))
+            parent = path.rpartition("/")[0]
+            if path != "." and parent not in self._mtree:
+                self._add_dirs(parent, None, entry.attributes.get("uname", "root"),
+                               entry.attributes.get("gname", "wheel"), print_status=False, reference_dir=None)
+        if base is not None:
+            for path, original in base._mtree.items():
+                if path in overlay._mtree or path not in self._mtree:
+                    continue
+                if MtreeDiff.changed_attributes(original, self._mtree[path]):
+                    conflicts.append(path)  # removed in overlay but modified here -> keep it
+                else:
+                    self._remove_entry(path)
+        conflicts.sort()
+        return conflicts
+
+    def _sorted_keys(self) -> "typing.List[str]":
+        if len(self._sorted_paths) + len(self._unsorted_paths) != len(self._mtree):
+            # Entries were added or removed by modifying _mtree directly -> sort all keys again
+            self._sorted_paths = sorted(self._mtree.keys())
+        elif self._unsorted_paths:
+            # Timsort merges the two sorted runs in linear time
+            self._unsorted_paths.sort()
+            self._sorted_paths.extend(self._unsorted_paths)
+            self._sorted_paths.sort()
+        self._unsorted_paths = []
+        return self._sorted_paths
+
+    def write(self, output: "typing.Union[io.StringIO,Path,typing.IO]", changed_since: "MtreeFile"=None):
+        """
+        Write the manifest sorted by path. If changed_since is set, only the entries that are not part of that
+        manifest (or have different attributes) are written.
+        """
         if isinstance(output, Path):
             with output.open("w") as f:
-                self.write(f)
+                self.write(f, changed_since)
                 return
+        entries = (self._mtree[path] for path in self._sorted_keys())
+        if changed_since is not None:
+            previous = changed_since._mtree
+            entries = (e for e in entries if previous.get(e.path) != e)
+        self.write_entries(output, entries)
+
+    @staticmethod
+    def write_entries(output: "typing.IO", entries: "typing.Iterable[MtreeEntry]", chunk_size=4096):
+        """Write a manifest containing entries (which must already be sorted) in chunks of chunk_size lines"""
         output.write("#mtree 2.0\n")
-        for path in sorted(self._mtree.keys()):
-            output.write(str(self._mtree[path]))
-            output.write("\n")
+        chunk = []
+        for entry in entries:
+            chunk.append(str(entry))
+            if len(chunk) == chunk_size:
+                chunk.append("")
+                output.write("\n".join(chunk))
+                chunk = []
+        if chunk:
+            chunk.append("")
+            output.write("\n".join(chunk))
         output.write("# END\n")
 
+
+_MTREE_VIEW_PATH_RE = re.compile(br"[^ \t\r\n]*")
+
+
+class MtreeView(object):
+    """
+    Read-only view of an mtree file (e.g. a METALOG) for code that only needs a few entries. The file is mmap()ed
+    and entries are only parsed when they are accessed. An index with the offsets of all lines sorted by path is
+    built on first use. If index_dir is set it is saved there (named after the absolute path of the file and keyed
+    by its size and mtime) so that later lookups only need a binary search. The index is never written next to the
+    file since that would add it to the rootfs that the METALOG describes.
+    """
+    INDEX_SUFFIX = ".cheribuild-index"
+    _INDEX_MAGIC = b"CBMTIDX1"
+    _INDEX_HEADER = struct.Struct("<8sQQQ")  # magic, file size, mtime_ns, number of entries
+    _TYPE_CODES = {"dir": b"d", "file": b"f", "link": b"l"}
+
+    def __init__(self, file: Path, index_dir: Path=None):
+        self.file = file
+        self.index_file = None  # type: typing.Optional[Path]
+        if index_dir is not None:
+            path_hash = hashlib.sha256(str(file.absolute()).encode("utf-8", errors="surrogateescape")).hexdigest()
+            self.index_file = index_dir / (file.name + "-" + path_hash[:16] + self.INDEX_SUFFIX)
+        self._mmap = None  # type: mmap.mmap
+        self._offsets = None  # type: array.array
+        self._types = None  # type: bytes
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._mmap = None
+        self._offsets = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _ensure_index(self):
+        if self._offsets is not None:
+            return
+        with self.file.open("rb") as f:
+            st = os.fstat(f.fileno())
+            # mmap() fails for empty files
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b""
+        if not self._load_index(st):
+            self._build_index()
+            self._save_index(st)
+
+    def _load_index(self, st: os.stat_result) -> bool:
+        if self.index_file is None:
+            return False
+        try:
+            with self.index_file.open("rb") as f:
+                magic, size, mtime_ns, count = self._INDEX_HEADER.unpack(f.read(self._INDEX_HEADER.size))
+                if magic != self._INDEX_MAGIC or size != st.st_size or mtime_ns != st.st_mtime_ns:
+                    return False
+                offsets = array.array("Q")
+                offsets.frombytes(f.read(count * offsets.itemsize))
+                types = f.read(count)
+                if len(offsets) != count or len(types) != count:
+                    return False
+        except (OSError, struct.error):
+            return False
+        self._offsets = offsets
+        self._types = types
+        return True
+
+    def _save_index(self, st: os.stat_result):
+        if self.index_file is None:
+            return
+        tmpfile = self.index_file.with_name(self.index_file.name + "." + str(os.getpid()))
+        try:
+            os.makedirs(str(self.index_file.parent), exist_ok=True)
+            with tmpfile.open("wb") as f:
+                f.write(self._INDEX_HEADER.pack(self._INDEX_MAGIC, st.st_size, st.st_mtime_ns, len(self._offsets)))
+                f.write(self._offsets.tobytes())
+                f.write(self._types)
+            os.replace(str(tmpfile), str(self.index_file))
+        except OSError as e:
+            # Not fatal (e.g. read-only directory), the index will just be built again next time
+            warningMessage("Could not save mtree index", self.index_file, e)
+
+    def _build_index(self):
+        keyed = []
+        data = self._mmap
+        end = len(data)
+        offset = 0
+        while offset < end:
+            line_end = data.find(b"\n", offset)
+            if line_end == -1:
+                line_end = end
+            line = data[offset:line_end]
+            stripped = line.lstrip()
+            if stripped and not stripped.startswith(b"#"):
+                start = offset + len(line) - len(stripped)
+                kind = None
+                type_index = stripped.find(b" type=")
+                if type_index != -1:
+                    kind = stripped[type_index + 6:].split(None, 1)[0].decode("utf-8", errors="replace")
+                try:
+                    path = self._decode_path(_MTREE_VIEW_PATH_RE.match(stripped).group())
+                    keyed.append((path, start, self._TYPE_CODES.get(kind, b"?")))
+                except Exception as e:
+                    warningMessage("Could not parse line", stripped, "in mtree file", self.file, ":", e)
+            offset = line_end + 1
+        keyed.sort(key=lambda k: k[0])  # stable -> duplicate definitions stay in file order
+        # Like MtreeFile.load(), the last definition wins for duplicates -> only index that one
+        unique = [k for i, k in enumerate(keyed) if i + 1 == len(keyed) or keyed[i + 1][0] != k[0]]
+        self._offsets = array.array("Q", (k[1] for k in unique))
+        self._types = b"".join(k[2] for k in unique)
+
+    @staticmethod
+    def _decode_path(field: bytes) -> str:
+        path = field.decode("utf-8", errors="surrogateescape")
+        if "\\" in path:
+            path = mtree_split(path)[0]
+        if path == "." or (path.startswith("./") and "//" not in path and "/." not in path and not path.endswith("/")):
+            return path  # already normalized (true for almost all lines)
+        return MtreeFile._ensure_mtree_path_fmt(path.rstrip("/") or ".")
+
+    def _path(self, index: int) -> str:
+        # Only decode the first field since this is called for every step of the binary search
+        return self._decode_path(_MTREE_VIEW_PATH_RE.match(self._mmap, self._offsets[index]).group())
+
+    def _line(self, index: int) -> bytes:
+        offset = self._offsets[index]
+        end = self._mmap.find(b"\n", offset)
+        return self._mmap[offset:end if end != -1 else len(self._mmap)]
+
+    def _entry(self, index: int) -> MtreeEntry:
+        return MtreeEntry.parse(self._line(index).decode("utf-8", errors="surrogateescape"))
+
+    def _lower_bound(self, path: str) -> int:
+        lo, hi = 0, len(self._offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._path(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, path: str) -> int:
+        self._ensure_index()
+        mtree_path = MtreeFile._ensure_mtree_path_fmt(str(path).strip("/") or ".")
+        index = self._lower_bound(mtree_path)
+        if index < len(self._offsets) and self._path(index) == mtree_path:
+            return index
+        return -1
+
+    def __contains__(self, path) -> bool:
+        return self._find(path) != -1
+
+    def get(self, path) -> "typing.Optional[MtreeEntry]":
+        index = self._find(path)
+        return self._entry(index) if index != -1 else None
+
+    def __len__(self):
+        self._ensure_index()
+        return len(self._offsets)
+
+    def _iter_range(self, start: int, prefix: "typing.Optional[str]", kind: bytes=None):
+        for index in range(start, len(self._offsets)):
+            if prefix is not None and not self._path(index).startswith(prefix):
+                break
+            if kind is None or self._types[index:index + 1] == kind:
+                yield self._entry(index)
+
+    def __iter__(self) -> "typing.Iterator[MtreeEntry]":
+        """All entries sorted by path"""
+        self._ensure_index()
+        return self._iter_range(0, None)
+
+    def entries_below(self, *directories: str) -> "typing.Iterator[MtreeEntry]":
+        """Iterate over the given directories and everything below them (e.g. "usr/lib")"""
+        self._ensure_index()
+        for directory in directories:
+            mtree_path = MtreeFile._ensure_mtree_path_fmt(directory.strip("/") or ".")
+            index = self._find(mtree_path)
+            if index != -1:
+                yield self._entry(index)
+            prefix = mtree_path + "/" if mtree_path != "." else "./"
+            yield from self._iter_range(self._lower_bound(prefix), prefix)
+
+    def directories(self) -> "typing.Iterator[MtreeEntry]":
+        self._ensure_index()
+        return self._iter_range(0, None, kind=self._TYPE_CODES["dir"])
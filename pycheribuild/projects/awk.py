@@ -46,7 +46,7 @@ class BuildAwk(Project):
     def install(self, **kwargs):
         self.runMake("names", cwd=self.sourceDir / "latest")
         self.installFile(self.sourceDir / "latest/a.out", self.installDir / "bin/nawk")
-        runCmd("ln", "-sfn", "nawk", "awk", cwd=self.installDir / "bin")
+        self.createSymlink(Path("nawk"), self.installDir / "bin/awk")
 
     def process(self):
         if not IS_LINUX:
@@ -28,7 +28,6 @@
 # SUCH DAMAGE.
 #
 import os
-import shutil
 from pathlib import Path
 
 from ..config.loader import ComputedDefaultValue
@@ -92,7 +91,7 @@ class BuildGnuBinutils(AutotoolsProject):
         self.configureArgs.append("--disable-shared")
         # newer compilers will default to -std=c99 which will break binutils:
         cflags = "-std=gnu89 -O2"
-        info = getCompilerInfo(Path(os.getenv("CC", shutil.which("cc"))))
+        info = getCompilerInfo(Path(os.getenv("CC", cached_which("cc"))))
         if info.compiler == "clang" or (info.compiler == "gcc" and info.version >= (4, 6, 0)):
             cflags += " -Wno-unused"
         self.configureEnvironment["CFLAGS"] = cflags
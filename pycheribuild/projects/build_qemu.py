@@ -30,7 +30,6 @@
 from .project import *
 from ..utils import *
 from pathlib import Path
-import shutil
 import subprocess
 
 
@@ -94,7 +93,7 @@ class BuildQEMU(AutotoolsProject):
         extraCFlags = "-DCONFIG_DEBUG_TCG=1" if self.debug_info else "-O3"
         extraLDFlags = ""
         extraCXXFlags = ""
-        if shutil.which("pkg-config"):
+        if cached_which("pkg-config"):
             glibIncludes = runCmd("pkg-config", "--cflags-only-I", "glib-2.0", captureOutput=True,
                                   printVerboseOnly=True, runInPretendMode=True).stdout.decode("utf-8").strip()
             extraCFlags += " " + glibIncludes
@@ -118,9 +117,9 @@ class BuildQEMU(AutotoolsProject):
                         version_suffix = ""
                         if compiler.name.startswith("clang"):
                             version_suffix = compiler.name[len("clang"):]
-                        llvm_ar = shutil.which("llvm-ar" + version_suffix)
-                        llvm_ranlib = shutil.which("llvm-ranlib" + version_suffix)
-                        llvm_nm = shutil.which("llvm-nm" + version_suffix)
+                        llvm_ar = cached_which("llvm-ar" + version_suffix)
+                        llvm_ranlib = cached_which("llvm-ranlib" + version_suffix)
+                        llvm_nm = cached_which("llvm-nm" + version_suffix)
                         if not llvm_ar or not llvm_ranlib or not llvm_nm:
                             self.warning("Could not find llvm-{ar,ranlib,nm}" + version_suffix,
                                          "-> disabling LTO (qemu will be a bit slower)")
@@ -181,7 +180,7 @@ class BuildQEMU(AutotoolsProject):
             if IS_MAC:
                 self.configureArgs.append("--disable-cocoa")
 
-        python_path = shutil.which("python2.7") or shutil.which("python2") or ""
+        python_path = cached_which("python2.7") or cached_which("python2") or ""
         # QEMU needs python 2.7 for building:
         self.configureArgs.append("--python=" + python_path)
         # the capstone disassembler doesn't support CHERI instructions:
@@ -101,7 +101,7 @@ class BuildCheriVis(Project):
         configOutput = runCmd("gnustep-config", "--variable=GNUSTEP_MAKEFILES", captureOutput=True).stdout
         self.gnustepMakefilesDir = Path(configOutput.decode("utf-8").strip())
         commonDotMake = self.gnustepMakefilesDir / "common.make"
-        if not commonDotMake.is_file():
+        if not cached_is_file(commonDotMake):
             self.dependencyError("gnustep-config binary exists, but", commonDotMake, "does not exist!",
                                  installInstructions=gnuStepInstallInstructions())
         # TODO: set ADDITIONAL_LIB_DIRS?
@@ -33,13 +33,19 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import time
 
+from collections import OrderedDict
 from pathlib import Path
 from .multiarchmixin import MultiArchBaseMixin
 from ..project import *
 from ..llvm import BuildUpstreamLLVM
+from ...archive import create_archive, archive_command
+from ...artifact_cache import ArtifactCache, snapshot_install_tree
 from ...config.loader import ComputedDefaultValue
 from ...config.chericonfig import CrossCompileTarget
+from ...mtree import MtreeView
+from ...sysroot import populate_sysroot_from_metalog
 from ...utils import *
 
 
@@ -564,10 +570,76 @@ class BuildFreeBSD(MultiArchBaseMixin, BuildFreeBSDBase):
         if not self.config.skipBuildworld:
             if self.fastRebuild:
                 build_args.set(WORLDFAST=True)
+            legacy_dir, bootstrap_tools_cache_key = None, None
+            if self.config.use_artifact_cache and not self.fastRebuild and not self.config.pretend:
+                legacy_dir, bootstrap_tools_cache_key = self._use_cached_bootstrap_tools(build_args)
             self.runMake("buildworld", options=build_args)
+            if bootstrap_tools_cache_key is not None and legacy_dir.is_dir():
+                files = sorted(snapshot_install_tree(legacy_dir).keys())
+                self.config.artifact_cache.store(bootstrap_tools_cache_key, legacy_dir, files,
+                                                 target="freebsd-bootstrap-tools-stage",
+                                                 inputs=self._bootstrap_tools_cache_inputs(build_args),
+                                                 relocatable_prefix=str(legacy_dir.parent))
         if not self.subdirOverride:
             self._buildkernel(kernconf=self.kernelConfig, mfs_root_image=mfs_root_image)
 
+    def _bootstrap_tools_cache_inputs(self, args: MakeOptions) -> "typing.Optional[typing.Dict[str, typing.Any]]":
+        """
+        The legacy and bootstrap-tools stages of buildworld only build tools for the host. They are therefore the
+        same for all architectures and only depend on the sources, the host toolchain and the WITH_/WITHOUT_ options.
+        The WORLDTMP path is not part of the key: symlinks and generated scripts that refer to it are rewritten when
+        extracting the cache entry into the WORLDTMP of another variant (see ArtifactCache.store()).
+        """
+        source = self._artifact_cache_source_inputs()
+        if source is None:
+            return None
+        uname = os.uname()
+        inputs = OrderedDict(target="freebsd-bootstrap-tools-stage", source=source, crossbuild=self.crossbuild,
+                             host=" ".join((uname.sysname, uname.release, uname.machine)))
+        for var, default in (("CC", "cc"), ("CXX", "c++")):
+            compiler = args.env_vars.get(var) or shutil.which(default)
+            if compiler and Path(compiler).exists():
+                inputs[var] = get_version_output(Path(compiler)).decode("utf-8", errors="replace")
+        inputs["options"] = sorted(arg for arg in args.all_commandline_args if
+                                   arg.startswith(("-DWITH_", "-DWITHOUT_")) and "CHERI" not in arg)
+        return inputs
+
+    def _use_cached_bootstrap_tools(self, args: MakeOptions) -> "typing.Tuple[typing.Optional[Path], str]":
+        """
+        Extract the result of the legacy and bootstrap-tools stages from the artifact cache (if available) and
+        remove _bootstrap-tools from the list of buildworld stages.
+        :return: The legacy directory and the cache key if the result should be added to the cache after buildworld
+        """
+        # When crossbuilding this will also bootstrap bmake if it doesn't exist yet
+        try:
+            output = runCmd([self.make_args.command] + args.all_commandline_args +
+                            ["-m", self.sourceDir / "share/mk", "-f", "Makefile.inc1", "-V", "WORLDTMP",
+                             "-V", "WMAKE_TGTS"], env=args.env_vars, cwd=self.sourceDir, captureOutput=True,
+                            printVerboseOnly=True).stdout.decode("utf-8").strip().splitlines()
+        except subprocess.CalledProcessError as e:
+            warningMessage("Could not query buildworld stages, not using cached bootstrap tools:", e)
+            return None, None
+        if len(output) < 2 or not output[-2].startswith("/") or "_bootstrap-tools" not in output[-1].split():
+            self.verbose_print("Could not determine buildworld stages, not using cached bootstrap tools:", output)
+            return None, None
+        legacy_dir = Path(output[-2], "legacy")
+        inputs = self._bootstrap_tools_cache_inputs(args)
+        if inputs is None:
+            return None, None
+        key = ArtifactCache.compute_key(inputs)
+        if legacy_dir.exists():
+            # Incremental build -> make will only rebuild what changed
+            return legacy_dir, None
+        if self.config.artifact_cache.lookup(key) is None:
+            statusUpdate("No cached bootstrap tools found for", self.sourceDir, "-- they will be added after buildworld")
+            return legacy_dir, key
+        statusUpdate("Using cached bootstrap tools for", self.target, "from the artifact cache")
+        self.config.artifact_cache.extract(key, legacy_dir, relocatable_prefix=str(legacy_dir.parent))
+        # Running _worldtmp with NO_CLEAN keeps the extracted files so we only need to skip the _bootstrap-tools stage
+        stages = [stage for stage in output[-1].split() if stage != "_bootstrap-tools"]
+        args.set(WMAKE_TGTS=" ".join(stages))
+        return legacy_dir, None
+
     def _removeOldRootfs(self):
         assert self.config.clean or not self.keepOldRootfs
         if self.config.skipBuildworld:
@@ -1158,6 +1230,9 @@ class BuildCheriBsdSysroot(SimpleProject):
     projectName = "cheribsd-sysroot"
     dependencies = ["cheribsd-cheri"]
     is_sdk_target = True
+    can_use_artifact_cache = True
+    artifact_cache_ignored_options = SimpleProject.artifact_cache_ignored_options + ("remote-sdk-path",
+                                                                                     "copy-in-process")
 
     rootfs_source_class = BuildCHERIBSD  # type: BuildCHERIBSD
 
@@ -1184,6 +1259,10 @@ class BuildCheriBsdSysroot(SimpleProject):
             cls.remotePath = cls.addConfigOption("remote-sdk-path", showHelp=True, metavar="PATH", help="The path to "
                                                  "the CHERI SDK on the remote FreeBSD machine (e.g. "
                                                  "vica:~foo/cheri/output/sdk)")
+        cls.copy_in_process = cls.addBoolOption("copy-in-process",
+            help="Copy the files listed in METALOG to the sysroot in parallel from cheribuild and hardlink unchanged "
+                 "files from the previous sysroot instead of using bsdtar. This is faster on slow disks but slower "
+                 "than bsdtar if the rootfs is on a tmpfs.")
 
     def copySysrootFromRemoteMachine(self):
         statusUpdate("Cannot build disk image on non-FreeBSD systems, will attempt to copy instead.")
@@ -1203,33 +1282,66 @@ class BuildCheriBsdSysroot(SimpleProject):
         self.copyRemoteFile(remoteSysrootArchive, self.config.sdkDir / self.config.sysrootArchiveName)
         runCmd("tar", "xzf", self.config.sdkDir / self.config.sysrootArchiveName, cwd=self.config.sdkDir)
 
-    def createSysroot(self):
+    def createSysroot(self, previous_sysroot: Path = None):
         # we need to add include files and libraries to the sysroot directory
         self.makedirs(self.config.sdkSysrootDir / "usr")
-        # GNU tar doesn't accept --include
-        tar_cmd = "bsdtar" if IS_LINUX else "tar"
-        # use tar+untar to copy all necessary files listed in metalog to the sysroot dir
-        archiveCmd = [tar_cmd, "cf", "-", "--include=./lib/", "--include=./usr/include/",
-                      "--include=./usr/lib/", "--include=./usr/libcheri", "--include=./usr/libdata/",
-                      # only pack those files that are mentioned in METALOG
-                      "@METALOG"]
-        printCommand(archiveCmd, cwd=BuildCHERIBSD.rootfsDir(self, self.config))
-        if not self.config.pretend:
-            tar_cwd = str(BuildCHERIBSD.rootfsDir(self, self.config))
-            with subprocess.Popen(archiveCmd, stdout=subprocess.PIPE, cwd=tar_cwd) as tar:
-                runCmd(["tar", "xf", "-"], stdin=tar.stdout, cwd=self.config.sdkSysrootDir)
+        if self.copy_in_process:
+            self._copy_sysroot_files_in_process(previous_sysroot)
+        else:
+            # GNU tar doesn't accept --include
+            tar_cmd = "bsdtar" if IS_LINUX else "tar"
+            # use tar+untar to copy all necessary files listed in metalog to the sysroot dir
+            archiveCmd = [tar_cmd, "cf", "-", "--include=./lib/", "--include=./usr/include/",
+                          "--include=./usr/lib/", "--include=./usr/libcheri", "--include=./usr/libdata/",
+                          # only pack those files that are mentioned in METALOG
+                          "@METALOG"]
+            printCommand(archiveCmd, cwd=BuildCHERIBSD.rootfsDir(self, self.config))
+            if not self.config.pretend:
+                tar_cwd = str(BuildCHERIBSD.rootfsDir(self, self.config))
+                with subprocess.Popen(archiveCmd, stdout=subprocess.PIPE, cwd=tar_cwd) as tar:
+                    runCmd(["tar", "xf", "-"], stdin=tar.stdout, cwd=self.config.sdkSysrootDir)
         if not (self.config.sdkSysrootDir / "lib/libc.so.7").is_file():
             self.fatal(self.config.sdkSysrootDir, "is missing the libc library, install seems to have failed!")
 
-        # fix symbolic links in the sysroot:
-        print("Fixing absolute paths in symbolic links inside lib directory...")
-        self.fixSymlinks()
+        if not self.copy_in_process:
+            # fix symbolic links in the sysroot:
+            print("Fixing absolute paths in symbolic links inside lib directory...")
+            self.fixSymlinks()
         # create an archive to make it easier to copy the sysroot to another machine
         self.deleteFile(self.config.sdkDir / self.config.sysrootArchiveName, printVerboseOnly=True)
-        runCmd("tar", "-czf", self.config.sdkDir / self.config.sysrootArchiveName, self.config.sdkSysrootDir.name,
-               cwd=self.config.sdkDir)
+        archive = self.config.sdkDir / self.config.sysrootArchiveName
+        statusUpdate("Creating", archive)
+        if self.config.pretend:
+            printCommand(archive_command(archive, self.config.sdkSysrootDir, compression="gzip"))
+        else:
+            stats = create_archive(archive, self.config.sdkSysrootDir, compression="gzip")
+            statusUpdate("Compressed", stats["uncompressed_size"] // (1024 * 1024), "MiB to",
+                         stats["compressed_size"] // (1024 * 1024), "MiB using", stats["compressor"], "in",
+                         "{:.2f}s".format(stats["time"]))
         print("Successfully populated sysroot")
 
+    def _copy_sysroot_files_in_process(self, previous_sysroot: "typing.Optional[Path]"):
+        rootfs = BuildCHERIBSD.rootfsDir(self, self.config)
+        metalog = rootfs / "METALOG"
+        # only copy those files that are mentioned in METALOG (and make absolute symlinks relative at the same time)
+        statusUpdate("Populating", self.config.sdkSysrootDir, "from", metalog)
+        if self.config.pretend:
+            return
+        if not metalog.is_file():
+            self.fatal("Cannot create sysroot:", metalog, "is missing")
+        start = time.time()
+        try:
+            with MtreeView(metalog, index_dir=self.config.buildRoot / ".cheribuild-mtree-index") as metalog_view:
+                stats = populate_sysroot_from_metalog(metalog_view, rootfs, self.config.sdkSysrootDir,
+                                                      previous_sysroot=previous_sysroot)
+        except FileNotFoundError as e:
+            self.fatal("Cannot create sysroot:", e.strerror)
+            return
+        statusUpdate("Installed", stats["files"], "files (" + str(stats["hardlinked"]), "unchanged ones "
+                     "hardlinked from the previous sysroot) and", stats["symlinks"], "symlinks (" +
+                     str(stats["fixed_symlinks"]), "with absolute paths fixed) in",
+                     "{:.2f}s".format(time.time() - start))
+
     def process(self):
         if self.config.skipBuildworld:
             statusUpdate("Not building sysroot because --skip-buildworld was passed")
@@ -1243,17 +1355,44 @@ class BuildCheriBsdSysroot(SimpleProject):
                     unprefixed_sysroot.rmdir()
                 self.createSymlink(self.config.sdkSysrootDir, unprefixed_sysroot)
 
+        cache_inputs = None
+        if self.config.use_artifact_cache and self.can_use_artifact_cache:
+            cache_inputs = self.artifact_cache_inputs()
+        from_metalog = IS_FREEBSD or self.rootfs_source_class.get_instance(self, self.config).crossbuild
+        previous_sysroot = None
+        if from_metalog and self.copy_in_process and self.config.sdkSysrootDir.is_dir() and not self.config.pretend:
+            # Keep the old sysroot until the new one has been created so that unchanged files can be hardlinked
+            previous_sysroot = self.config.sdkSysrootDir.with_suffix(".delete-me-pls-previous")
+            if previous_sysroot.exists():
+                self._deleteDirectories(previous_sysroot)
+            self.config.sdkSysrootDir.rename(previous_sysroot)
+        try:
+            self._populate_sysroot(cache_inputs, from_metalog, previous_sysroot)
+        finally:
+            if previous_sysroot is not None:
+                self.config.deletion_service.submit(previous_sysroot, self._delete_directories_in_background)
+
+    def _populate_sysroot(self, cache_inputs, from_metalog: bool, previous_sysroot: "typing.Optional[Path]"):
         with self.asyncCleanDirectory(self.config.sdkSysrootDir):
-            if IS_FREEBSD or self.rootfs_source_class.get_instance(self, self.config).crossbuild:
-                self.createSysroot()
+            if cache_inputs is not None and self._install_from_artifact_cache(cache_inputs, self.config.sdkDir):
+                return
+            if from_metalog:
+                self.createSysroot(previous_sysroot)
             else:
                 self.copySysrootFromRemoteMachine()
+                cache_inputs = None  # we can only cache sysroots that were created from the local CheriBSD build
             if (self.config.sdkDir / "sysroot/usr/libcheri/").is_dir():
                 # clang++ expects libgcc_eh to exist:
                 libgcc_eh = self.config.sdkDir / "sysroot/usr/libcheri/libgcc_eh.a"
                 if not libgcc_eh.is_file():
                     warningMessage("CHERI libgcc_eh missing! You should probably update CheriBSD")
                     runCmd("ar", "rc", libgcc_eh)
+            if cache_inputs is not None:
+                files = [os.path.join(self.config.sdkSysrootDir.name, f) for f in
+                         sorted(snapshot_install_tree(self.config.sdkSysrootDir))]
+                if (self.config.sdkDir / self.config.sysrootArchiveName).is_file():
+                    files.append(self.config.sysrootArchiveName)
+                self._store_in_artifact_cache(cache_inputs, self.config.sdkDir, files)
 
 
 class BuildCheriBsdAndSysroot(TargetAlias):
@@ -156,7 +156,7 @@ class CrossCompileMixin(MultiArchBaseMixin):
         # Use the compiler from the build directory for native builds to get stddef.h (which will be deleted)
         if self._crossCompileTarget == CrossCompileTarget.NATIVE:
             llvm_build_dir = BuildLLVM.get_instance(self, config).buildDir
-            if (llvm_build_dir / "bin/clang").exists():
+            if cached_exists(llvm_build_dir / "bin/clang"):
                 self.compiler_dir = llvm_build_dir / "bin"
 
         self.targetTriple = None
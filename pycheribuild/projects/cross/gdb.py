@@ -44,14 +44,16 @@ class TemporarilyRemoveProgramsFromSdk(object):
         statusUpdate('Temporarily moving', self.programs, "from", self.config.sdkBinDir)
         for l in self.programs:
             if (self.config.sdkBinDir / l).exists():
-                runCmd("mv", "-f", l, l + ".backup", cwd=self.config.sdkBinDir, printVerboseOnly=True)
+                self.config.FS.moveFile(self.config.sdkBinDir / l, self.config.sdkBinDir / (l + ".backup"), force=True,
+                                        printVerboseOnly=True)
         return self
 
     def __exit__(self, *exc):
         statusUpdate('Restoring', self.programs, "in", self.config.sdkBinDir)
         for l in self.programs:
             if (self.config.sdkBinDir / (l + ".backup")).exists() or self.config.pretend:
-                runCmd("mv", "-f", l + ".backup", l, cwd=self.config.sdkBinDir, printVerboseOnly=True)
+                self.config.FS.moveFile(self.config.sdkBinDir / (l + ".backup"), self.config.sdkBinDir / l, force=True,
+                                        printVerboseOnly=True)
         return False
 
 
@@ -122,6 +122,10 @@ class BuildLibCXX(CrossCompileCMakeProject):
     repository = "https://github.com/CTSRD-CHERI/libcxx.git"
     defaultInstallDir = installToCXXDir
     dependencies = ["libcxxrt"]
+    can_use_artifact_cache = True
+    artifact_cache_ignored_options = CrossCompileCMakeProject.artifact_cache_ignored_options + (
+        "only-compile-tests", "collect-test-binaries", "nfs-mounted-path", "nfs-mounted-path-in-qemu", "ssh-host",
+        "ssh-port", "ssh-user", "parallel-test-jobs")
 
     @classmethod
     def setupConfigOptions(cls, **kwargs):
@@ -28,7 +28,7 @@
 # SUCH DAMAGE.
 #
 from .crosscompileproject import *
-from ...utils import statusUpdate, IS_MAC, runCmd
+from ...utils import statusUpdate, IS_MAC, runCmd, cached_exists
 from ...config.loader import ComputedDefaultValue
 from pathlib import Path
 import tempfile
@@ -77,7 +77,7 @@ class BuildNewlibBaremetal(CrossCompileAutotoolsProject):
     #     super().compile(cwd=self.buildDir / "libgloss")
 
     def needsConfigure(self):
-        return not (self.buildDir / "Makefile").exists()
+        return not cached_exists(self.buildDir / "Makefile")
 
     def add_configure_vars(self, **kwargs):
         # newlib is annoying, we need to pass all these arguments to make as well because it won't run all
@@ -28,6 +28,7 @@
 # SUCH DAMAGE.
 #
 from .crosscompileproject import *
+from ...utils import cached_exists
 import re
 
 
@@ -74,7 +75,7 @@ class BuildNginx(CrossCompileAutotoolsProject):
         self.writeFile(self.real_install_root_dir / "nginx-benchmark.sh", benchmark, overwrite=True, mode=0o755)
 
     def needsConfigure(self):
-        return not (self.buildDir / "Makefile").exists()
+        return not cached_exists(self.buildDir / "Makefile")
 
     def configure(self):
         if self.debugInfo:
@@ -29,7 +29,7 @@
 #
 from .crosscompileproject import *
 from ...config.loader import ComputedDefaultValue
-from ...utils import commandline_to_str, runCmd, IS_FREEBSD, IS_MAC, fatalError, IS_LINUX, getCompilerInfo
+from ...utils import commandline_to_str, runCmd, IS_FREEBSD, IS_MAC, fatalError, IS_LINUX, getCompilerInfo, cached_exists
 from pathlib import Path
 
 # This class is used to build qtbase and all of qt5
@@ -288,7 +288,7 @@ class BuildLibXml2(CrossCompileAutotoolsProject):
 
     def __init__(self, config):
         super().__init__(config)
-        if (self.sourceDir / "configure").exists():
+        if cached_exists(self.sourceDir / "configure"):
             self.configureCommand = self.sourceDir / "configure"
         else:
             self.configureCommand = self.sourceDir / "autogen.sh"
@@ -30,15 +30,21 @@
 import datetime
 import shlex
 import stat
+import subprocess
 import io
+import json
 import tempfile
+import time
+from collections import OrderedDict
 
 from .cross.cheribsd import BuildFreeBSD
 from .cross.cheribsd import *
 from ..config.loader import ComputedDefaultValue
 from .project import *
 from ..utils import *
-from ..mtree import MtreeFile
+from ..mtree import MtreeFile, MtreeView
+from ..file_digests import FileDigestCache
+from ..strip_cache import StripCache, is_elf_file
 
 # Notes:
 # Mount the filesystem of a BSD VM: guestmount -a /foo/bar.qcow2 -m /dev/sda1:/:ufstype=ufs2:ufs --ro /mnt/foo
@@ -47,6 +53,9 @@ from ..mtree import MtreeFile
 
 
 
+# Suffix for the temporary hardlinks that are needed for makefs to detect deduplicated files
+DEDUPLICATION_HARDLINK_SUFFIX = ".cheribuild-dedup-hardlink"
+
 PKG_REPO_URL = "https://people.freebsd.org/~brooks/packages/cheribsd-mips-20170403-brooks-20170609/"
 # old version of libarchive needed by kyua
 OLD_LIBARCHIVE_URL = "https://people.freebsd.org/~arichardson/cheri-files/libarchive.so.6"
@@ -90,6 +99,16 @@ class _BuildDiskImageBase(SimpleProject):
         cls.wget_via_tmp = cls.addBoolOption("wget-via-tmp",
                                 help="Use a directory in /tmp for recursive wget operations;"
                                       "of interest in rare cases, like extra-files on smbfs.")
+        cls.compute_digests = cls.addBoolOption("compute-digests",
+                                                help="Record the size and sha256 digest of all files in the manifest "
+                                                     "that is passed to makefs. Digests are cached in "
+                                                     "$BUILD_ROOT/.cheribuild-file-digests.json")
+        cls.deduplicate_files = cls.addBoolOption("deduplicate-files", default=True,
+                                                  help="Store files with identical contents, owner and mode as "
+                                                       "hardlinks in the disk image")
+        cls.deduplicate_subtrees = cls.addConfigOption("deduplicate-subtrees", kind=list, default=[], metavar="DIRS",
+                                                       help="Only deduplicate files below these directories of the "
+                                                            "image (e.g. usr/tests). The default is all files.")
         cls.disableTMPFS = None
 
     def __init__(self, config, source_class: "typing.Type[BuildFreeBSD]"):
@@ -97,7 +116,15 @@ class _BuildDiskImageBase(SimpleProject):
         # make use of the mtree file created by make installworld
         # this means we can create a disk image without root privilege
         self.manifestFile = None  # type: Path
-        self.extraFiles = []  # type: typing.List[Path]
+        # The files in extraFilesDir that have not been added yet and their path in the image and lstat() result
+        self.extraFiles = OrderedDict()  # type: typing.Dict[Path, typing.Tuple[str, os.stat_result]]
+        # (input, output) pairs of ELF files that will be stripped before makefs runs
+        self._files_to_strip = []  # type: typing.List[typing.Tuple[Path, Path]]
+        # Files with random contents that should not cause the image to be rebuilt (see image_fingerprint())
+        self._fingerprint_ignored_paths = []  # type: typing.List[str]
+        self._previous_fingerprint = None  # type: typing.Optional[dict]
+        # The file digest cache used while building the image (see __process())
+        self.digest_cache = None  # type: FileDigestCache
         self._addRequiredSystemTool("ssh-keygen")
 
         self.makefs_cmd = None
@@ -113,7 +140,7 @@ class _BuildDiskImageBase(SimpleProject):
         assert self.rootfsDir is not None
         self.userGroupDbDir = self.source_project.sourceDir / "etc"
         self.crossBuildImage = self.source_project.crossbuild
-        self.minimumImageSize = "1g",  # minimum image size = 1GB
+        self.minimumImageSize = "1g"  # minimum image size = 1GB
         self.mtree = MtreeFile()
         self.input_METALOG = self.rootfsDir / "METALOG"
         self.input_METALOG_required = True
@@ -123,28 +150,34 @@ class _BuildDiskImageBase(SimpleProject):
         if self.needs_special_pkg_repo:
             self._addRequiredSystemTool("wget")  # Needed to recursively fetch the pkg repo
 
-    def addFileToImage(self, file: Path, *, baseDirectory: Path, user="root", group="wheel", mode=None):
-        pathInTarget = file.relative_to(baseDirectory)
-        assert not str(pathInTarget).startswith(".."), pathInTarget
-
-        if self.strip_binaries and file.exists():
-            # Try to shrink the size by stripping all elf binaries
-            with file.open("rb") as f:
-                if f.read(4) == b"\x7fELF":
-                    self.verbose_print("Stripping ELF binary", file)
-                    stripped_path = self.tmpdir / pathInTarget
-                    self.makedirs(stripped_path.parent)
-                    runCmd(self.config.sdkBinDir / "llvm-strip", file, "-o", stripped_path)
-                    # runCmd("file", stripped_path)
-                    file = stripped_path
+    def addFileToImage(self, file: Path, *, baseDirectory: Path, user="root", group="wheel", mode=None,
+                       pathInTarget: str=None, st: os.stat_result=None):
+        """
+        :param pathInTarget: the path relative to baseDirectory (computed if not given)
+        :param st: the lstat() result for file if it is already known
+        """
+        if pathInTarget is None:
+            pathInTarget = str(file.relative_to(baseDirectory))
+        assert not pathInTarget.startswith(".."), pathInTarget
+        # remove it from extraFiles so we don't install it twice
+        self.extraFiles.pop(file, None)
+
+        if self.strip_binaries and is_elf_file(file):
+            # Try to shrink the size by stripping all elf binaries. This happens in parallel in strip_elf_files()
+            # so the METALOG entry refers to the stripped file that will be created there.
+            self.verbose_print("Will strip ELF binary", file)
+            st = file.stat()  # symlinks to ELF files are replaced by the stripped file
+            stripped_path = self.tmpdir / pathInTarget
+            self.makedirs(stripped_path.parent)
+            self._files_to_strip.append((file, stripped_path))
+            file = stripped_path
 
         if not self.config.quiet:
             statusUpdate(file, " -> /", pathInTarget, sep="")
 
         # This also adds all the parent directories to METALOG
-        self.mtree.add_file(file, pathInTarget, mode=mode, uname=user, gname=group, print_status=self.config.verbose)
-        if file in self.extraFiles:
-            self.extraFiles.remove(file)  # remove it from extraFiles so we don't install it twice
+        self.mtree.add_file(file, pathInTarget, mode=mode, uname=user, gname=group, print_status=self.config.verbose,
+                            st=st)
 
     def createFileForImage(self, pathInImage: str, *, contents: str="\n", showContentsByDefault=True, mode=None):
         if pathInImage.startswith("/"):
@@ -153,7 +186,6 @@ class _BuildDiskImageBase(SimpleProject):
         userProvided = self.extraFilesDir / pathInImage
         if userProvided.is_file():
             self.verbose_print("Using user provided /", pathInImage, " instead of generating default", sep="")
-            self.extraFiles.remove(userProvided)
             targetFile = userProvided
             baseDir = self.extraFilesDir
         else:
@@ -236,13 +268,11 @@ class _BuildDiskImageBase(SimpleProject):
         # If they do not exist in the extra-files directory yet we generate a default one and use that
         # Additionally all other files in the extra-files directory will be added to the disk image
         if self.extraFilesDir.exists():
-            for root, dirnames, filenames in os.walk(str(self.extraFilesDir)):
-                if '.svn' in dirnames:
-                    dirnames.remove('.svn')
-                if '.git' in dirnames:
-                    dirnames.remove('.git')
-                for filename in filenames:
-                    self.extraFiles.append(Path(root, filename))
+            vcs_dirs = (".svn", ".git")
+            for path, relpath, st in scan_files(self.extraFilesDir, skip_dir=lambda d: os.path.basename(d) in vcs_dirs):
+                # deduplicate_identical_files() may have left a hardlink here if an earlier build was killed
+                if not relpath.endswith(DEDUPLICATION_HARDLINK_SUFFIX):
+                    self.extraFiles[Path(path)] = (relpath, st)
 
         # TODO: https://www.freebsd.org/cgi/man.cgi?mount_unionfs(8) should make this easier
         # Overlay extra-files over additional stuff over cheribsd rootfs dir
@@ -327,6 +357,115 @@ class _BuildDiskImageBase(SimpleProject):
                     random_data = os.urandom(4096)
                     f.write(random_data)
             self.addFileToImage(entropy_file, baseDirectory=self.tmpdir)
+            self._fingerprint_ignored_paths.append(i)
+
+    def strip_elf_files(self):
+        files = self._files_to_strip
+        self._files_to_strip = []
+        strip_command = [self.config.sdkBinDir / "llvm-strip"]
+        if not files:
+            return
+        if self.config.pretend:
+            for src, dest in files:
+                runCmd(strip_command + [src, "-o", dest])
+            return
+        start = time.time()
+        cache = StripCache(self.config.buildRoot / ".cheribuild-strip-cache", strip_command)
+        try:
+            cache.strip_files(files, digests=self.digest_cache, jobs=self.config.makeJobs)
+        except subprocess.CalledProcessError as e:
+            output = e.output.decode("utf-8", "replace")
+            self.fatal("Failed to strip ELF binary:", commandline_to_str(e.cmd), "\n" + output)
+        cache.prune()
+        statusUpdate("Stripped", len(files), "ELF binaries in", "{:.2f}".format(time.time() - start), "seconds (" +
+                     str(cache.hits), "were found in the strip cache)")
+
+    def add_file_digests(self):
+        start = time.time()
+        previous_hits = self.digest_cache.hits
+        updated = self.mtree.add_digests(self.rootfsDir, cache=self.digest_cache, jobs=self.config.makeJobs)
+        statusUpdate("Computed digests of", updated, "files in", "{:.2f}".format(time.time() - start), "seconds (" +
+                     str(self.digest_cache.hits - previous_hits), "were unchanged)")
+
+    def deduplicate_identical_files(self) -> "typing.List[Path]":
+        """:return: the hardlinks that were created to make makefs detect the duplicates (delete after makefs)"""
+        start = time.time()
+        groups, saved = self.mtree.deduplicate_files(self.rootfsDir, subtrees=self.deduplicate_subtrees,
+                                                     cache=self.digest_cache, jobs=self.config.makeJobs)
+        created_links = []
+        for group in groups:
+            canonical = Path(group[1].attributes["contents"])  # the duplicates now all refer to the first file
+            if canonical.stat().st_nlink < 2:
+                # makefs only checks for hardlinks if the link count is greater than one (see the cheribsdbox case).
+                # The link has to be on the same file system (so not in self.tmpdir) and may therefore be left behind
+                # in the rootfs or the extra-files directory if we are killed. Both scans ignore this suffix.
+                link = canonical.with_name(canonical.name + DEDUPLICATION_HARDLINK_SUFFIX)
+                self.deleteFile(link)
+                os.link(str(canonical), str(link))
+                created_links.append(link)
+        statusUpdate("Deduplicated", sum(len(g) - 1 for g in groups), "files in", len(groups), "groups, saving",
+                     format_size(saved), "(took {:.2f} seconds)".format(time.time() - start))
+        return created_links
+
+    @property
+    def fingerprint_file(self) -> Path:
+        return self.diskImagePath.with_name(self.diskImagePath.name + ".cheribuild-fingerprint.json")
+
+    def makefs_flags(self) -> "typing.List[str]":
+        return [
+            "-Z",  # sparse file output
+            "-b", "30%",  # minimum 30% free blocks
+            "-f", "30%",  # minimum 30% free inodes
+            "-R", "4m",  # round up size to the next 1m multiple
+            "-M", self.minimumImageSize,
+            "-B", "be",  # big endian byte order
+            "-N", str(self.userGroupDbDir),  # use master.passwd from the cheribsd source not the current systems passwd file
+            # which makes sure that the numeric UID values are correct
+        ]
+
+    def image_fingerprint(self) -> dict:
+        """
+        Everything that affects the contents of the image: the manifest entries (including the digests of the files),
+        the makefs flags, the passwd/group files used by makefs -N and the image format. If this matches the
+        fingerprint of the existing image we don't need to run makefs (and qemu-img convert) again.
+        """
+        entries = self.mtree.fingerprint(self.rootfsDir, ignore_contents=self._fingerprint_ignored_paths,
+                                         cache=self.digest_cache, jobs=self.config.makeJobs)
+        # makefs -N resolves the uname=/gname= values using these files so they are not covered by the -N path
+        user_group_db = OrderedDict()
+        for name in ("master.passwd", "group"):
+            try:
+                user_group_db[name] = self.digest_cache.digest(str(self.userGroupDbDir / name))[1]
+            except OSError:
+                user_group_db[name] = None
+        return OrderedDict([
+            ("version", 1),
+            ("makefs", [str(f) for f in [self.makefs_cmd] + self.makefs_flags()]),
+            ("user_group_db", user_group_db),
+            ("format", "qcow2" if self.useQCOW2 else "raw"),
+            ("options", dict(deduplicate_files=self.deduplicate_files, deduplicate_subtrees=self.deduplicate_subtrees,
+                             compute_digests=self.compute_digests)),
+            ("entries", entries),
+        ])
+
+    def _load_image_fingerprint(self) -> "typing.Optional[dict]":
+        """:return: the fingerprint of the existing image or None if it is missing or the image has been modified"""
+        try:
+            with self.fingerprint_file.open("r", encoding="utf-8") as f:
+                fingerprint = json.load(f)
+            st = self.diskImagePath.stat()
+        except (OSError, ValueError):
+            return None
+        # Booting the image also modifies it -> rebuild it
+        if not isinstance(fingerprint, dict) or fingerprint.get("image") != [st.st_size, st.st_mtime_ns]:
+            return None
+        return fingerprint
+
+    def _save_image_fingerprint(self, fingerprint: dict):
+        st = self.diskImagePath.stat()
+        fingerprint["image"] = [st.st_size, st.st_mtime_ns]
+        with self.fingerprint_file.open("w", encoding="utf-8") as f:
+            json.dump(fingerprint, f)
 
     def makeImage(self):
         # check that qemu-img exists before starting the potentially long-running makefs command
@@ -339,22 +478,36 @@ class _BuildDiskImageBase(SimpleProject):
             else:
                 self.fatal("qemu-img command was not found!", fixitHint="Make sure to build target qemu first")
 
+        fingerprint = None
+        if not self.config.pretend:
+            start = time.time()
+            fingerprint = self.image_fingerprint()
+            self.verbose_print("Computing the disk image fingerprint took {:.2f} seconds".format(time.time() - start))
+            if self._previous_fingerprint is not None:
+                changes = describe_fingerprint_changes(self._previous_fingerprint, fingerprint)
+                if not changes:
+                    statusUpdate("Disk image", self.diskImagePath, "is up to date, not running makefs")
+                    return
+                statusUpdate("Rebuilding disk image", self.diskImagePath, "since the following inputs changed:")
+                for change in changes:
+                    print("   ", change)
+        self.deleteFile(self.fingerprint_file)
+        self.deleteFile(self.diskImagePath)
+
+        if self.compute_digests and not self.config.pretend:
+            self.add_file_digests()
+        dedup_hardlinks = []
+        if self.deduplicate_files and not self.config.pretend:
+            dedup_hardlinks = self.deduplicate_identical_files()
         # write out the manifest file:
         self.mtree.write(self.manifestFile)
         # print(self.manifestFile.read_text())
         debug_options = []
         if self.config.verbose:
             debug_options = ["-d", "0x90000"]  # trace POPULATE and WRITE_FILE events
+        makefs_start = time.time()
         try:
-            runCmd([self.makefs_cmd] + debug_options + [
-                "-Z",  # sparse file output
-                "-b", "30%",  # minimum 30% free blocks
-                "-f", "30%",  # minimum 30% free inodes
-                "-R", "4m",  # round up size to the next 1m multiple
-                "-M", self.minimumImageSize,
-                "-B", "be",  # big endian byte order
-                "-N", self.userGroupDbDir,  # use master.passwd from the cheribsd source not the current systems passwd file
-                # which makes sure that the numeric UID values are correct
+            runCmd([self.makefs_cmd] + debug_options + self.makefs_flags() + [
                 self.diskImagePath,  # output file
                 self.manifestFile,  # use METALOG as the manifest for the disk image
                 # extra directories:
@@ -366,6 +519,13 @@ class _BuildDiskImageBase(SimpleProject):
             self.queryYesNo("About to delete the temporary directory. Copy any files you need before pressing enter.",
                             yesNoStr="")
             raise
+        finally:
+            for link in dedup_hardlinks:
+                self.deleteFile(link)
+        if not self.config.pretend:
+            statusUpdate("makefs took {:.2f} seconds, image size is".format(time.time() - makefs_start),
+                         format_size(self.diskImagePath.stat().st_size), "(" +
+                         format_size(self.diskImagePath.stat().st_blocks * 512), "allocated)")
 
         # Converting QEMU images: https://en.wikibooks.org/wiki/QEMU/Images
         if not self.config.quiet:
@@ -373,7 +533,7 @@ class _BuildDiskImageBase(SimpleProject):
         if self.useQCOW2:
             # create a qcow2 version from the raw image:
             rawImg = self.diskImagePath.with_suffix(".raw")
-            runCmd("mv", "-f", self.diskImagePath, rawImg)
+            self.moveFile(self.diskImagePath, rawImg, force=True)
             runCmd(qemuImgCommand, "convert",
                    "-f", "raw",  # input file is in raw format (not required as QEMU can detect it
                    "-O", "qcow2",  # convert to qcow2 format
@@ -382,6 +542,8 @@ class _BuildDiskImageBase(SimpleProject):
             self.deleteFile(rawImg, printVerboseOnly=True)
             if self.config.verbose:
                 runCmd(qemuImgCommand, "info", self.diskImagePath)
+        if fingerprint is not None:
+            self._save_image_fingerprint(fingerprint)
 
     def copyFromRemoteHost(self):
         statusUpdate("Cannot build disk image on non-FreeBSD systems, will attempt to copy instead.")
@@ -409,14 +571,20 @@ class _BuildDiskImageBase(SimpleProject):
             # Given a directory, derive the default file name inside it
             self.diskImagePath = _defaultDiskImagePath(self.config.cheriBits, self.diskImagePath)
 
+        self._previous_fingerprint = None
         if self.diskImagePath.is_file():
-            # only show prompt if we can actually input something to stdin
+            # No need to ask if we created the image and it has not been modified since: makeImage() will only
+            # rebuild it if any of the inputs changed.
             if not self.config.clean:
-                # with --clean always delete the image
-                print("An image already exists (" + str(self.diskImagePath) + "). ", end="")
-                if not self.queryYesNo("Overwrite?", defaultResult=True):
-                    return  # we are done here
-            self.deleteFile(self.diskImagePath)
+                self._previous_fingerprint = self._load_image_fingerprint()
+            if self._previous_fingerprint is None:
+                # only show prompt if we can actually input something to stdin
+                if not self.config.clean:
+                    # with --clean always delete the image
+                    print("An image already exists (" + str(self.diskImagePath) + "). ", end="")
+                    if not self.queryYesNo("Overwrite?", defaultResult=True):
+                        return  # we are done here
+                self.deleteFile(self.diskImagePath)
 
         # we can only build disk images on FreeBSD, so copy the file if we aren't
         if not IS_FREEBSD and not self.crossBuildImage:
@@ -444,42 +612,47 @@ class _BuildDiskImageBase(SimpleProject):
         with tempfile.TemporaryDirectory() as tmp:
             self.tmpdir = Path(tmp)
             self.manifestFile = self.tmpdir / "METALOG"
+            # Shared by stripping, digests, deduplication and the fingerprint and only saved once: save() drops the
+            # entries that were not used by this instance once the cache grows too large.
+            self.digest_cache = FileDigestCache(self.config.buildRoot / ".cheribuild-file-digests.json")
             self.prepareRootfs()
             # now add all the user provided files to the image:
             # we have to make a copy as we modify self.extraFiles in self.addFileToImage()
-            for p in self.extraFiles.copy():
-                pathInImage = p.relative_to(self.extraFilesDir)
+            for p, (pathInImage, st) in list(self.extraFiles.items()):
                 self.print("Adding user provided file /", pathInImage, " to disk image.", sep="")
-                self.addFileToImage(p, baseDirectory=self.extraFilesDir)
+                self.addFileToImage(p, baseDirectory=self.extraFilesDir, pathInTarget=pathInImage, st=st)
 
             # then walk the rootfs to see if any additional files should be added:
             self.add_unlisted_files_to_metalog()
+            self.strip_elf_files()
 
             # finally create the disk image
             self.makeImage()
+            if not self.config.pretend:
+                self.digest_cache.save()
         self.tmpdir = None
         self.manifestFile = None
+        self.digest_cache = None
 
     def add_unlisted_files_to_metalog(self):
         unlisted_files = []
-        rootfs_str = str(self.rootfsDir)  # compat with python < 3.6
-        for root, dirnames, filenames in os.walk(rootfs_str):
-            for filename in filenames:
-                full_path = Path(root, filename)
-                target_path = os.path.relpath(str(full_path), rootfs_str)
-                if target_path.startswith("usr/local/") or target_path.startswith("opt/") or target_path.startswith(
-                        "extra/"):
-                    self.mtree.add_file(full_path, target_path, print_status=self.config.verbose)
-                elif target_path not in self.mtree:
-                    if target_path != "METALOG":  # METALOG is not added to METALOG
-                        unlisted_files.append((full_path, target_path))
+        # Everything in these directories is added to the image (they are not listed in METALOG)
+        always_added = ("usr/local", "opt", "extra")
+        for subdir in always_added:
+            if (self.rootfsDir / subdir).is_dir() and not (self.rootfsDir / subdir).is_symlink():
+                self.mtree.add_directory(self.rootfsDir / subdir, subdir, print_status=self.config.verbose)
+        for path, target_path, st in scan_files(self.rootfsDir, skip_dir=lambda d: d in always_added):
+            if target_path not in self.mtree and not target_path.endswith(DEDUPLICATION_HARDLINK_SUFFIX):
+                # METALOG is not added to METALOG (nor are indexes that were saved next to it)
+                if target_path != "METALOG" and not target_path.endswith(MtreeView.INDEX_SUFFIX):
+                    unlisted_files.append((path, target_path, st))
         if unlisted_files:
             print("Found the following files in the rootfs that are not listed in METALOG:")
             for i in unlisted_files:
                 print("\t", i[1])
             if self.queryYesNo("Should these files also be added to the image?", defaultResult=True, forceResult=True):
-                for i in unlisted_files:
-                    self.mtree.add_file(i[0], i[1], print_status=self.config.verbose)
+                for path, target_path, st in unlisted_files:
+                    self.mtree.add_file(Path(path), target_path, print_status=self.config.verbose, st=st)
 
     def generateSshHostKeys(self):
         # do the same as "ssh-keygen -A" just with a different output directory as it does not allow customizing that
@@ -501,6 +674,51 @@ class _BuildDiskImageBase(SimpleProject):
             self.addFileToImage(publicKey, baseDirectory=self.extraFilesDir, mode="0644")
 
 
+def scan_files(directory: Path, *, skip_dir: "typing.Callable[[str], bool]"=None
+               ) -> "typing.Iterator[typing.Tuple[str, str, os.stat_result]]":
+    """
+    Iterate over all files below directory (sorted by name). Like os.walk() this does not descend into symlinks to
+    directories (and does not return them). The os.scandir() entries are used directly which avoids the Path
+    objects and additional stat() calls that os.walk() + Path.relative_to() + Path.lstat() need. Also like os.walk()
+    directories that cannot be listed (e.g. a missing rootfs with --pretend) are ignored.
+    :param skip_dir: called with the relative path of every directory, returning True skips that directory
+    :return: (path, path relative to directory, lstat() result) for every file
+    """
+    pending = [(str(directory), "")]
+    while pending:
+        host_dir, relative_dir = pending.pop()
+        subdirs = []
+        try:
+            entries = sorted(os.scandir(host_dir), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            relpath = relative_dir + entry.name
+            if entry.is_dir():
+                if not entry.is_symlink() and not (skip_dir and skip_dir(relpath)):
+                    subdirs.append((entry.path, relpath + "/"))
+                continue
+            yield entry.path, relpath, entry.stat(follow_symlinks=False)
+        pending.extend(reversed(subdirs))
+
+
+def describe_fingerprint_changes(old: dict, new: dict, max_entries=10) -> "typing.List[str]":
+    """:return: a human-readable list of the differences between two disk image fingerprints"""
+    changes = []
+    for key in new.keys():
+        if key not in ("entries", "image") and old.get(key) != new[key]:
+            changes.append("{}: {} -> {}".format(key, old.get(key), new[key]))
+    old_entries = old.get("entries", dict())
+    new_entries = new["entries"]
+    entry_changes = ["added " + p for p in sorted(new_entries.keys() - old_entries.keys())]
+    entry_changes.extend("removed " + p for p in sorted(old_entries.keys() - new_entries.keys()))
+    entry_changes.extend("changed " + p for p in sorted(new_entries.keys() & old_entries.keys())
+                         if new_entries[p] != old_entries[p])
+    if len(entry_changes) > max_entries:
+        entry_changes = entry_changes[:max_entries] + ["... and {} more".format(len(entry_changes) - max_entries)]
+    return changes + entry_changes
+
+
 def _defaultDiskImagePath(bits, pfx, img_prefix=""):
     if bits == 128:
         return pfx / (img_prefix + "cheri128-disk.img")
@@ -83,7 +83,7 @@ class BuildElftoolchain(Project):
 
     def checkSystemDependencies(self):
         super().checkSystemDependencies()
-        if IS_MAC and not Path("/usr/local/opt/libarchive/lib").exists():
+        if IS_MAC and not cached_exists("/usr/local/opt/libarchive/lib"):
             self.dependencyError("libarchive is missing", installInstructions="Run `brew install libarchive`")
 
     def compile(self, **kwargs):
@@ -99,12 +99,15 @@ class BuildElftoolchain(Project):
             warningMessage("Could not determine bmake version:", e)
         if is_old_broken_bmake:
             # build is not parallel-safe -> we can't make with all the all-foo targets and -jN
-            # To speed it up run make for the individual library directories instead and then for all the binaries
+            # To speed it up run make for the individual library directories instead (in dependency order) and then
+            # build all the programs concurrently (they only depend on the libraries)
             first_call = True  # recreate logfile on first call, after that append
-            for tgt in self.libTargets + self.programsToBuild:
+            for tgt in self.libTargets:
                 self.runMake("obj", cwd=self.sourceDir / tgt, logfileName="build", appendToLogfile=not first_call)
                 self.runMake("all", cwd=self.sourceDir / tgt, logfileName="build", appendToLogfile=True)
                 first_call = False
+            self.run_make_in_directories([self.sourceDir / tgt for tgt in self.programsToBuild], "obj", "all",
+                                         logfileName="build", appendToLogfile=True)
         else:
             self.runMake("obj", cwd=self.sourceDir)
             self.runMake("all", cwd=self.sourceDir, appendToLogfile=True)
@@ -139,11 +142,11 @@ class BuildElftoolchain(Project):
         # The build system assumes all install directories already exist;
         for i in ("bin", "lib", "include", "share") + mandirs:
             self.makedirs(self.installDir / i)
-        firstCall = True  # recreate logfile on first call, after that append
-        for tgt in self.programsToBuild:
-            self.runMakeInstall(cwd=self.sourceDir / tgt, logfileName="install", appendToLogfile=not firstCall,
-                                parallel=False)
-            firstCall = False
+        # Every program directory installs different files -> install them concurrently
+        install_options = self.make_args.copy()
+        install_options.env_vars.update(self.makeInstallEnv)
+        self.run_make_in_directories([self.sourceDir / tgt for tgt in self.programsToBuild], "install",
+                                     options=install_options, logfileName="install")
 
         allInstalledTools = self.programsToBuild + self.extraPrograms
         for prog in allInstalledTools:
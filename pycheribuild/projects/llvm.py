@@ -129,8 +129,8 @@ class BuildLLVM(CMakeProject):
                 version_suffix = self.cCompiler.name[len("clang"):]
             self._addRequiredSystemTool("llvm-ar" + version_suffix)
             self._addRequiredSystemTool("llvm-ranlib" + version_suffix)
-            llvm_ar = shutil.which("llvm-ar" + version_suffix)
-            llvm_ranlib = shutil.which("llvm-ranlib" + version_suffix)
+            llvm_ar = cached_which("llvm-ar" + version_suffix)
+            llvm_ranlib = cached_which("llvm-ranlib" + version_suffix)
             self.add_cmake_options(LLVM_ENABLE_LTO="Thin", CMAKE_AR=llvm_ar, CMAKE_RANLIB=llvm_ranlib)
             if not self.canUseLLd(self.cCompiler):
                 warningMessage("LLD not found for LTO build, it may fail.")
@@ -251,6 +251,10 @@ class BuildUpstreamLLVMMonorepo(BuildLLVM):
     defaultInstallDir = ComputedDefaultValue(
         function=lambda config, project: config.outputRoot / "upstream-llvm-monorepo",
         asString="$INSTALL_ROOT/upstream-llvm-monorepo")
+    # We only build the llvm directory and the included projects so there is no need to check out the other ones
+    default_sparse_checkout = ComputedDefaultValue(
+        function=lambda config, project: ["llvm"] + project.included_projects.split(";"),
+        asString="llvm and the directories in --upstream-llvm-monorepo/include-projects")
     appendCheriBitsToBuildDir = False
 
     @classmethod
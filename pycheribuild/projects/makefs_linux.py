@@ -47,7 +47,7 @@ class BuildMakefsOnLinux(Project):
         if not IS_LINUX:
             return  # not need on FreeBSD
         super().checkSystemDependencies()
-        if not Path("/usr/include/bsd/bsd.h").is_file():
+        if not cached_is_file("/usr/include/bsd/bsd.h"):
             self.dependencyError("libbsd must be installed to compile makefs on linux")
 
     def compile(self, **kwargs):
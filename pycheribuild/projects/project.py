@@ -28,6 +28,7 @@
 # SUCH DAMAGE.
 #
 import copy
+import hashlib
 import io
 import inspect
 import os
@@ -41,6 +42,7 @@ import time
 import errno
 import sys
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path
 from copy import deepcopy
@@ -49,6 +51,8 @@ from ..config.loader import ConfigLoaderBase, ComputedDefaultValue, ConfigOption
 from ..config.chericonfig import CheriConfig, CrossCompileTarget
 from ..targets import Target, MultiArchTarget, MultiArchTargetAlias, targetManager
 from ..filesystemutils import FileSystemUtils
+from ..artifact_cache import ArtifactCache
+from ..git_object_store import GitObjectStore
 from ..utils import *
 
 __all__ = ["Project", "CMakeProject", "AutotoolsProject", "TargetAlias", "TargetAliasWithDependencies", # no-combine
@@ -147,6 +151,17 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
     # To check that we don't create an crosscompile targets without a fixed target
     _should_not_be_instantiated = False
     __cached_deps = None  # type: typing.List[Target]
+    # Whether the installed files of this target can be restored from the artifact cache (--artifact-cache). This
+    # requires a complete list of the installed files (see Project._artifact_cache_installed_files())
+    can_use_artifact_cache = False
+    # Target options that don't affect the installed files and should therefore not be part of the cache key
+    artifact_cache_ignored_options = ("source-directory", "build-directory", "install-directory", "skip-update",
+                                      "git-revision", "repository", "git-clone-mode", "sparse-checkout",
+                                      "shallow-submodules", "generate-cmakelists")
+    # Global options that affect the installed files of all targets
+    _artifact_cache_global_options = ("cheri-bits", "unified-sdk", "mips-float-abi", "cross-compile-linkage",
+                                      "cap-table-abi", "cross-target-suffix", "with-libstatcounters")
+    _cached_artifact_cache_inputs = None
 
     @classmethod
     def allDependencyNames(cls, config: CheriConfig) -> "typing.List[str]":
@@ -498,12 +513,12 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
         :return: Throws an error if dependencies are missing
         """
         for (tool, installInstructions) in self.__requiredSystemTools.items():
-            if not shutil.which(str(tool)):
+            if not cached_which(tool):
                 if installInstructions is None or installInstructions == "":
                     installInstructions = "Try installing `" + tool + "` using your system package manager."
                 self.dependencyError("Required program", tool, "is missing!", installInstructions=installInstructions)
         for (package, instructions) in self.__requiredPkgConfig.items():
-            if not shutil.which("pkg-config"):
+            if not cached_which("pkg-config"):
                 # error should already have printed above
                 break
             check_cmd = ["pkg-config", "--exists", package]
@@ -512,13 +527,100 @@ class SimpleProject(FileSystemUtils, metaclass=ProjectSubclassDefinitionHook):
             if exit_code != 0:
                 self.dependencyError("Required library", package, "is missing!", installInstructions=instructions)
         for (header, instructions) in self.__requiredSystemHeaders.items():
-            if not Path("/usr/include", header).exists() and not Path("/usr/local/include", header).exists():
+            if not cached_exists(Path("/usr/include", header)) and \
+                    not cached_exists(Path("/usr/local/include", header)):
                 self.dependencyError("Required C header", header, "is missing!", installInstructions=instructions)
         self._systemDepsChecked = True
 
     def process(self):
         raise NotImplementedError()
 
+    def _artifact_cache_source_inputs(self) -> "typing.Optional[typing.Dict[str, str]]":
+        """
+        :return: The git revision and a hash of all local changes (including untracked files and submodules) or
+        None if the source directory is not a git repository
+        """
+        if not self.sourceDir or not (self.sourceDir / ".git").exists():
+            return None
+
+        def git(*args) -> bytes:
+            return runCmd(("git",) + args, cwd=self.sourceDir, captureOutput=True, runInPretendMode=True,
+                          printVerboseOnly=True).stdout
+        local_changes = hashlib.sha256(git("diff", "HEAD", "--binary"))
+        local_changes.update(git("submodule", "status", "--recursive"))
+        for untracked in git("ls-files", "-z", "--others", "--exclude-standard").split(b"\0"):
+            if not untracked:
+                continue
+            local_changes.update(untracked + b"\0")
+            untracked_path = self.sourceDir / untracked.decode("utf-8")
+            if untracked_path.is_file():
+                local_changes.update(untracked_path.read_bytes())
+        return OrderedDict(revision=git("rev-parse", "HEAD").decode("utf-8").strip(),
+                           local_changes=local_changes.hexdigest())
+
+    def artifact_cache_inputs(self) -> "typing.Optional[typing.Dict[str, typing.Any]]":
+        """
+        :return: All inputs that determine the installed files of this target: the source revision, local changes,
+        the resolved options and the (recursive) keys of all dependencies. None if the result cannot be cached.
+        """
+        if self._cached_artifact_cache_inputs is not None:
+            return self._cached_artifact_cache_inputs
+        inputs = OrderedDict()
+        inputs["target"] = self.target
+        if self.sourceDir is not None:
+            inputs["source"] = self._artifact_cache_source_inputs()
+            if inputs["source"] is None:
+                self.verbose_print("Cannot cache", self.target, "since", self.sourceDir, "is not a git repository")
+                return None
+        options = OrderedDict()
+        for name in self._artifact_cache_global_options:
+            option = self._configLoader.options.get(name)
+            if option is not None:  # jenkins does not have all options
+                options[name] = option.__get__(self.config, self.config.__class__)
+        for name, option in sorted(self._configLoader.options.items()):
+            # noinspection PyProtectedMember
+            if option._owningClass is not self.__class__:
+                continue
+            if name.partition("/")[2] in self.artifact_cache_ignored_options:
+                continue
+            options[name] = option.__get__(self, self.__class__)
+        inputs["options"] = options
+        dependencies = OrderedDict()
+        for dep in self.direct_dependencies(self.config):
+            dep_inputs = dep.get_or_create_project(None, self.config).artifact_cache_inputs()
+            if dep_inputs is None:
+                self.verbose_print("Cannot cache", self.target, "since dependency", dep.name, "cannot be cached")
+                return None
+            dependencies[dep.name] = ArtifactCache.compute_key(dep_inputs)
+        inputs["dependencies"] = dependencies
+        self._cached_artifact_cache_inputs = inputs
+        return inputs
+
+    def _install_from_artifact_cache(self, inputs: "typing.Dict[str, typing.Any]", install_root: Path) -> bool:
+        cache = self.config.artifact_cache
+        key = ArtifactCache.compute_key(inputs)
+        if self.config.clean:
+            self.verbose_print("Not checking artifact cache for", self.target, "since --clean was passed")
+            return False
+        if cache.lookup(key) is None:
+            statusUpdate("No artifact cache entry for", self.target, "found, building it")
+            return False
+        self.makedirs(install_root)
+        cache.extract(key, install_root)
+        return True
+
+    def _store_in_artifact_cache(self, inputs: "typing.Dict[str, typing.Any]", install_root: Path,
+                                 files: "typing.Optional[typing.List[str]]"):
+        if files is None and not self.config.pretend:
+            warningMessage("Not adding", self.target, "to the artifact cache since the list of installed files is "
+                           "not known")
+            return
+        if not files and not self.config.pretend:
+            warningMessage("Not adding", self.target, "to the artifact cache since no installed files were found")
+            return
+        key = ArtifactCache.compute_key(inputs)
+        self.config.artifact_cache.store(key, install_root, files, target=self.target, inputs=inputs)
+
     def run_tests(self):
         # for the --test option
         statusUpdate("No tests defined for target", self.target)
@@ -671,7 +773,7 @@ class MakeOptions(object):
             self.__project._addRequiredSystemTool("make")
             return "make"
         elif self.kind == MakeCommandKind.GnuMake:
-            if IS_LINUX and not shutil.which("gmake"):
+            if IS_LINUX and not cached_which("gmake"):
                 statusUpdate("Could not find `gmake` command, assuming `make` is GNU make")
                 self.__project._addRequiredSystemTool("make")
                 return "make"
@@ -765,6 +867,14 @@ class Project(SimpleProject):
     gitRevision = None
     gitBranch = ""
     skipGitSubmodules = False
+    # Default values for the --<target>/git-clone-mode, --<target>/sparse-checkout and --<target>/shallow-submodules
+    # options (None for the clone mode means use the value of --git-clone-mode)
+    default_git_clone_mode = None
+    default_sparse_checkout = None  # type: typing.Optional[typing.List[str]]
+    default_shallow_submodules = False
+    git_clone_mode = None
+    sparse_checkout = None  # type: typing.Optional[typing.List[str]]
+    shallow_submodules = False
     compileDBRequiresBear = True
     doNotAddToTargets = True
     build_dir_suffix = ""   # add a suffix to the build dir (e.g. for freebsd-with-bootstrap-clang)
@@ -904,6 +1014,17 @@ class Project(SimpleProject):
                                                   metavar="REVISION")
             cls.repository = cls.addConfigOption("repository", kind=str, help="The URL of the git repository",
                                                  default=cls.repository, metavar="REPOSITORY")
+            cls.git_clone_mode = cls.addConfigOption("git-clone-mode", kind=str, metavar="MODE",
+                choices=("shallow", "full", "blobless", "treeless"),
+                default=cls.default_git_clone_mode or ComputedDefaultValue(
+                    lambda config, proj: config.git_clone_mode, "the value of the global --git-clone-mode option"),
+                help="Override --git-clone-mode for this target only")
+            cls.sparse_checkout = cls.addConfigOption("sparse-checkout", kind=list, metavar="DIRS",
+                default=cls.default_sparse_checkout,
+                help="Only check out these directories of the repository (using git sparse-checkout in cone mode). "
+                     "Only used for new clones and for repositories that already use a sparse checkout.")
+            cls.shallow_submodules = cls.addBoolOption("shallow-submodules", default=cls.default_shallow_submodules,
+                help="Only fetch the commits of git submodules that are referenced by the repository")
         if "generate_cmakelists" not in cls.__dict__:
             # Make sure not to dereference a parent class descriptor here -> use getattr_static
             option = inspect.getattr_static(cls, "generate_cmakelists")
@@ -955,6 +1076,39 @@ class Project(SimpleProject):
                                    self.__class__.__name__)
         self.__dict__[name] = value
 
+    @staticmethod
+    def _git_version() -> "typing.Tuple[int, int, int]":
+        git = cached_which("git")
+        return get_program_version(Path(git)) if git else (0, 0, 0)
+
+    def _git_clone_args(self, remoteUrl) -> "typing.List[str]":
+        if self.config.git_object_store:
+            object_store = GitObjectStore(self.config.git_object_store)
+            object_store.fetch(remoteUrl)
+            # The store already contains the full history so there is no need for a shallow or partial clone
+            return object_store.clone_args()
+        mode = self.git_clone_mode or self.config.git_clone_mode
+        if mode == "shallow":
+            return ["--depth", "1"]
+        elif mode in ("blobless", "treeless"):
+            # Partial clones need git 2.19 (and a server that supports uploadpack.allowFilter)
+            if self._git_version() < (2, 19):
+                warningMessage("git", mode, "clones require git 2.19 or newer, falling back to a shallow clone")
+                return ["--depth", "1"]
+            return ["--filter=blob:none" if mode == "blobless" else "--filter=tree:0"]
+        assert mode == "full", "Invalid git clone mode " + str(mode)
+        return []
+
+    def _git_sparse_checkout_paths(self, srcDir: Path) -> "typing.Optional[typing.List[str]]":
+        # The sparse checkout profile only applies to the main repository and not e.g. tools/clang for LLVM
+        if not self.sparse_checkout or srcDir != self.sourceDir:
+            return None
+        # git sparse-checkout was added in git 2.25
+        if self._git_version() < (2, 25):
+            warningMessage("Cannot use a sparse checkout for", srcDir, "since it requires git 2.25 or newer")
+            return None
+        return self.sparse_checkout
+
     def _ensureGitRepoIsCloned(self, *, srcDir: Path, remoteUrl, initialBranch=None, skipSubmodules=False):
         # git-worktree creates a .git file instead of a .git directory so we can't use .is_dir()
         if not (srcDir / ".git").exists():
@@ -963,25 +1117,136 @@ class Project(SimpleProject):
             print(srcDir, "is not a git repository. Clone it from' " + remoteUrl + "'?", end="")
             if not self.queryYesNo(defaultResult=False):
                 self.fatal("Sources for", str(srcDir), " missing!")
-            cloneCmd = ["git", "clone", "--depth", "1"]
+            cloneCmd = ["git", "clone"] + self._git_clone_args(remoteUrl)
+            sparse_checkout = self._git_sparse_checkout_paths(srcDir)
+            if sparse_checkout:
+                # Only check out the files in the root directory, the profile is set after cloning
+                cloneCmd.append("--sparse")
             if not skipSubmodules:
                 cloneCmd.append("--recurse-submodules")
+                if self.shallow_submodules:
+                    cloneCmd.append("--shallow-submodules")
             if initialBranch:
                 cloneCmd += ["--branch", initialBranch]
             runCmd(cloneCmd + [remoteUrl, srcDir], cwd="/")
+            if sparse_checkout:
+                runCmd("git", "sparse-checkout", "init", "--cone", cwd=srcDir, printVerboseOnly=True)
+                runCmd(["git", "sparse-checkout", "set"] + sparse_checkout, cwd=srcDir, printVerboseOnly=True)
+                # Submodules inside the newly checked out directories have not been cloned yet
+                if not skipSubmodules:
+                    self._update_git_submodules(srcDir, init=True)
+
+    def _update_git_submodules(self, srcDir: Path, init=False):
+        cmd = ["git", "submodule", "update", "--recursive"]
+        if init:
+            cmd.append("--init")
+        if self.shallow_submodules:
+            cmd += ["--depth", "1"]
+        runCmd(cmd, cwd=srcDir, printVerboseOnly=True)
+
+    @staticmethod
+    def _git_output(srcDir: Path, *args) -> "typing.Optional[str]":
+        """:return: the output of git or None if it failed"""
+        try:
+            return runCmd(("git",) + args, cwd=srcDir, captureOutput=True, captureError=True,
+                          printVerboseOnly=True).stdout.decode("utf-8").strip()
+        except subprocess.CalledProcessError:
+            return None
+
+    def _git_remote_heads(self, url: str) -> "typing.Optional[typing.Dict[str, str]]":
+        """:return: a dict mapping the branches of the remote to commit hashes (a single ls-remote per URL)"""
+        cache = self.config.git_update_state.remote_heads
+        if url not in cache:
+            output = self._git_output(Path("/"), "ls-remote", "--heads", url)
+            if output is None:
+                return None
+            heads = dict()
+            for line in output.splitlines():
+                commit, ref = line.split(None, 1)
+                heads[ref] = commit
+            cache[url] = heads
+        return cache[url]
+
+    def _git_upstream_unchanged(self, srcDir: Path, skipSubmodules: bool) -> bool:
+        """
+        Check if the upstream branch of srcDir has new commits without fetching or walking the working tree.
+        :return: True if the current branch already contains the remote branch and all submodules are checked out
+        at the recorded commit (i.e. git pull + git submodule update would not do anything)
+        """
+        if self.config.pretend:
+            return False
+        branch = self._git_output(srcDir, "symbolic-ref", "-q", "HEAD")
+        if not branch:
+            return False  # detached HEAD
+        short_branch = branch[len("refs/heads/"):]
+        config = self._git_output(srcDir, "config", "--get-regexp",
+                                  r"^(branch\." + re.escape(short_branch) + r"\.(remote|merge)|remote\..*\.url)$")
+        if not config:
+            return False
+        values = dict(line.split(None, 1) for line in config.splitlines() if " " in line)
+        remote = values.get("branch." + short_branch + ".remote")
+        merge_ref = values.get("branch." + short_branch + ".merge")
+        url = values.get("remote." + str(remote) + ".url")
+        if not merge_ref or not url:
+            return False
+        local_commits = self._git_output(srcDir, "rev-parse", "HEAD", "@{upstream}")
+        remote_heads = self._git_remote_heads(url)
+        if not local_commits or remote_heads is None:
+            return False
+        head, upstream = local_commits.split()
+        if remote_heads.get(merge_ref) != upstream:
+            return False
+        # Local commits on top of the upstream branch are fine (pull --rebase would be a no-op)
+        if head != upstream and self._git_output(srcDir, "merge-base", "--is-ancestor", upstream, head) is None:
+            return False
+        if not skipSubmodules and (srcDir / ".gitmodules").exists():
+            status = self._git_output(srcDir, "submodule", "status", "--recursive")
+            # "+" means that the checked out commit does not match the one recorded in the index
+            if status is None or any(line.startswith(("+", "U")) for line in status.splitlines()):
+                return False
+        return True
+
+    def _update_git_sparse_checkout(self, srcDir: Path):
+        # Update the sparse checkout profile in case it changed (e.g. for upstream-llvm-monorepo/include-projects)
+        sparse_checkout = self._git_sparse_checkout_paths(srcDir)
+        if sparse_checkout and (srcDir / ".git/info/sparse-checkout").exists():
+            runCmd(["git", "sparse-checkout", "set"] + sparse_checkout, cwd=srcDir, printVerboseOnly=True)
 
     def _updateGitRepo(self, srcDir: Path, remoteUrl, *, revision=None, initialBranch=None, skipSubmodules=False):
         self._ensureGitRepoIsCloned(srcDir=srcDir, remoteUrl=remoteUrl, initialBranch=initialBranch,
                                     skipSubmodules=skipSubmodules)
         if self.skipUpdate:
             return
+        start = time.time()
+        update_state = self.config.git_update_state
+        update_state.checked += 1
+        # Avoid git diff, git pull and git submodule update (which all walk the whole working tree) if there are no
+        # new commits upstream. This only needs one git ls-remote per remote URL.
+        if self._git_upstream_unchanged(srcDir, skipSubmodules):
+            duration = time.time() - start
+            self.verbose_print("Not updating", srcDir, "since the upstream branch has not changed")
+            update_state.record_skipped_update(srcDir, duration)
+            self._update_git_sparse_checkout(srcDir)
+            if revision:
+                runCmd("git", "checkout", revision, cwd=srcDir, printVerboseOnly=True)
+            return
+        self._update_git_repo_slow_path(srcDir, remoteUrl, revision=revision, skipSubmodules=skipSubmodules)
+        # Remember how long the full update took to report the time saved by skipping it next time
+        update_state.record_update_duration(srcDir, time.time() - start)
+
+    def _update_git_repo_slow_path(self, srcDir: Path, remoteUrl, *, revision, skipSubmodules):
+        if self.config.git_object_store:
+            object_store = GitObjectStore(self.config.git_object_store)
+            if object_store.is_used_by(srcDir):
+                # Fetch into the store first so that the objects are shared with all other clones
+                object_store.fetch(remoteUrl)
         # make sure we run git stash if we discover any local changes
         hasChanges = len(runCmd("git", "diff", "--stat", "--ignore-submodules",
                                 captureOutput=True, cwd=srcDir, printVerboseOnly=True).stdout) > 1
 
         pullCmd = ["git", "pull"]
         has_autostash = False
-        git_version = get_program_version(Path(shutil.which("git"))) if shutil.which("git") else (0, 0, 0)
+        git_version = self._git_version()
         # Use the autostash flag for Git >= 2.14 (https://stackoverflow.com/a/30209750/894271)
         if git_version >= (2, 14):
             has_autostash = True
@@ -1004,11 +1269,14 @@ class Project(SimpleProject):
                     # print("NO REAL CHANGES")
                     hasChanges = False  # probably git diff showed something from a submodule
 
-        if not skipSubmodules:
+        # With shallow submodules the full history of the submodules would be fetched by pull --recurse-submodules
+        # so we only fetch the referenced commits in the git submodule update step
+        if not skipSubmodules and not self.shallow_submodules:
             pullCmd.append("--recurse-submodules")
         runCmd(pullCmd + ["--rebase"], cwd=srcDir, printVerboseOnly=True)
+        self._update_git_sparse_checkout(srcDir)
         if not skipSubmodules:
-            runCmd("git", "submodule", "update", "--recursive", cwd=srcDir, printVerboseOnly=True)
+            self._update_git_submodules(srcDir)
         if hasChanges and not has_autostash:
             runCmd("git", "stash", "pop", cwd=srcDir, printVerboseOnly=True)
         if revision:
@@ -1083,6 +1351,79 @@ class Project(SimpleProject):
         # add a newline at the end in case it ended with a filtered line (no final newline)
         print("Running", make_command, makeTarget, "took", time.time() - starttime, "seconds")
 
+    def run_make_in_directories(self, directories: "typing.Sequence[Path]", *targets: str, logfileName: str,
+                                options: MakeOptions = None, appendToLogfile=False, max_jobs: int = None) -> None:
+        """
+        Run `make <target>` (without -j) for all targets in each of the directories, with up to max_jobs (defaults to
+        the number of make jobs) directories being built concurrently by separate make processes. This is useful for
+        independent directories whose build system is not parallel-safe. The commands and output of every directory
+        are shown and written to the logfile in the order of directories (and not interleaved).
+        """
+        if not options:
+            options = self.make_args
+        commands = [(d, [self.get_make_commandline(t, options=options, parallel=False) for t in targets])
+                    for d in directories]
+        if self.config.pretend:
+            for directory, cmds in commands:
+                for cmd in cmds:
+                    printCommand(cmd, cwd=directory, env=options.env_vars)
+            return
+        env = os.environ.copy()
+        env.update((k, str(v)) for k, v in options.env_vars.items())
+
+        def build(directory: Path, cmds: "typing.List[list]"):
+            results = []
+            for cmd in cmds:
+                cmd = list(map(str, cmd))
+                # Capture stdout and stderr together to keep warnings next to the output that caused them
+                proc = popen_handle_noexec(cmd, cwd=str(directory), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                           env=env)
+                output, _ = proc.communicate()
+                results.append((cmd, output, proc.returncode))
+                if proc.returncode:
+                    break
+            return results
+
+        logfilePath = Path(os.devnull) if self.config.noLogfile else self.buildDir / (logfileName + ".log")
+        if not self.config.noLogfile:
+            print("Saving build log to", logfilePath)
+            if logfilePath.is_file() and not appendToLogfile:
+                logfilePath.unlink()  # remove old logfile
+        starttime = time.time()
+        with ThreadPoolExecutor(max_workers=max_jobs or self.config.makeJobs or 1) as executor:
+            futures = [executor.submit(build, directory, cmds) for directory, cmds in commands]
+            with logfilePath.open("ab") as logfile:
+                for (directory, _), future in zip(commands, futures):
+                    for cmd, output, retcode in future.result():
+                        cmdStr = commandline_to_str(cmd)
+                        printCommand(cmd, cwd=directory, env=options.env_vars)
+                        logfile.write(("\n\ncd " + shlex.quote(str(directory)) + " && " + cmdStr +
+                                       "\n\n").encode("utf-8"))
+                        logfile.write(output)
+                        self._show_captured_output(output, failed=retcode != 0)
+                        if retcode:
+                            for f in futures:
+                                f.cancel()
+                            logfile.flush()
+                            self.fatal("Command \"" + cmdStr + "\" failed with exit code", retcode,
+                                       fixitHint="See " + str(logfilePath) + " for details.")
+        print("Running", options.command, " ".join(targets), "in", len(commands), "directories took",
+              time.time() - starttime, "seconds")
+
+    def _show_captured_output(self, output: bytes, *, failed=False):
+        # Show all output of failed commands since the error messages would otherwise be overwritten by the filter
+        if self.config.quiet and not failed:
+            return
+        if self.config.verbose or failed:
+            if self._lastStdoutLineCanBeOverwritten:
+                sys.stdout.buffer.write(b"\n")
+                self._lastStdoutLineCanBeOverwritten = False
+            sys.stdout.buffer.write(output)
+        else:
+            for line in output.splitlines(keepends=True):
+                self._stdoutFilter(line)
+        flushStdio(sys.stdout)
+
     def update(self):
         if not self.repository:
             self.fatal("Cannot update", self.projectName, "as it is missing a git URL", fatalWhenPretending=True)
@@ -1207,6 +1548,28 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
     def display_name(self):
         return self.projectName
 
+    def artifact_cache_inputs(self) -> "typing.Optional[typing.Dict[str, typing.Any]]":
+        if self._cached_artifact_cache_inputs is not None:
+            return self._cached_artifact_cache_inputs
+        inputs = super().artifact_cache_inputs()
+        if inputs is None:
+            return None
+        # The install prefix may be embedded in the installed files (only DESTDIR can be changed safely)
+        inputs["install-root"] = str(self.installPrefix) if self.destdir is not None else str(self.installDir)
+        compiler = getattr(self, "CC", None)
+        if compiler and Path(compiler).exists():
+            # CHERI clang includes the git revisions of clang and LLVM in the version output
+            inputs["compiler"] = get_version_output(Path(compiler)).decode("utf-8", errors="replace")
+        return inputs
+
+    def _artifact_cache_installed_files(self) -> "typing.Optional[typing.List[str]]":
+        """
+        :return: all files installed by this project (relative to self.real_install_root_dir) or None if they are not
+        known. Comparing the install directory before and after the install step is not enough since `install -C`
+        and up-to-date installs don't touch the existing files, so this requires an install manifest.
+        """
+        return None
+
     def process(self):
         if self.generate_cmakelists:
             self._do_generate_cmakelists()
@@ -1220,6 +1583,12 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
         if not self._systemDepsChecked:
             self.checkSystemDependencies()
         assert self._systemDepsChecked, "self._systemDepsChecked must be set by now!"
+        cache_inputs = None
+        if self.config.use_artifact_cache and self.can_use_artifact_cache and not self.config.configureOnly and \
+                not self.config.skipInstall:
+            cache_inputs = self.artifact_cache_inputs()
+            if cache_inputs is not None and self._install_from_artifact_cache(cache_inputs, self.real_install_root_dir):
+                return
 
         # run the rm -rf <build dir> in the background
         cleaningTask = self.clean() if self.config.clean else ThreadJoiner(None)
@@ -1240,6 +1609,9 @@ add_custom_target(cheribuild-full VERBATIM USES_TERMINAL COMMAND {command} {targ
             if not self.config.skipInstall:
                 statusUpdate("Installing", self.display_name, "... ")
                 self.install()
+                if cache_inputs is not None:
+                    self._store_in_artifact_cache(cache_inputs, self.real_install_root_dir,
+                                                  self._artifact_cache_installed_files())
 
 
 class CMakeProject(Project):
@@ -1308,7 +1680,7 @@ class CMakeProject(Project):
         # CMake is smart enough to detect when it must be reconfigured -> skip configure if cache exists
         cmakeCache = self.buildDir / "CMakeCache.txt"
         buildFile = "build.ninja" if self.generator == CMakeProject.Generator.Ninja else "Makefile"
-        return not cmakeCache.exists() or not (self.buildDir / buildFile).exists()
+        return not cached_exists(cmakeCache) or not cached_exists(self.buildDir / buildFile)
 
     def configure(self, **kwargs):
         if self.installPrefix:
@@ -1330,6 +1702,18 @@ class CMakeProject(Project):
             _stdoutFilter = self._cmakeInstallStdoutFilter
         super().install(_stdoutFilter=_stdoutFilter)
 
+    def _artifact_cache_installed_files(self) -> "typing.Optional[typing.List[str]]":
+        # CMake lists all installed files (including the up-to-date ones that were not copied again)
+        manifest = self.buildDir / "install_manifest.txt"
+        if not manifest.is_file():
+            return None
+        root = str(self.real_install_root_dir)
+        result = []
+        for line in manifest.read_text(encoding="utf-8").splitlines():
+            if line and os.path.lexists(line) and line.startswith(root + "/"):
+                result.append(os.path.relpath(line, root))
+        return sorted(result)
+
     def _get_cmake_version(self):
         cmd = Path(self.configureCommand)
         assert self.configureCommand is not None
@@ -1341,7 +1725,7 @@ class CMakeProject(Project):
 
     def checkSystemDependencies(self):
         if not Path(self.configureCommand).is_absolute():
-            abspath = shutil.which(self.configureCommand)
+            abspath = cached_which(self.configureCommand)
             if abspath:
                 self.configureCommand = abspath
         super().checkSystemDependencies()
@@ -1398,7 +1782,7 @@ class AutotoolsProject(Project):
         super().configure(**kwargs)
 
     def needsConfigure(self):
-        return not (self.buildDir / "Makefile").exists()
+        return not cached_exists(self.buildDir / "Makefile")
 
 # A target that is just an alias for at least one other targets but does not force building of dependencies
 class TargetAlias(SimpleProject):
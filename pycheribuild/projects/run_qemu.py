@@ -69,7 +69,7 @@ class LaunchQEMUBase(SimpleProject):
 
         default_smb_dir = None
         # Only default to providing the smb mount if smbd exists
-        if cls._provide_src_via_smb and shutil.which("smbd"):  # for running CheriBSD + FreeBSD
+        if cls._provide_src_via_smb and cached_which("smbd"):  # for running CheriBSD + FreeBSD
             default_smb_dir = ComputedDefaultValue(function=lambda cfg, proj: cfg.sourceRoot,
                                                    asString="$CHERIBUILD_SOURCE_ROOT")
         cls.qemu_smb_mount = cls.addPathOption("smb-host-directory", default=default_smb_dir, metavar="DIR",
@@ -320,8 +320,8 @@ class LaunchFreeBSDX86(AbstractLaunchFreeBSD):
     def __init__(self, config):
         super().__init__(config, disk_image_class=BuildFreeBSDDiskImageX86)
         self._addRequiredSystemTool("qemu-system-x86_64")
-        qemu_path = shutil.which("qemu-system-x86_64")
-        self.qemuBinary = Path(qemu_path if qemu_path else shutil.which("false"))
+        qemu_path = cached_which("qemu-system-x86_64")
+        self.qemuBinary = Path(qemu_path if qemu_path else cached_which("false"))
         self.machineFlags = []  # default cpu
         self.currentKernel = None  # needs the bootloader
 
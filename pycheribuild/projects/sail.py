@@ -29,10 +29,9 @@
 #
 import os
 from .project import *
-from ..utils import runCmd, setEnv, coloured, AnsiColour, commandline_to_str, printCommand, get_program_version, IS_LINUX
+from ..utils import runCmd, setEnv, coloured, AnsiColour, commandline_to_str, printCommand, get_program_version, IS_LINUX, cached_which
 from subprocess import CalledProcessError
 import shlex
-import shutil
 
 class OpamMixin(object):
 
@@ -48,7 +47,7 @@ class OpamMixin(object):
     def checkSystemDependencies(self):
         assert isinstance(self, SimpleProject)
         super().checkSystemDependencies()
-        opam_path = shutil.which("opam")
+        opam_path = cached_which("opam")
         if opam_path:
             opam_version = get_program_version(Path(opam_path), regex=b"(\\d+)\\.(\\d+)\\.?(\\d+)?")
             if opam_version < (2, 0, 0):
@@ -57,7 +56,7 @@ class OpamMixin(object):
 
     @property
     def opam_binary(self):
-        return shutil.which("opam") or "opam"
+        return cached_which("opam") or "opam"
 
     def _opam_cmd(self, command, *args):
         cmdline = [self.opam_binary, command, "--root=" + str(self.opamroot)]
@@ -100,8 +100,7 @@ class BuildFreestandingSdk(SimpleProject):
             for tool in set(toolsToSymlink):
                 self.createBuildtoolTargetSymlinks(sdkBinDir / tool)
             # For some reason CheriBSD does not build a cross ar, let's symlink the system one to the SDK bindir
-            runCmd("ln", "-fsn", shutil.which("ar"), sdkBinDir / "ar",
-                   cwd=self.config.sdkDir / "bin", printVerboseOnly=True)
+            self.createSymlink(Path(shutil.which("ar")), sdkBinDir / "ar", relative=False)
             self.createBuildtoolTargetSymlinks(sdkBinDir / "ar")
             # install ld as ld.bfd and add a symlink
             self.installFile(self.cheribsdBuildRoot / "tmp/usr/bin/ld", sdkBinDir / "ld.bfd")
@@ -0,0 +1,137 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import hashlib
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .copy_file import copy_file
+from .file_digests import FileDigestCache, file_sha256
+from .utils import *
+
+__all__ = ["StripCache", "is_elf_file"]  # no-combine
+
+
+def is_elf_file(path: "typing.Union[str, Path]") -> bool:
+    try:
+        with open(str(path), "rb") as f:
+            return f.read(4) == b"\x7fELF"
+    except OSError:
+        return False
+
+
+class StripCache(object):
+    """
+    Directory of stripped ELF files keyed by the sha256 of the input file and the strip command (including the size
+    and mtime of the strip binary) so that unchanged binaries are only stripped once. The stripped files are
+    reflinked (or copied if that is not supported) to the requested output path. They must not be hardlinked since
+    identical inputs would then share one inode and makefs would use the mode/owner of that inode for all of them.
+    """
+    # Stripped files that have not been used for this long (based on the access time) are deleted by prune()
+    MAX_AGE = 30 * 24 * 60 * 60
+
+    def __init__(self, directory: Path, strip_command: "typing.List[str]"):
+        self.directory = directory
+        self.strip_command = [str(s) for s in strip_command]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        try:
+            tool_st = os.stat(self.strip_command[0])
+            tool_id = "{}:{}".format(tool_st.st_size, tool_st.st_mtime_ns)
+        except OSError:
+            tool_id = ""
+        self._command_key = "\0".join([tool_id] + self.strip_command)
+
+    def _cache_path(self, digest: str) -> str:
+        key = hashlib.sha256((digest + "\0" + self._command_key).encode("utf-8")).hexdigest()
+        return os.path.join(str(self.directory), key[:2], key)
+
+    def strip(self, src: Path, dest: Path, digests: FileDigestCache=None) -> bool:
+        """:return: True if the stripped file was found in the cache"""
+        digest = digests.digest(str(src))[1] if digests is not None else file_sha256(str(src))
+        cached = self._cache_path(digest)
+        try:
+            # Only update the access time for prune() and keep the mtime of the stripped file
+            os.utime(cached, ns=(int(time.time() * 1000000000), os.stat(cached).st_mtime_ns))
+            hit = True
+        except FileNotFoundError:
+            hit = False
+        if not hit:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            # Strip to a temporary file so that an interrupted build does not leave a truncated file in the cache
+            tmpfile = cached + "." + str(os.getpid()) + "." + str(threading.get_ident())
+            try:
+                subprocess.check_output(self.strip_command + [str(src), "-o", tmpfile], stderr=subprocess.STDOUT)
+                os.replace(tmpfile, cached)
+            finally:
+                if os.path.exists(tmpfile):
+                    os.unlink(tmpfile)
+        copy_file(cached, dest)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return hit
+
+    def strip_files(self, files: "typing.List[typing.Tuple[Path, Path]]", *, digests: FileDigestCache=None,
+                    jobs: int=None):
+        """
+        Strip all (src, dest) pairs using a thread pool. Raises subprocess.CalledProcessError (with the output of
+        the strip command) if any of them could not be stripped.
+        """
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            futures = [executor.submit(self.strip, src, dest, digests) for src, dest in files]
+            for future in futures:
+                future.result()
+
+    def prune(self, max_age: float=None):
+        if max_age is None:
+            max_age = self.MAX_AGE
+        oldest = time.time() - max_age
+        if not self.directory.is_dir():
+            return
+        for subdir in os.listdir(str(self.directory)):
+            subdir = os.path.join(str(self.directory), subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                path = os.path.join(subdir, name)
+                try:
+                    if os.stat(path).st_atime < oldest:
+                        os.unlink(path)
+                except OSError as e:
+                    warningMessage("Could not remove stale strip cache entry", path, e)
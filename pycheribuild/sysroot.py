@@ -0,0 +1,144 @@
+#
+# Copyright (c) 2018 Alex Richardson
+# All rights reserved.
+#
+# This software was developed by SRI International and the University of
+# Cambridge Computer Laboratory under DARPA/AFRL contract FA8750-10-C-0237
+# ("CTSRD"), as part of the DARPA CRASH research programme.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR AND CONTRIBUTORS ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+#
+import errno
+import os
+import stat
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .copy_file import copy_file, default_copy_tree_jobs
+from .mtree import MtreeFile, MtreeView
+from .utils import *
+
+__all__ = ["populate_sysroot_from_metalog", "sysroot_symlink_target", "SYSROOT_DIRECTORIES"]  # no-combine
+
+# The directories of the rootfs that are needed for cross-compiling (everything else is only needed at run time)
+SYSROOT_DIRECTORIES = ("lib", "usr/include", "usr/lib", "usr/libcheri", "usr/libdata")
+
+
+def _is_sysroot_path(path: str) -> bool:
+    return any(path == d or path.startswith(d + "/") for d in SYSROOT_DIRECTORIES)
+
+
+def sysroot_symlink_target(path: str, target: str) -> str:
+    """
+    :param path: the path of the symlink relative to the sysroot
+    :param target: the target of the symlink
+    :return: target converted to a relative path if it is absolute (e.g. /usr/lib/libc.so -> /lib/libc.so.7) so that
+    the link points inside the sysroot instead of to the files of the host system
+    """
+    if not target.startswith("/"):
+        return target
+    return os.path.relpath(target, "/" + os.path.dirname(path))
+
+
+def _install_sysroot_file(rootfs: str, sysroot: str, previous_sysroot: "typing.Optional[str]", path: str) -> bool:
+    """:return: True if the file was hardlinked from the previous sysroot"""
+    src = os.path.join(rootfs, path)
+    dest = os.path.join(sysroot, path)
+    if previous_sysroot is not None:
+        try:
+            src_stat = os.stat(src)
+            previous = os.path.join(previous_sysroot, path)
+            previous_stat = os.lstat(previous)
+            # Files are copied with their timestamps so unchanged size + mtime means that it was not reinstalled
+            if stat.S_ISREG(previous_stat.st_mode) and previous_stat.st_size == src_stat.st_size and \
+                    previous_stat.st_mtime_ns == src_stat.st_mtime_ns:
+                os.link(previous, dest)
+                return True
+        except OSError:
+            pass  # not in the previous sysroot (or on a different file system) -> copy it
+    copy_file(src, dest, preserve_timestamps=True, follow_symlinks=True)
+    return False
+
+
+def populate_sysroot_from_metalog(metalog: "typing.Union[MtreeFile, MtreeView]", rootfs: Path, sysroot: Path, *,
+                                  previous_sysroot: Path = None, jobs: int = None,
+                                  missing_ok=False) -> "OrderedDict[str, int]":
+    """
+    Copy all files from SYSROOT_DIRECTORIES that are listed in metalog (the mtree file created by a NO_ROOT
+    installworld) from rootfs to sysroot. This is an alternative to `bsdtar cf - @METALOG | tar xf -` and the fixlinks
+    program: files are copied (or reflinked) in parallel and symlinks are created with relative targets directly.
+    :param previous_sysroot: a sysroot created by an earlier run. Files that have not changed since then are
+    hardlinked instead of being copied again.
+    Passing a MtreeView avoids parsing the entries outside of SYSROOT_DIRECTORIES.
+    :param missing_ok: only count files that are listed in metalog but don't exist instead of failing
+    :return: statistics about the number of files/symlinks that were created
+    :raises FileNotFoundError: if files listed in metalog are missing (after all other files have been copied)
+    """
+    directories = set()
+    files = []
+    symlinks = []
+    entries = metalog.entries_below(*SYSROOT_DIRECTORIES) if isinstance(metalog, MtreeView) else metalog
+    for entry in entries:
+        if entry.path == ".":
+            continue
+        path = entry.path[2:]
+        if not _is_sysroot_path(path):
+            continue
+        kind = entry.attributes.get("type")
+        if kind == "dir":
+            directories.add(path)
+            continue
+        directories.add(os.path.dirname(path))
+        if kind == "link":
+            symlinks.append((path, entry.attributes["link"]))
+        else:
+            files.append(path)
+    for d in sorted(directories):
+        os.makedirs(os.path.join(str(sysroot), d), exist_ok=True)
+
+    stats = OrderedDict(files=len(files), hardlinked=0, symlinks=len(symlinks), fixed_symlinks=0, missing=0)
+    previous = str(previous_sysroot) if previous_sysroot is not None and previous_sysroot.is_dir() else None
+    with ThreadPoolExecutor(max_workers=jobs or default_copy_tree_jobs()) as executor:
+        futures = [executor.submit(_install_sysroot_file, str(rootfs), str(sysroot), previous, f) for f in files]
+        # Create the symlinks while the files are being copied
+        for path, target in symlinks:
+            new_target = sysroot_symlink_target(path, target)
+            if new_target != target:
+                stats["fixed_symlinks"] += 1
+            link = os.path.join(str(sysroot), path)
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(new_target, link)
+    missing = []
+    for path, future in zip(files, futures):
+        try:
+            if future.result():
+                stats["hardlinked"] += 1
+        except FileNotFoundError:
+            missing.append(path)
+    stats["missing"] = len(missing)
+    if missing and not missing_ok:
+        # Same as bsdtar @METALOG, which fails if any of the listed files can't be found
+        raise FileNotFoundError(errno.ENOENT, "Files listed in METALOG do not exist in " + str(rootfs) + ": " +
+                                ", ".join(missing))
+    return stats
@@ -92,6 +92,22 @@ class Target(object):
             project.process()
         statusUpdate("Built target '" + self.name + "' in", time.time() - starttime, "seconds")
         self._completed = True
+        # Always record the last use (also for --build-dir-usage) so that the quota can be enabled at any time
+        for kind, path in self.directories(project):
+            config.build_dir_manager.record_use(self.name, kind, path)
+
+    @staticmethod
+    def directories(project: "SimpleProject") -> "typing.List[typing.Tuple[str, Path]]":
+        """:return: the (kind, path) pairs of the build and install directories used by project"""
+        result = []
+        build_dir = getattr(project, "buildDir", None)
+        # in-source builds (e.g. sqlite) must not be treated as build directories
+        if build_dir and build_dir != getattr(project, "sourceDir", None):
+            result.append(("build", build_dir))
+        install_dir = getattr(project, "installDir", None)
+        if install_dir:
+            result.append(("install", install_dir))
+        return result
 
     def run_tests(self, config: "CheriConfig"):
         if self._tests_have_run:
@@ -311,6 +327,8 @@ class TargetManager(object):
 
         for target in chosenTargets:
             target.checkSystemDeps(config)
+        if config.build_dir_quota is not None and not config.print_targets_only:
+            self.evict_unused_build_dirs(config, chosenTargets)
         # all dependencies exist -> run the targets
         for target in chosenTargets:
             if config.print_targets_only:
@@ -319,6 +337,19 @@ class TargetManager(object):
             else:
                 target.execute(config)
 
+    @staticmethod
+    def evict_unused_build_dirs(config: CheriConfig, chosenTargets: "typing.Iterable[Target]"):
+        keep = []
+        for target in chosenTargets:
+            project = target.get_or_create_project(None, config)
+            keep.extend(path for _, path in target.directories(project))
+            if getattr(project, "sourceDir", None):
+                keep.append(project.sourceDir)
+        removed, freed = config.build_dir_manager.evict(keep, lambda path: config.deletion_service.submit(
+            path, config.FS._delete_directories_in_background))
+        if removed:
+            statusUpdate("Evicted", removed, "build directories, freeing", format_size(freed))
+
     def get_all_chosen_targets(self, config) -> "typing.Iterable[Target]":
         # check that all target dependencies are correct:
         for t in self._allTargets.values():
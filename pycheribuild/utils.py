@@ -40,6 +40,7 @@ import tempfile
 import threading
 import traceback
 from .colour import coloured, AnsiColour, statusUpdate, warningMessage
+from .metadata_cache import *
 from collections import namedtuple
 from pathlib import Path
 
@@ -60,7 +61,8 @@ __all__ = ["typing", "IS_LINUX", "IS_FREEBSD", "IS_MAC", "printCommand", "includ
            "warningMessage", "Type_T", "typing", "popen_handle_noexec", "extract_version", "get_program_version", # no-combine
            "check_call_handle_noexec", "ThreadJoiner", "getCompilerInfo", "latestClangTool", "SafeDict", # no-combine
            "defaultNumberOfMakeJobs", "commandline_to_str", "OSInfo", "is_jenkins_build", "get_global_config",  # no-combine
-           "get_version_output"]  # no-combine
+           "get_version_output", "metadata_cache", "cached_exists", "cached_is_dir", "cached_is_file",  # no-combine
+           "cached_listdir", "cached_stat", "cached_which", "invalidate_cached_metadata", "format_size"]  # no-combine
 
 
 if sys.version_info < (3, 4):
@@ -248,6 +250,10 @@ def runCmd(*args, captureOutput=False, captureError=False, input: "typing.Union[
             process.kill()
             process.wait()
             raise
+        finally:
+            # The command could have changed any file (commands run in pretend mode only query information)
+            if not (_cheriConfig and _cheriConfig.pretend):
+                metadata_cache.clear()
         retcode = process.poll()
         if retcode:
             if _cheriConfig and _cheriConfig.pretend and not raiseInPretendMode:
@@ -369,15 +375,15 @@ def latestClangTool(basename: str):
         else:
             suffix1 = ("%d%d" % version)
             suffix2 = ("-%d.%d" % version)
-        guess = shutil.which(basename + suffix1)
+        guess = cached_which(basename + suffix1)
         if guess:
             found_versioned_clang = (guess, version)
             break
-        guess = shutil.which(basename + suffix2)
+        guess = cached_which(basename + suffix2)
         if guess:
             found_versioned_clang = (guess, version)
             break
-    guess = shutil.which(basename)
+    guess = cached_which(basename)
     if guess:
         if found_versioned_clang[0] is None:
             return guess
@@ -388,6 +394,13 @@ def latestClangTool(basename: str):
     return found_versioned_clang[0]
 
 
+def format_size(size: int) -> str:
+    for unit in ("bytes", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024 or unit == "GiB":
+            return "{:.1f} {}".format(size, unit) if unit != "bytes" else "{} {}".format(size, unit)
+        size /= 1024.0
+
+
 def defaultNumberOfMakeJobs():
     makeJobs = os.cpu_count()
     if makeJobs > 24:
@@ -48,6 +48,13 @@ import typing
 from pathlib import Path
 from contextlib import closing
 
+try:
+    # The disk images are several GB -> use reflinks/copy_file_range() if possible
+    sys.path.append(str(Path(__file__).absolute().parent.parent))
+    from pycheribuild.copy_file import copy_file
+except ImportError:
+    copy_file = shutil.copy
+
 STARTING_INIT = "start_init: trying /sbin/init"
 BOOT_FAILURE = "Enter full pathname of shell or RETURN for /bin/sh"
 SHELL_OPEN = "exec /bin/sh"
@@ -513,11 +520,11 @@ def main(test_function:"typing.Callable[[CheriBSDInstance, argparse.Namespace, .
     if args.extract_images_to:
         os.makedirs(args.extract_images_to, exist_ok=True)
         new_kernel_path = os.path.join(args.extract_images_to, Path(args.kernel).name)
-        shutil.copy(args.kernel, new_kernel_path)
+        copy_file(args.kernel, new_kernel_path)
         args.kernel = new_kernel_path
         if args.disk_image:
             new_image_path = os.path.join(args.extract_images_to, Path(args.disk_image).name)
-            shutil.copy(args.disk_image, new_image_path)
+            copy_file(args.disk_image, new_image_path)
             args.disk_image = new_image_path
 
         force_decompression = True
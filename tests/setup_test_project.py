@@ -0,0 +1,69 @@
+import os
+import subprocess
+from pathlib import Path
+
+from pycheribuild.projects.project import SimpleProject
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+GIT_IDENTITY = dict(GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+                    GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com")
+
+
+def create_test_project(project_class: "typing.Type[SimpleProject]", root: Path, **config_overrides):
+    """Instantiate project_class with a mock config that really runs commands (no --pretend) below root"""
+    config = setup_mock_chericonfig(root)
+    config.pretend = False
+    config.verbose = False
+    config.quiet = True
+    config.force = True
+    config.skipClone = False
+    config.skipUpdate = False
+    config.git_object_store = None
+    for k, v in config_overrides.items():
+        setattr(config, k, v)
+    project_class.setupConfigOptions()
+    return project_class(config)
+
+
+def git(*args, cwd: Path = None) -> str:
+    # Not computed once since some tests change the environment with monkeypatch.setenv()
+    return subprocess.check_output(["git"] + list(args), cwd=str(cwd) if cwd else None,
+                                   env=dict(os.environ, **GIT_IDENTITY),
+                                   stderr=subprocess.DEVNULL).decode("utf-8").strip()
+
+
+def commit_file(repo: Path, name: str, contents: str):
+    (repo / name).write_text(contents)
+    git("add", name, cwd=repo)
+    git("commit", "-q", "-m", "Update " + name, cwd=repo)
+
+
+def commit_random_files(repo: Path, count: int, *, prefix="file", subdirs=(".",), files_per_subdir: int = None,
+                        size=16 * 1024):
+    """
+    Create count commits that each add a random file (prefix + commit number) in every subdir
+    :param files_per_subdir: overwrite the same files (prefix + commit number % files_per_subdir) instead
+    """
+    for i in range(count):
+        name = prefix + str(i % files_per_subdir if files_per_subdir else i)
+        for subdir in subdirs:
+            (repo / subdir).mkdir(exist_ok=True)
+            with (repo / subdir / name).open("wb") as f:
+                f.write(os.urandom(size))
+        git("add", ".", cwd=repo)
+        git("commit", "-q", "-m", "commit " + str(i), cwd=repo)
+
+
+def git_dir_size(path: Path) -> int:
+    """:return: the size of all files in the bare repository path, in path/.git or in path/*/.git for a source root"""
+    if path.name.endswith(".git"):
+        git_dirs = [path]
+    elif (path / ".git").is_dir():
+        git_dirs = [path / ".git"]
+    else:
+        git_dirs = [p / ".git" for p in path.iterdir()]
+    total = 0
+    for git_dir in git_dirs:
+        for dirpath, _, filenames in os.walk(str(git_dir)):
+            total += sum(os.lstat(os.path.join(dirpath, f)).st_size for f in filenames)
+    return total
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+# noinspection PyProtectedMember
+from pycheribuild import archive as archive_module
+from pycheribuild.archive import create_archive, archive_command, archive_compression_for_name
+
+
+def _create_sysroot(root: Path, num_files=200):
+    for i in range(num_files):
+        subdir = root / "usr" / ("lib" if i % 2 else "include") / ("dir" + str(i % 5))
+        subdir.mkdir(parents=True, exist_ok=True)
+        # Compressible contents (like headers and libraries)
+        (subdir / ("file" + str(i))).write_bytes((b"int function" + str(i).encode() + b"(void);\n") * (i * 10))
+    (root / "lib").mkdir(exist_ok=True)
+    (root / "lib/libc.so").symlink_to("../usr/lib/dir1/file1")
+
+
+def _sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _no_external_compressors(monkeypatch):
+    monkeypatch.setattr(archive_module.shutil, "which", lambda cmd: None)
+
+
+def test_compression_for_name():
+    assert archive_compression_for_name("cheribsd-sysroot.tar.gz") == "gzip"
+    assert archive_compression_for_name(Path("cheri-sdk.tgz")) == "gzip"
+    assert archive_compression_for_name("cheribsd-mips.tar.xz") == "xz"
+    assert archive_compression_for_name("sdk.tar.zst") == "zstd"
+    assert archive_compression_for_name("sdk.tar") == "none"
+    assert archive_compression_for_name("sdk.zip") is None
+
+
+@pytest.mark.parametrize("compression", ["gzip", "xz"])
+@pytest.mark.parametrize("in_process", [False, True])
+def test_create_archive(monkeypatch, compression, in_process):
+    if in_process:
+        _no_external_compressors(monkeypatch)
+        # Use small blocks to check that the blocks are written in the right order
+        suffixes, commands, compress_block, _ = archive_module.ARCHIVE_COMPRESSIONS[compression]
+        monkeypatch.setitem(archive_module.ARCHIVE_COMPRESSIONS, compression,
+                            (suffixes, commands, compress_block, 4096))
+    with tempfile.TemporaryDirectory() as td:
+        sysroot = Path(td, "sysroot")
+        _create_sysroot(sysroot)
+        output = Path(td, "sysroot.tar." + ("gz" if compression == "gzip" else "xz"))
+        stats = create_archive(output, sysroot, jobs=4)
+        assert stats["compressed_size"] == output.stat().st_size
+        assert stats["compressed_size"] < stats["uncompressed_size"]
+        if in_process or not shutil.which(archive_module.ARCHIVE_COMPRESSIONS[compression][1][0][0]):
+            assert stats["compressor"] == "in-process " + compression
+        assert not Path(td, output.name + ".tmp").exists()
+        # The system tar must be able to extract the concatenated gzip members/xz streams
+        extracted = Path(td, "extracted")
+        extracted.mkdir()
+        subprocess.check_call(["tar", "-xf", str(output), "-C", str(extracted)])
+        for f in sysroot.rglob("*"):
+            copy = extracted / "sysroot" / f.relative_to(sysroot)
+            if f.is_symlink():
+                assert os.readlink(str(copy)) == os.readlink(str(f))
+            elif f.is_file():
+                assert copy.read_bytes() == f.read_bytes()
+        with tarfile.open(str(output)) as tar:
+            names = tar.getnames()
+            # directories are listed in sorted order before their contents
+            assert names[:4] == ["sysroot", "sysroot/lib", "sysroot/usr", "sysroot/lib/libc.so"]
+            assert len(names) == len(list(sysroot.rglob("*"))) + 1
+            assert all(m.uid == 0 and m.gid == 0 and m.uname == "" and m.gname == "" for m in tar.getmembers())
+            assert len(set(m.mtime for m in tar.getmembers())) == 1
+
+
+def test_archive_is_reproducible(monkeypatch):
+    monkeypatch.delenv("SOURCE_DATE_EPOCH", raising=False)
+    with tempfile.TemporaryDirectory() as td:
+        first = Path(td, "first/sysroot")
+        second = Path(td, "second/sysroot")
+        _create_sysroot(first)
+        _create_sysroot(second)
+        for f in second.rglob("*"):
+            os.utime(str(f), (12345, 12345), follow_symlinks=False)
+        for compression in ("gzip", "xz", "none"):
+            create_archive(Path(td, "first.tar"), first, compression=compression)
+            create_archive(Path(td, "second.tar"), second, compression=compression)
+            assert _sha256(Path(td, "first.tar")) == _sha256(Path(td, "second.tar")), compression
+        # The in-process compressor also produces the same output for every run
+        _no_external_compressors(monkeypatch)
+        create_archive(Path(td, "first.tar.gz"), first, jobs=1)
+        create_archive(Path(td, "second.tar.gz"), second, jobs=3)
+        assert _sha256(Path(td, "first.tar.gz")) == _sha256(Path(td, "second.tar.gz"))
+
+
+def test_jenkins_tarball_layout():
+    with tempfile.TemporaryDirectory() as td:
+        tarball = Path(td, "tarball")
+        (tarball / "opt/test/bin").mkdir(parents=True)
+        (tarball / "opt/test/bin/tool").write_text("tool")
+        output = Path(td, "test-mips.tar.xz")
+        create_archive(output, tarball, arcname=".")
+        with tarfile.open(str(output)) as tar:
+            assert tar.getnames() == [".", "./opt", "./opt/test", "./opt/test/bin", "./opt/test/bin/tool"]
+
+
+def test_partial_archive_is_removed(monkeypatch):
+    def fail(output, root, arcname, mtime):
+        output.write(b"partial")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(archive_module, "_write_tar", fail)
+    with tempfile.TemporaryDirectory() as td:
+        for compression in ("gzip", "none"):
+            output = Path(td, "sysroot.tar")
+            with pytest.raises(OSError):
+                create_archive(output, Path(td), compression=compression)
+            assert list(Path(td).iterdir()) == []
+
+
+@pytest.mark.skipif(subprocess.call(["tar", "--sort=name", "--version"], stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL) != 0, reason="requires GNU tar")
+@pytest.mark.parametrize("arcname", [None, ".", "renamed"])
+def test_archive_command(arcname):
+    with tempfile.TemporaryDirectory() as td:
+        sysroot = Path(td, "sysroot")
+        _create_sysroot(sysroot, num_files=20)
+        create_archive(Path(td, "python.tar.gz"), sysroot, arcname=arcname)
+        # The command that is printed with --pretend creates an archive with the same contents
+        subprocess.check_call(archive_command(Path(td, "tar.tar.gz"), sysroot, arcname=arcname))
+        members = []
+        for name in ("python.tar.gz", "tar.tar.gz"):
+            with tarfile.open(str(Path(td, name))) as tar:
+                members.append(sorted((m.name.rstrip("/"), m.mode, m.uid, m.gid, m.mtime, m.size, m.linkname)
+                                      for m in tar.getmembers()))
+        assert members[0] == members[1]
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_archive(monkeypatch):
+    # Point CHERIBUILD_BENCHMARK_SYSROOT at a real sysroot for representative numbers
+    with tempfile.TemporaryDirectory(dir=os.getenv("CHERIBUILD_BENCHMARK_DIR")) as td:
+        sysroot = Path(os.getenv("CHERIBUILD_BENCHMARK_SYSROOT", str(Path(td, "sysroot"))))
+        if not sysroot.exists():
+            _create_sysroot(sysroot, num_files=int(os.getenv("CHERIBUILD_BENCHMARK_FILES", "1000")))
+        results = []
+        start = time.time()
+        subprocess.check_call(["tar", "-czf", str(Path(td, "tar.tar.gz")), sysroot.name], cwd=str(sysroot.parent))
+        results.append(("tar -czf", Path(td, "tar.tar.gz").stat().st_size, time.time() - start))
+        for compression in ("gzip", "xz", "zstd"):
+            if archive_module.ARCHIVE_COMPRESSIONS[compression][2] is None and not shutil.which(compression):
+                continue
+            stats = create_archive(Path(td, "sysroot.tar." + compression), sysroot, compression=compression)
+            results.append((stats["compressor"], stats["compressed_size"], stats["time"]))
+            uncompressed = stats["uncompressed_size"]
+        _no_external_compressors(monkeypatch)
+        for compression in ("gzip", "xz"):
+            stats = create_archive(Path(td, "in-process.tar." + compression), sysroot, compression=compression)
+            results.append((stats["compressor"], stats["compressed_size"], stats["time"]))
+        print("\nArchiving", uncompressed // 1024, "KiB:")
+        for name, size, duration in results:
+            print("{:>20}: ratio {:.2f} in {:.2f}s".format(name, uncompressed / size, duration))
@@ -0,0 +1,208 @@
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.artifact_cache import ArtifactCache, snapshot_install_tree
+
+
+def _create_file(path: Path, contents: bytes) -> Path:
+    os.makedirs(str(path.parent), exist_ok=True)
+    with path.open("wb") as f:
+        f.write(contents)
+    return path
+
+
+def _create_install_tree(root: Path) -> "list":
+    _create_file(root / "lib/libfoo.so.1", b"\x7fELF" + b"x" * 1000)
+    _create_file(root / "include/foo.h", b"int foo(void);\n")
+    (root / "lib/libfoo.so").symlink_to("libfoo.so.1")
+    return ["include/foo.h", "lib/libfoo.so", "lib/libfoo.so.1"]
+
+
+def test_compute_key_order_independent():
+    key1 = ArtifactCache.compute_key({"target": "libcxx", "options": {"a": 1, "b": Path("/x")}})
+    key2 = ArtifactCache.compute_key({"options": {"b": "/x", "a": 1}, "target": "libcxx"})
+    key3 = ArtifactCache.compute_key({"target": "libcxx", "options": {"a": 2, "b": "/x"}})
+    assert key1 == key2
+    assert key1 != key3
+
+
+def test_store_and_extract():
+    with tempfile.TemporaryDirectory() as td:
+        cache = ArtifactCache(Path(td, "cache"))
+        install_root = Path(td, "install")
+        files = _create_install_tree(install_root)
+        key = ArtifactCache.compute_key({"target": "foo"})
+        assert cache.lookup(key) is None
+        assert cache.store(key, install_root, files, target="foo")
+        # Storing the same key again is a no-op
+        assert not cache.store(key, install_root, files, target="foo")
+        info = cache.lookup(key)
+        assert info is not None
+        assert info["files"] == files
+        assert info["size"] > 1000
+
+        new_root = Path(td, "other-output-root/install")
+        assert cache.extract(key, new_root) == files
+        assert (new_root / "lib/libfoo.so.1").read_bytes() == (install_root / "lib/libfoo.so.1").read_bytes()
+        assert (new_root / "include/foo.h").read_text() == "int foo(void);\n"
+        assert (new_root / "lib/libfoo.so").is_symlink()
+        assert os.readlink(str(new_root / "lib/libfoo.so")) == "libfoo.so.1"
+        # Without --artifact-cache-hardlinks the extracted files must not share the inode with the cache
+        assert (new_root / "lib/libfoo.so.1").stat().st_nlink == 1
+
+        stats = cache.stats()
+        assert stats["entries"] == 1
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["stores"] == 1
+        assert stats["targets"]["foo"][0] == 1
+
+
+def test_extract_with_hardlinks():
+    with tempfile.TemporaryDirectory() as td:
+        cache = ArtifactCache(Path(td, "cache"), allow_hardlinks=True)
+        install_root = Path(td, "install")
+        files = _create_install_tree(install_root)
+        key = ArtifactCache.compute_key({"target": "foo"})
+        cache.store(key, install_root, files, target="foo")
+        new_root = Path(td, "install2")
+        cache.extract(key, new_root)
+        assert (new_root / "lib/libfoo.so.1").read_bytes() == (install_root / "lib/libfoo.so.1").read_bytes()
+        # Either a reflink (separate inode) or a hardlink into the cache was created but never a link to the source
+        assert (new_root / "lib/libfoo.so.1").stat().st_ino != (install_root / "lib/libfoo.so.1").stat().st_ino
+
+
+def test_lru_gc():
+    with tempfile.TemporaryDirectory() as td:
+        cache = ArtifactCache(Path(td, "cache"))
+        keys = []
+        for i in range(3):
+            root = Path(td, "install" + str(i))
+            _create_file(root / "file", b"x" * 1000)
+            key = ArtifactCache.compute_key({"target": "foo", "index": i})
+            cache.store(key, root, ["file"], target="foo" + str(i))
+            keys.append(key)
+        # Make the second entry the oldest one and mark the first one as recently used
+        now = time.time()
+        for i, age in enumerate((100, 300, 200)):
+            os.utime(str(cache._entry_dir(keys[i]) / "info.json"), (now - age, now - age))
+        assert cache.lookup(keys[0]) is not None
+        removed, freed = cache.gc(max_size=2000)
+        assert (removed, freed) == (1, 1000)
+        assert not cache.contains(keys[1])
+        assert cache.contains(keys[0]) and cache.contains(keys[2])
+        removed, freed = cache.gc(max_size=1000)
+        assert (removed, freed) == (1, 1000)
+        assert cache.contains(keys[0])
+        assert cache.stats()["evictions"] == 2
+
+
+def test_store_enforces_max_size():
+    with tempfile.TemporaryDirectory() as td:
+        cache = ArtifactCache(Path(td, "cache"), max_size=1500)
+        for i in range(3):
+            root = Path(td, "install" + str(i))
+            _create_file(root / "file", b"x" * 1000)
+            cache.store(ArtifactCache.compute_key({"index": i}), root, ["file"], target="foo")
+        assert cache.stats()["entries"] == 1
+        assert cache.contains(ArtifactCache.compute_key({"index": 2}))
+
+
+def test_gc_removes_interrupted_stores():
+    with tempfile.TemporaryDirectory() as td:
+        cache = ArtifactCache(Path(td, "cache"))
+        leftover = Path(td, "cache/tmp/abcdef.99999999/tree")
+        leftover.mkdir(parents=True)
+        cache.gc()
+        assert not leftover.parent.exists()
+
+
+def test_snapshot_install_tree():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        expected = _create_install_tree(root)
+        (root / "lib/subdir").mkdir()
+        (root / "lib/subdir_link").symlink_to("subdir")
+        assert sorted(snapshot_install_tree(root)) == sorted(expected + ["lib/subdir_link"])
+        assert snapshot_install_tree(root / "missing") == dict()
+
+
+def test_installed_files_require_manifest():
+    from types import SimpleNamespace
+    from pycheribuild.projects.project import CMakeProject, Project
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        install_root = root / "install"
+        build_dir = root / "build"
+        build_dir.mkdir()
+        project = SimpleNamespace(buildDir=build_dir, real_install_root_dir=install_root)
+        # Files that were already up-to-date are not modified by the install step so without a manifest the list of
+        # installed files is not known and the project is not cached
+        assert Project._artifact_cache_installed_files(project) is None
+        assert CMakeProject._artifact_cache_installed_files(project) is None
+        files = _create_install_tree(install_root)
+        manifest = [str(install_root / f) for f in files] + [str(install_root / "lib/removed.a"), "/outside/file"]
+        (build_dir / "install_manifest.txt").write_text("\n".join(manifest) + "\n")
+        assert CMakeProject._artifact_cache_installed_files(project) == files
+
+
+def test_bootstrap_tools_cache_key():
+    from types import SimpleNamespace
+    from pycheribuild.projects.cross.cheribsd import BuildFreeBSD
+
+    def key(*args, source="abc123"):
+        project = SimpleNamespace(crossbuild=True, _artifact_cache_source_inputs=lambda: source)
+        make_args = SimpleNamespace(env_vars={"CC": "/does/not/exist/cc", "CXX": "/does/not/exist/c++"},
+                                    all_commandline_args=list(args))
+        inputs = BuildFreeBSD._bootstrap_tools_cache_inputs(project, make_args)
+        return None if inputs is None else ArtifactCache.compute_key(inputs)
+
+    first = key("-DWITHOUT_TESTS", "-DWITH_CHERI")
+    # The target architecture specific options are ignored so all variants share the same entry
+    assert key("-DWITHOUT_TESTS", "-DWITH_CHERI128") == first
+    assert key("-DWITHOUT_TESTS") == first
+    assert key("-DWITH_TESTS", "-DWITH_CHERI") != first
+    assert key(source="def456") != key()
+    assert key(source=None) is None
+
+
+def test_relocatable_prefix():
+    with tempfile.TemporaryDirectory() as td:
+        cache = ArtifactCache(Path(td, "cache"), allow_hardlinks=True)
+        # The bootstrap tools of one variant are reused for the WORLDTMP of another one
+        worldtmp = Path(td, "cheribsd-build/tmp")
+        legacy = worldtmp / "legacy"
+        _create_file(legacy / "usr/bin/tool", b"\x7fELF\0binary without paths")
+        _create_file(legacy / "usr/bin/wrapper", ("#!/bin/sh\nexec " + str(legacy) + "/usr/bin/tool\n").encode())
+        (legacy / "usr/bin/wrapper").chmod(0o755)
+        (legacy / "usr/bin/link").symlink_to(legacy / "usr/bin/tool")
+        (legacy / "usr/bin/cc").symlink_to("/usr/bin/cc")
+        files = sorted(snapshot_install_tree(legacy))
+        key = ArtifactCache.compute_key({"target": "freebsd-bootstrap-tools-stage"})
+        assert cache.store(key, legacy, files, target="bootstrap-tools", relocatable_prefix=str(worldtmp))
+
+        other_worldtmp = Path(td, "freebsd-mips-build/tmp")
+        other_legacy = other_worldtmp / "legacy"
+        assert cache.extract(key, other_legacy, relocatable_prefix=str(other_worldtmp)) == files
+        assert (other_legacy / "usr/bin/wrapper").read_text() == "#!/bin/sh\nexec " + str(other_legacy) + \
+            "/usr/bin/tool\n"
+        assert os.access(str(other_legacy / "usr/bin/wrapper"), os.X_OK)
+        assert os.readlink(str(other_legacy / "usr/bin/link")) == str(other_legacy / "usr/bin/tool")
+        assert os.readlink(str(other_legacy / "usr/bin/cc")) == "/usr/bin/cc"
+        # The rewritten file is not a hardlink to the cache contents, the unchanged binary is
+        assert (other_legacy / "usr/bin/wrapper").stat().st_nlink == 1
+        assert (other_legacy / "usr/bin/tool").stat().st_nlink == 2
+        # The original entry is not modified
+        assert cache.extract(key, Path(td, "copy")) == files
+        assert str(legacy) in Path(td, "copy/usr/bin/wrapper").read_text()
+
+        # Binaries that contain the prefix cannot be relocated
+        _create_file(legacy / "usr/bin/tool", b"\x7fELF\0" + str(legacy).encode())
+        key = ArtifactCache.compute_key({"target": "freebsd-bootstrap-tools-stage", "index": 2})
+        assert not cache.store(key, legacy, files, target="bootstrap-tools", relocatable_prefix=str(worldtmp))
+        assert not cache.contains(key)
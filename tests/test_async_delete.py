@@ -1,10 +1,15 @@
 from pathlib import Path
 from unittest import TestCase
+from pycheribuild.delete_tree import DeletionService, find_interrupted_deletions
 from pycheribuild.projects.project import Project, CrossCompileTarget
 from pycheribuild.utils import setCheriConfig, IS_LINUX
 from .setup_mock_chericonfig import setup_mock_chericonfig, MockConfig
 import os
+import platform
+import shutil
+import sys
 import tempfile
+import threading
 import time
 import unittest
 import subprocess
@@ -24,11 +29,11 @@ class MockProject(Project):
         self.installDir = config.sourceRoot / "install" / name  # type: Path
         super().__init__(config)
 
-    def _deleteDirectories(self, *dirs):
+    def _deleteDirectories(self, *dirs, **kwargs):
         if self.config.sleep_before_delete:
             print("SLEEPING")
             time.sleep(0.05)
-        super()._deleteDirectories(*dirs)
+        super()._deleteDirectories(*dirs, **kwargs)
 
 
 class TestAsyncDelete(TestCase):
@@ -200,6 +205,80 @@ class TestAsyncDelete(TestCase):
         self._assertDirEmpty(self.project.buildDir)  # dir should still be empty
         self.assertFalse(moved_builddir.exists())  # tempdir should be deleted now
 
+    @staticmethod
+    def _create_files(directory: Path, num_files: int, subdirs: int = 10):
+        for i in range(num_files):
+            subdir = directory / ("dir" + str(i % subdirs))
+            subdir.mkdir(parents=True, exist_ok=True)
+            (subdir / ("file" + str(i))).touch()
+
+    def test_interrupted_deletions_are_reclaimed(self):
+        self.config.verbose = False
+        leftover = self.config.buildRoot / "foo-build.delete-me-pls"
+        leftover_sysroot = self.config.outputRoot / "sdk" / "sysroot.delete-me-pls"
+        unrelated = self.config.buildRoot / "bar-build"
+        self._create_files(leftover, 5000)
+        self._create_files(leftover_sysroot, 10)
+        self._create_files(unrelated, 10)
+        # Kill a process while it is deleting the directory (same as pressing Ctrl+C twice during a build)
+        deleter = subprocess.Popen([sys.executable, "-c", "import sys; sys.path.insert(0, sys.argv[1]); "
+                                    "from pycheribuild.delete_tree import delete_tree; print('started', flush=True); "
+                                    "delete_tree(sys.argv[2], jobs=1)", str(Path(__file__).parent.parent),
+                                    str(leftover)], stdout=subprocess.PIPE)
+        self.assertEqual(deleter.stdout.readline(), b"started\n")
+        deleter.kill()
+        deleter.wait()
+        deleter.stdout.close()
+        self.assertEqual(find_interrupted_deletions([self.config.buildRoot, self.config.outputRoot]),
+                         sorted([str(leftover), str(leftover_sysroot)]))
+        service = DeletionService(max_workers=2)
+        service.reclaim_interrupted_deletions([self.config.buildRoot, self.config.outputRoot],
+                                              self.project._deleteDirectories)
+        service.wait()
+        self.assertFalse(leftover.exists())
+        self.assertFalse(leftover_sysroot.exists())
+        self._assertNumFiles(unrelated, 10)
+        self.assertEqual(find_interrupted_deletions([self.config.buildRoot, self.config.outputRoot]), [])
+
+    def test_background_delete_throughput(self):
+        self.config.verbose = False
+        dirs = [self.config.buildRoot / ("dir" + str(i) + ".delete-me-pls") for i in range(8)]
+        for d in dirs:
+            self._create_files(d, 500)
+        lock = threading.Lock()
+        active = [0, 0]  # current, maximum
+
+        def delete(path):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.02)  # make sure that the jobs would overlap if they weren't limited
+            self.project._deleteDirectories(path)
+            with lock:
+                active[0] -= 1
+
+        service = DeletionService(max_workers=2)
+        start = time.time()
+        for d in dirs:
+            service.submit(d, delete)
+        service.wait()
+        duration = time.time() - start
+        print("Deleted", len(dirs) * 500, "files in {:.2f}s ({:.0f} files/s)".format(duration,
+                                                                                   len(dirs) * 500 / duration))
+        self.assertEqual(active[1], 2, "Deletion should use exactly two threads")
+        for d in dirs:
+            self.assertFalse(d.exists())
+        self.assertEqual(service.pending, 0)
+
+    @unittest.skipUnless(IS_LINUX and shutil.which("ionice") and hasattr(threading, "get_native_id") and
+                         platform.machine() in ("x86_64", "aarch64"), "requires Linux ionice")
+    def test_background_delete_io_priority(self):
+        priorities = []
+        service = DeletionService(max_workers=1)
+        service.submit(self.tempRoot / "missing", lambda p: priorities.append(subprocess.check_output(
+            ["ionice", "-p", str(threading.get_native_id())]).decode("utf-8").strip()))
+        service.wait()
+        self.assertEqual(priorities, ["best-effort: prio 7"])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,113 @@
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.build_dir_manager import BuildDirectoryManager, directory_size
+from pycheribuild.delete_tree import delete_tree, find_interrupted_deletions
+
+MiB = 1024 * 1024
+
+
+def _create_build_dir(path: Path, size_mb: int):
+    (path / "obj").mkdir(parents=True)
+    with (path / "obj/file.o").open("wb") as f:
+        f.write(os.urandom(size_mb * MiB))
+
+
+def _record(manager: BuildDirectoryManager, target: str, kind: str, path: Path, last_used: float):
+    manager.record_use(target, kind, path)
+    # Fake the last use time
+    entries = manager._load()
+    entries[str(path)]["last_used"] = last_used
+    manager._save(entries)
+
+
+def test_directory_size():
+    with tempfile.TemporaryDirectory() as td:
+        _create_build_dir(Path(td, "build"), 2)
+        Path(td, "build/link").symlink_to("/usr")
+        assert 2 * MiB <= directory_size(Path(td)) <= 2 * MiB + 64 * 1024
+
+
+def test_evict_least_recently_used():
+    with tempfile.TemporaryDirectory() as td:
+        build_root = Path(td, "build")
+        manager = BuildDirectoryManager(build_root, quota=6 * MiB)
+        now = time.time()
+        for i, name in enumerate(("llvm-build", "qemu-build", "cheribsd-obj-128", "cheribsd-obj-256")):
+            _create_build_dir(build_root / name, 2)
+            _record(manager, name.split("-")[0], "build", build_root / name, now - 1000 * (4 - i))
+        # Directories that were not recorded (e.g. created by another tool or the strip cache) are never evicted
+        _create_build_dir(build_root / "old-build", 1)
+        os.utime(str(build_root / "old-build"), (now - 100000, now - 100000))
+        _create_build_dir(build_root / "ccache", 1)
+        # Install directories are never evicted
+        _create_build_dir(build_root / "sdk", 1)
+        _record(manager, "llvm", "install", build_root / "sdk", now - 100000)
+        deleted = []
+        # llvm-build is older but needed by the current build -> evict qemu-build instead
+        removed, freed = manager.evict([build_root / "llvm-build/obj"], lambda p: deleted.append(p) or delete_tree(p))
+        assert sorted(p.name for p in build_root.iterdir() if p.is_dir()) == [
+            "ccache", "cheribsd-obj-256", "llvm-build", "old-build", "sdk"]
+        assert [p.name for p in deleted] == ["qemu-build.delete-me-pls", "cheribsd-obj-128.delete-me-pls"]
+        assert removed == 2
+        assert 4 * MiB <= freed <= 4 * MiB + 64 * 1024
+        assert sorted(Path(p).name for p, _ in manager.entries()) == ["cheribsd-obj-256", "llvm-build", "sdk"]
+        # Nothing to do if we are below the quota
+        assert manager.evict([], delete_tree) == (0, 0)
+
+
+def test_interrupted_eviction_is_reclaimed():
+    with tempfile.TemporaryDirectory() as td:
+        build_root = Path(td, "build")
+        manager = BuildDirectoryManager(build_root, quota=0)
+        _create_build_dir(build_root / "llvm-build", 1)
+        manager.record_use("llvm", "build", build_root / "llvm-build")
+        manager.evict([], lambda p: None)  # killed before the deletion started
+        assert find_interrupted_deletions([build_root]) == [str(build_root / "llvm-build.delete-me-pls")]
+        # A pending deletion of the same directory (e.g. from an interrupted --clean) doesn't prevent the eviction
+        _create_build_dir(build_root / "llvm-build", 1)
+        manager.record_use("llvm", "build", build_root / "llvm-build")
+        deleted = []
+        assert manager.evict([], deleted.append)[0] == 1
+        assert deleted == [build_root / "llvm-build.delete-me-pls-2"]
+        assert find_interrupted_deletions([build_root]) == [str(build_root / "llvm-build.delete-me-pls"),
+                                                            str(build_root / "llvm-build.delete-me-pls-2")]
+
+
+def test_pretend_and_usage(capsys):
+    with tempfile.TemporaryDirectory() as td:
+        build_root = Path(td, "build")
+        _create_build_dir(build_root / "llvm-build", 1)
+        BuildDirectoryManager(build_root).record_use("llvm", "build", build_root / "llvm-build")
+        BuildDirectoryManager(build_root).record_use("llvm", "install", Path(td, "sdk"))  # does not exist
+        pretend = BuildDirectoryManager(build_root, quota=0, pretend=True)
+        pretend.record_use("qemu", "build", build_root / "llvm-build")
+        assert pretend.evict([], lambda p: None) == (1, directory_size(build_root / "llvm-build"))
+        assert (build_root / "llvm-build").is_dir()
+        manager = BuildDirectoryManager(build_root)
+        manager.record_use("cheribsd-sysroot", "build", build_root / "llvm-build")
+        assert list(manager.usage().keys()) == ["cheribsd-sysroot", "llvm"]
+        manager.print_usage()
+        output = capsys.readouterr().out
+        assert "1 directories using 1.0 MiB" in output
+        assert "llvm-build" in output
+
+
+def test_protected_directories_are_not_evicted():
+    with tempfile.TemporaryDirectory() as td:
+        # --build-root set to the source root: the build root and its parents must never be evicted
+        build_root = Path(td, "cheri")
+        manager = BuildDirectoryManager(build_root, quota=0, protected=[build_root / "output", build_root])
+        _create_build_dir(build_root / "output/sdk-build", 1)
+        _create_build_dir(build_root / "llvm-build", 1)
+        for path in (build_root, build_root / "output", build_root / "output/sdk-build", build_root / "llvm-build"):
+            manager.record_use("llvm", "build", path)
+        deleted = []
+        assert manager.evict([], deleted.append)[0] == 2
+        assert sorted(p.name for p in deleted) == ["llvm-build.delete-me-pls", "sdk-build.delete-me-pls"]
+        assert build_root.is_dir() and (build_root / "output").is_dir()
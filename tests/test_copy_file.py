@@ -0,0 +1,184 @@
+import errno
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+# noinspection PyProtectedMember
+from pycheribuild import copy_file as copy_file_module
+from pycheribuild.copy_file import copy_file, copy_tree
+
+MiB = 1024 * 1024
+
+
+def _create_sparse_file(path: Path, size: int, data_offsets):
+    with path.open("wb") as f:
+        for offset in data_offsets:
+            f.seek(offset)
+            f.write(os.urandom(MiB))
+        f.truncate(size)
+
+
+def _allocated_size(path: Path) -> int:
+    return os.stat(str(path)).st_blocks * 512
+
+
+def test_unsupported_copy_method_is_skipped(monkeypatch):
+    calls = []
+
+    def unsupported(src_fd, dest_fd, offset, count):
+        calls.append(offset)
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+
+    methods = [unsupported, copy_file_module._read_write_chunk]
+    monkeypatch.setattr(copy_file_module, "_clone_file", lambda src_fd, dest_fd, devices=None: False)
+    monkeypatch.setattr(copy_file_module, "_CHUNK_COPY_METHODS", methods)
+    monkeypatch.setattr(copy_file_module, "_UNSUPPORTED_CHUNK_COPY_METHODS", set())
+    with tempfile.TemporaryDirectory() as td:
+        Path(td, "src").write_bytes(b"data")
+        for dest in ("dest1", "dest2"):
+            copy_file(Path(td, "src"), Path(td, dest))
+            assert Path(td, dest).read_bytes() == b"data"
+    # Only tried once and the list of methods (shared between all copy threads) is not modified
+    assert calls == [0]
+    assert methods == [unsupported, copy_file_module._read_write_chunk]
+
+
+@pytest.mark.parametrize("method", [None] + [m.__name__ for m in copy_file_module._CHUNK_COPY_METHODS])
+def test_copy_file(monkeypatch, method):
+    if method is not None:
+        # Test all the fallbacks (FICLONE is not supported on tmpfs/ext4 anyway)
+        monkeypatch.setattr(copy_file_module, "_clone_file", lambda src_fd, dest_fd, devices=None: False)
+        monkeypatch.setattr(copy_file_module, "_CHUNK_COPY_METHODS", [getattr(copy_file_module, method)])
+    with tempfile.TemporaryDirectory() as td:
+        src = Path(td, "src")
+        src.write_bytes(os.urandom(3 * MiB + 17))
+        src.chmod(0o751)
+        dest = Path(td, "dest")
+        copy_file(src, dest)
+        assert dest.read_bytes() == src.read_bytes()
+        assert stat.S_IMODE(dest.stat().st_mode) == 0o751
+
+        # An existing file is replaced and not modified in-place (it could be a hardlink to another file)
+        other_link = Path(td, "other-link")
+        os.link(str(dest), str(other_link))
+        src.write_bytes(b"new contents")
+        copy_file(src, dest)
+        assert dest.read_bytes() == b"new contents"
+        assert len(other_link.read_bytes()) == 3 * MiB + 17
+
+        empty = Path(td, "empty")
+        empty.touch()
+        copy_file(empty, dest)
+        assert dest.read_bytes() == b""
+
+
+def test_copy_sparse_file():
+    with tempfile.TemporaryDirectory() as td:
+        src = Path(td, "disk.img")
+        size = 256 * MiB
+        _create_sparse_file(src, size, [0, 100 * MiB, 200 * MiB])
+        if _allocated_size(src) >= size:
+            pytest.skip("File system does not support sparse files")
+        dest = Path(td, "copy.img")
+        copy_file(src, dest)
+        assert dest.stat().st_size == size
+        assert _allocated_size(dest) <= _allocated_size(src) + MiB
+        with src.open("rb") as s, dest.open("rb") as d:
+            for offset in range(0, size, 16 * MiB):
+                assert s.read(16 * MiB) == d.read(16 * MiB), "mismatch at offset " + str(offset)
+
+
+def test_copy_symlinks_and_hardlinks():
+    with tempfile.TemporaryDirectory() as td:
+        src = Path(td, "src")
+        src.write_text("contents")
+        link = Path(td, "link")
+        link.symlink_to("src")
+        dest = Path(td, "dest")
+        copy_file(link, dest)
+        assert dest.is_symlink() and os.readlink(str(dest)) == "src"
+        copy_file(link, dest, follow_symlinks=True)
+        assert not dest.is_symlink() and dest.read_text() == "contents"
+        copy_file(src, dest, allow_hardlink=True)
+        assert dest.read_text() == "contents"
+        # FICLONE is preferred over a hardlink
+        if _supports_reflinks(Path(td)):
+            assert not os.path.samefile(str(src), str(dest))
+        else:
+            assert os.path.samefile(str(src), str(dest))
+
+
+def _supports_reflinks(directory: Path) -> bool:
+    src = directory / "reflink-test-src"
+    src.write_bytes(b"x")
+    with src.open("rb") as s, (directory / "reflink-test-dest").open("wb") as d:
+        return copy_file_module._clone_file(s.fileno(), d.fileno())
+
+
+def test_copy_tree():
+    with tempfile.TemporaryDirectory() as td:
+        src = Path(td, "src")
+        for i in range(50):
+            subdir = src / ("dir" + str(i % 7)) / ("nested" + str(i % 3))
+            subdir.mkdir(parents=True, exist_ok=True)
+            (subdir / ("file" + str(i))).write_bytes(os.urandom(i * 100))
+        (src / "empty/dir").mkdir(parents=True)
+        (src / "dir0/link").symlink_to("nested0")
+        (src / "dangling").symlink_to("does-not-exist")
+        os.utime(str(src / "dir1/nested1/file1"), (12345, 12345))
+        dest = Path(td, "dest")
+        files = copy_tree(src, dest, jobs=4)
+        assert len(files) == 52
+        for f in files:
+            s = src / f
+            d = dest / f
+            if s.is_symlink():
+                assert os.readlink(str(d)) == os.readlink(str(s))
+            else:
+                assert d.read_bytes() == s.read_bytes()
+        assert (dest / "empty/dir").is_dir()
+        assert (dest / "dir1/nested1/file1").stat().st_mtime == 12345
+
+        # Only copy some of the files
+        partial = Path(td, "partial")
+        copy_tree(src, partial, ["dir2/nested2/file2", "dangling"])
+        assert sorted(str(p.relative_to(partial)) for p in partial.rglob("*")) == [
+            "dangling", "dir2", "dir2/nested2", "dir2/nested2/file2"]
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_copy_file():
+    # Use CHERIBUILD_BENCHMARK_DIR to benchmark on a different file system (e.g. tmpfs vs ext4 vs btrfs)
+    size = int(os.getenv("CHERIBUILD_BENCHMARK_SIZE_MB", "2048")) * MiB
+    num_files = int(os.getenv("CHERIBUILD_BENCHMARK_FILES", "20000"))
+    with tempfile.TemporaryDirectory(dir=os.getenv("CHERIBUILD_BENCHMARK_DIR")) as td:
+        root = Path(td)
+        # A mostly empty disk image (similar to the ones created by makefs)
+        image = root / "disk.img"
+        _create_sparse_file(image, size, range(0, size // 2, 4 * MiB))
+        tree = root / "tree"
+        for i in range(num_files):
+            subdir = tree / ("dir" + str(i % 100))
+            subdir.mkdir(parents=True, exist_ok=True)
+            (subdir / ("file" + str(i))).write_bytes(b"x" * (i % 8192))
+        results = []
+        for name, copy_one, copy_all in (("shutil", shutil.copy2, shutil.copytree), ("copy_file", copy_file, copy_tree)):
+            start = time.time()
+            copy_one(str(image), str(root / (name + ".img")))
+            image_time = time.time() - start
+            start = time.time()
+            copy_all(str(tree), str(root / (name + "-tree")))
+            tree_time = time.time() - start
+            results.append((name, image_time, _allocated_size(root / (name + ".img")), tree_time))
+        print()
+        for name, image_time, allocated, tree_time in results:
+            print("{:>10}: {} MiB image: {:.2f}s ({} MiB allocated), {} files: {:.2f}s".format(
+                name, size // MiB, image_time, allocated // MiB, num_files, tree_time))
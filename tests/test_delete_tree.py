@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.delete_tree import delete_tree
+
+
+def _create_tree(root: Path, num_files: int, files_per_dir: int = 100, dirs_per_dir: int = 10):
+    """Create a tree with num_files empty files (similar to a large build directory)"""
+    created = 0
+    pending = [root]
+    while created < num_files:
+        directory = pending.pop(0)
+        directory.mkdir(parents=True, exist_ok=True)
+        for i in range(min(files_per_dir, num_files - created)):
+            # os.open() is a lot faster than Path.touch() for a million files
+            os.close(os.open(os.path.join(str(directory), "file" + str(i) + ".o"), os.O_CREAT | os.O_WRONLY, 0o644))
+        created += min(files_per_dir, num_files - created)
+        pending.extend(directory / ("dir" + str(i)) for i in range(dirs_per_dir))
+
+
+def test_delete_tree():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td, "build")
+        _create_tree(root, 2000, files_per_dir=7, dirs_per_dir=3)
+        (root / "empty/nested/dirs").mkdir(parents=True)
+        outside = Path(td, "outside")
+        outside.mkdir()
+        (outside / "keep").write_text("must not be deleted")
+        # Symlinks must be removed and not followed
+        (root / "dir0/link-to-outside").symlink_to(outside)
+        (root / "dangling").symlink_to("does-not-exist")
+        delete_tree(root, jobs=4)
+        assert not root.exists()
+        assert (outside / "keep").read_text() == "must not be deleted"
+
+
+def test_delete_tree_non_directories():
+    with tempfile.TemporaryDirectory() as td:
+        delete_tree(Path(td, "does-not-exist"))
+        file = Path(td, "file")
+        file.write_text("x")
+        delete_tree(file)
+        assert not file.exists()
+        link = Path(td, "link")
+        link.symlink_to(td)
+        delete_tree(link)
+        assert not os.path.lexists(str(link))
+        assert Path(td).is_dir()
+
+
+@pytest.mark.skipif(os.getuid() == 0, reason="root can delete files in read-only directories")
+def test_delete_tree_error():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td, "build")
+        _create_tree(root, 50, files_per_dir=5, dirs_per_dir=2)
+        (root / "dir1").chmod(0o555)
+        try:
+            with pytest.raises(OSError):
+                delete_tree(root)
+            # Everything else should have been deleted
+            assert list(root.iterdir()) == [root / "dir1"]
+        finally:
+            (root / "dir1").chmod(0o755)
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_delete_tree():
+    # Use CHERIBUILD_BENCHMARK_DIR to benchmark on a different file system (e.g. NFS or a real SSD instead of tmpfs)
+    num_files = int(os.getenv("CHERIBUILD_BENCHMARK_FILES", "1000000"))
+    with tempfile.TemporaryDirectory(dir=os.getenv("CHERIBUILD_BENCHMARK_DIR")) as td:
+        results = []
+        for name, delete in (("rm -rf", lambda p: subprocess.check_call(["rm", "-rf", str(p)])),
+                             ("delete_tree", delete_tree)):
+            root = Path(td, name.replace(" ", "_"))
+            _create_tree(root, num_files)
+            subprocess.check_call(["sync"])
+            start = time.time()
+            delete(root)
+            results.append((name, time.time() - start))
+            assert not root.exists()
+        print("\nDeleting", num_files, "files:", ", ".join("{}: {:.2f}s".format(n, t) for n, t in results))
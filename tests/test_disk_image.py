@@ -0,0 +1,161 @@
+import os
+import stat
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.file_digests import FileDigestCache
+from pycheribuild.mtree import MtreeFile, MtreeView
+from pycheribuild.projects.disk_image import (describe_fingerprint_changes, scan_files, _BuildDiskImageBase,
+                                              DEDUPLICATION_HARDLINK_SUFFIX)
+
+
+def test_describe_fingerprint_changes():
+    old = dict(version=1, makefs=["makefs", "-M", "1g"], format="raw", entries={"./a": "1", "./b": "2", "./c": "3"},
+               image=[1234, 5678])
+    assert describe_fingerprint_changes(old, dict(old, image=None)) == []
+    new = dict(version=1, makefs=["makefs", "-M", "256m"], format="qcow2", entries={"./a": "1", "./b": "4", "./d": "5"})
+    assert describe_fingerprint_changes(old, new) == [
+        "makefs: ['makefs', '-M', '1g'] -> ['makefs', '-M', '256m']", "format: raw -> qcow2",
+        "added ./d", "removed ./c", "changed ./b"]
+    new["entries"] = {"./" + str(i): "x" for i in range(20)}
+    changes = describe_fingerprint_changes(old, new, max_entries=5)
+    assert len(changes) == 2 + 6
+    assert changes[-1] == "... and 18 more"
+
+
+def test_image_fingerprint_includes_user_group_db():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        (root / "rootfs").mkdir()
+        (root / "etc").mkdir()
+        (root / "etc/master.passwd").write_text("root:*:0:0::0:0:Charlie &:/root:/bin/sh\n")
+        (root / "etc/group").write_text("wheel:*:0:root\n")
+        project = SimpleNamespace(mtree=MtreeFile(), rootfsDir=root / "rootfs", _fingerprint_ignored_paths=[],
+                                  digest_cache=FileDigestCache(root / "digests.json"),
+                                  config=SimpleNamespace(makeJobs=1), makefs_cmd="makefs",
+                                  makefs_flags=lambda: ["-N", str(root / "etc")], userGroupDbDir=root / "etc",
+                                  useQCOW2=False, deduplicate_files=True, deduplicate_subtrees=[],
+                                  compute_digests=False)
+        first = _BuildDiskImageBase.image_fingerprint(project)
+        assert describe_fingerprint_changes(first, _BuildDiskImageBase.image_fingerprint(project)) == []
+        # Changing a UID changes the owner of files in the image even though the -N path is the same
+        (root / "etc/master.passwd").write_text("root:*:1:0::0:0:Charlie &:/root:/bin/sh\n")
+        time.sleep(0.01)
+        os.utime(str(root / "etc/master.passwd"))
+        changes = describe_fingerprint_changes(first, _BuildDiskImageBase.image_fingerprint(project))
+        assert len(changes) == 1 and changes[0].startswith("user_group_db:")
+
+
+def test_scan_files():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        for d in ("etc/ssh", "usr/local/bin", "usr/lib", ".git/objects", "foo.git"):
+            (root / d).mkdir(parents=True)
+        for f in ("etc/rc.conf", "etc/ssh/sshd_config", "usr/local/bin/bash", "usr/lib/libc.so.7", ".git/HEAD",
+                  "foo.git/file", "zzz"):
+            (root / f).write_text(f)
+        (root / "etc/link-to-dir").symlink_to("ssh")
+        (root / "etc/link-to-file").symlink_to("rc.conf")
+        (root / "dangling").symlink_to("does-not-exist")
+        files = list(scan_files(root, skip_dir=lambda d: d in ("usr/local", ".git")))
+        # Same order as os.walk() with sorted names, symlinks to directories are not returned
+        assert [relpath for _, relpath, _ in files] == [
+            "dangling", "zzz", "etc/link-to-file", "etc/rc.conf", "etc/ssh/sshd_config", "foo.git/file",
+            "usr/lib/libc.so.7"]
+        for path, relpath, st in files:
+            assert path == os.path.join(td, relpath)
+            assert st == os.lstat(path)
+        assert stat.S_ISLNK(files[0][2].st_mode)
+
+
+def _add_extra_files_old(extra_files_dir: Path) -> MtreeFile:
+    """The previous implementation: os.walk(), Path objects and a list for the remaining extra files"""
+    mtree = MtreeFile()
+    extra_files = []
+    for root, dirnames, filenames in os.walk(str(extra_files_dir)):
+        for filename in filenames:
+            extra_files.append(Path(root, filename))
+    for p in extra_files.copy():
+        path_in_target = p.relative_to(extra_files_dir)
+        mtree.add_file(p, path_in_target, print_status=False)
+        if p in extra_files:
+            extra_files.remove(p)
+    return mtree
+
+
+def _add_extra_files_new(extra_files_dir: Path) -> MtreeFile:
+    project = SimpleNamespace(mtree=MtreeFile(), extraFiles=OrderedDict(), strip_binaries=False,
+                              config=SimpleNamespace(quiet=True, verbose=False))
+    for path, relpath, st in scan_files(extra_files_dir):
+        project.extraFiles[Path(path)] = (relpath, st)
+    for p, (path_in_image, st) in list(project.extraFiles.items()):
+        _BuildDiskImageBase.addFileToImage(project, p, baseDirectory=extra_files_dir, pathInTarget=path_in_image,
+                                           st=st)
+    assert not project.extraFiles
+    return project.mtree
+
+
+def test_add_extra_files():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        for i in range(50):
+            (root / str(i % 7)).mkdir(exist_ok=True)
+            (root / str(i % 7) / str(i)).write_text(str(i))
+        (root / "link").symlink_to("0/0")
+        assert len(_add_extra_files_new(root)) == 50 + 7 + 2 and \
+            sorted(map(str, _add_extra_files_new(root))) == sorted(map(str, _add_extra_files_old(root)))
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_extra_files():
+    num_files = int(os.getenv("CHERIBUILD_BENCHMARK_FILES", "100000"))
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        for i in range(num_files):
+            directory = os.path.join(td, "dir" + str(i % 100), "sub" + str(i % 7))
+            if i < 700:
+                os.makedirs(directory, exist_ok=True)
+            os.close(os.open(os.path.join(directory, "file" + str(i)), os.O_CREAT | os.O_WRONLY, 0o644))
+        results = []
+        for name, add_files in (("old", _add_extra_files_old), ("new", _add_extra_files_new)):
+            start = time.time()
+            mtree = add_files(root)
+            results.append((name, time.time() - start))
+            assert len(mtree) == num_files + 100 * 8 + 1
+        print("\nAdding", num_files, "extra files:", ", ".join("{}: {:.2f}s".format(n, t) for n, t in results))
+
+
+def test_unlisted_files():
+    with tempfile.TemporaryDirectory() as td:
+        rootfs = Path(td)
+        (rootfs / "bin").mkdir()
+        (rootfs / "bin/cat").write_text("cat")
+        (rootfs / "bin/unlisted").write_text("unlisted")
+        (rootfs / "METALOG").write_text("./bin/cat type=file\n")
+        (rootfs / ("METALOG" + MtreeView.INDEX_SUFFIX)).write_bytes(b"index")
+        (rootfs / ("bin/cat" + DEDUPLICATION_HARDLINK_SUFFIX)).write_text("cat")
+        mtree = MtreeFile()
+        mtree.add_file(rootfs / "bin/cat", "bin/cat", print_status=False)
+        project = SimpleNamespace(mtree=mtree, rootfsDir=rootfs, config=SimpleNamespace(verbose=False),
+                                  queryYesNo=lambda *args, **kwargs: True)
+        _BuildDiskImageBase.add_unlisted_files_to_metalog(project)
+        assert sorted(e.path for e in mtree if e.is_file()) == ["./bin/cat", "./bin/unlisted"]
+
+
+def test_unlisted_files_missing_rootfs():
+    # The rootfs does not exist yet when running with --pretend
+    with tempfile.TemporaryDirectory() as td:
+        rootfs = Path(td, "rootfs")
+        assert list(scan_files(rootfs)) == []
+        project = SimpleNamespace(mtree=MtreeFile(), rootfsDir=rootfs, config=SimpleNamespace(verbose=False),
+                                  queryYesNo=lambda *args, **kwargs: True)
+        _BuildDiskImageBase.add_unlisted_files_to_metalog(project)
+        assert len(project.mtree) == 0
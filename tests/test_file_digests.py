@@ -0,0 +1,98 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.file_digests import FileDigestCache, compute_file_digests, file_sha256
+from pycheribuild.mtree import MtreeFile
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_digest_cache():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        (root / "a").write_bytes(b"a" * 3000000)
+        (root / "b").write_bytes(b"b")
+        os.link(str(root / "b"), str(root / "b-hardlink"))
+        paths = [str(root / name) for name in ("a", "b", "b-hardlink", "missing")]
+        cache = FileDigestCache(root / "cache.json")
+        result = compute_file_digests(paths, cache=cache, jobs=4)
+        assert result == {paths[0]: (3000000, _sha256(b"a" * 3000000)), paths[1]: (1, _sha256(b"b")),
+                          paths[2]: (1, _sha256(b"b"))}
+        assert cache.misses + cache.hits == 3
+        assert cache.misses in (2, 3)  # the hardlink can be hashed concurrently
+        cache.save()
+
+        # The digests are reused in the next run
+        cache = FileDigestCache(root / "cache.json")
+        assert compute_file_digests(paths, cache=cache) == result
+        assert (cache.hits, cache.misses) == (3, 0)
+        # ... unless the file changed
+        (root / "a").write_bytes(b"c" * 3000000)
+        st = (root / "a").stat()
+        os.utime(str(root / "a"), ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        assert cache.digest(paths[0]) == (3000000, _sha256(b"c" * 3000000))
+        assert cache.misses == 1
+        assert compute_file_digests(paths[:2]) == {paths[0]: (3000000, file_sha256(paths[0])), paths[1]: result[paths[1]]}
+
+        # Broken cache files are ignored
+        (root / "cache.json").write_text("{")
+        assert FileDigestCache(root / "cache.json").digest(paths[1]) == result[paths[1]]
+
+
+def test_mtree_add_digests():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        (root / "bin").mkdir()
+        (root / "bin/ls").write_bytes(b"ls")
+        (root / "extra").write_bytes(b"extra")
+        mtree = MtreeFile(io.StringIO("""#mtree 2.0
+. type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+./bin/ls type=file uname=root gname=wheel mode=0555 size=1
+./bin/sh type=link uname=root gname=wheel mode=0755 link=ls
+./bin/missing type=file uname=root gname=wheel mode=0555
+./bin/extra type=file uname=root gname=wheel mode=0555 contents={}/extra
+""".format(root)))
+        assert mtree.add_digests(root, cache=FileDigestCache(root / "cache.json")) == 2
+        assert str(mtree._mtree["./bin/ls"]) == ("./bin/ls type=file uname=root gname=wheel mode=0555 size=2 "
+                                                 "sha256digest=" + _sha256(b"ls"))
+        assert str(mtree._mtree["./bin/extra"]) == ("./bin/extra type=file uname=root gname=wheel mode=0555 contents=" +
+                                                    str(root / "extra") + " size=5 sha256digest=" + _sha256(b"extra"))
+        assert "sha256digest" not in mtree._mtree["./bin/sh"].attributes
+        assert "size" not in mtree._mtree["./bin/missing"].attributes
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_digests():
+    # No CheriBSD rootfs is available in most test environments -> use a directory of the host system by default
+    directory = os.getenv("CHERIBUILD_BENCHMARK_DIR", "/usr/lib")
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        paths.extend(os.path.join(dirpath, f) for f in filenames if os.path.isfile(os.path.join(dirpath, f)))
+    total_size = sum(os.path.getsize(p) for p in paths)
+    compute_file_digests(paths)  # make sure all files are in the page cache so that the first result is comparable
+    with tempfile.TemporaryDirectory() as td:
+        results = []
+        for name, jobs, cache in (("serial", 1, None), ("parallel", None, None),
+                                  ("parallel, cold cache", None, FileDigestCache(Path(td, "cache.json"))),
+                                  ("parallel, warm cache", None, None)):
+            if name.endswith("warm cache"):
+                cache = FileDigestCache(Path(td, "cache.json"))
+            start = time.time()
+            compute_file_digests(paths, cache=cache, jobs=jobs)
+            if cache is not None:
+                cache.save()
+            results.append((name, time.time() - start))
+    print("\nDigesting {} files ({} MiB) in {}: ".format(len(paths), total_size // 1024 // 1024, directory) +
+          ", ".join("{} {:.2f}s".format(name, duration) for name, duration in results))
@@ -0,0 +1,133 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.filesystemutils import FileSystemUtils
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+
+def _fs(root: Path, pretend=False) -> FileSystemUtils:
+    config = setup_mock_chericonfig(root)
+    config.pretend = pretend
+    config.verbose = False
+    return FileSystemUtils(config)
+
+
+def test_create_symlinks():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        fs = _fs(root)
+        (root / "bin").mkdir()
+        (root / "bin/clang").write_text("clang")
+        (root / "bin/existing-file").write_text("old")
+        (root / "bin/existing-link").symlink_to("does-not-exist")
+        (root / "lib").mkdir()
+        (root / "bin/link-to-dir").symlink_to("../lib")
+        fs.create_symlinks([("clang", "cc"), ("clang", "existing-file"), ("clang", "existing-link"),
+                            ("clang", "link-to-dir"), ("clang", root / "bin/absolute")], cwd=root / "bin")
+        for name in ("cc", "existing-file", "existing-link", "link-to-dir", "absolute"):
+            assert os.readlink(str(root / "bin" / name)) == "clang"
+        # ln -fsn creates links inside real directories instead of replacing them
+        fs.create_symlinks([("../bin/clang", root / "lib")])
+        assert os.readlink(str(root / "lib/clang")) == "../bin/clang"
+        # no temporary files must be left behind
+        assert sorted(p.name for p in (root / "bin").iterdir()) == [
+            "absolute", "cc", "clang", "existing-file", "existing-link", "link-to-dir"]
+
+        with pytest.raises(SystemExit):
+            fs.createSymlink(root / "bin/clang", root / "sdk/bin/clang")  # parent directory is missing
+        fs.makedirs(root / "sdk/bin")
+        fs.createSymlink(root / "bin/clang", root / "sdk/bin/clang")
+        assert os.readlink(str(root / "sdk/bin/clang")) == "../../bin/clang"
+
+
+def test_create_symlinks_pretend():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        fs = _fs(root, pretend=True)
+        (root / "tool").write_text("tool")
+        fs.createBuildtoolTargetSymlinks(root / "tool")
+        fs.moveFile(root / "tool", root / "moved")
+        assert sorted(p.name for p in root.iterdir()) == ["tool"]
+
+
+def test_build_tool_symlinks():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        fs = _fs(root)
+        (root / "llvm-objdump").write_text("objdump")
+        fs.createBuildtoolTargetSymlinks(root / "llvm-objdump", toolName="objdump", createUnprefixedLink=True)
+        assert sorted(p.name for p in root.iterdir()) == [
+            "cheri-unknown-freebsd-objdump", "llvm-objdump", "mips4-unknown-freebsd-objdump",
+            "mips64-unknown-freebsd-objdump", "objdump"]
+        assert all(os.readlink(str(p)) == "llvm-objdump" for p in root.iterdir() if p.is_symlink())
+
+
+def test_move_file():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        fs = _fs(root)
+        (root / "a").write_text("a")
+        (root / "b").write_text("b")
+        fs.moveFile(root / "a", root / "b", force=True)
+        assert (root / "b").read_text() == "a"
+        assert not (root / "a").exists()
+        (root / "dir").mkdir()
+        fs.moveFile(root / "b", root / "dir")
+        assert (root / "dir/b").read_text() == "a"
+        fs.moveFile(root / "dir/b", root / "new/parent/c")
+        assert (root / "new/parent/c").read_text() == "a"
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_sdk_symlinks():
+    # The sdk target creates the target-prefixed symlinks for all LLVM, elftoolchain and binutils tools
+    tools = ["tool" + str(i) for i in range(int(os.getenv("CHERIBUILD_BENCHMARK_TOOLS", "60")))]
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        fs = _fs(root)
+        for tool in tools:
+            (root / ("llvm-" + tool)).write_text(tool)
+        start = time.time()
+        for tool in tools:
+            for prefix in ("", "mips4-unknown-freebsd-", "cheri-unknown-freebsd-", "mips64-unknown-freebsd-"):
+                subprocess.check_call(["ln", "-fsn", "llvm-" + tool, prefix + tool], cwd=str(root))
+        ln_time = time.time() - start
+        start = time.time()
+        for tool in tools:
+            fs.createBuildtoolTargetSymlinks(root / ("llvm-" + tool), toolName=tool, createUnprefixedLink=True)
+        native_time = time.time() - start
+        print("\nCreating", 4 * len(tools), "symlinks: ln {:.3f}s, native {:.3f}s".format(ln_time, native_time))
+
+
+@pytest.mark.parametrize("delete_jobs", [None, 2])
+def test_delete_directories(delete_jobs):
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        fs = _fs(root)
+        fs.config.delete_jobs = delete_jobs  # rm -rf by default, delete_tree() with --delete-jobs
+        for d in ("build/a/b", "build/c"):
+            (root / d).mkdir(parents=True)
+            (root / d / "file").write_text(d)
+        fs.cleanDirectory(root / "build")
+        assert list((root / "build").iterdir()) == []
+
+
+def test_background_deletion_uses_one_thread(monkeypatch):
+    import pycheribuild.filesystemutils
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        fs = _fs(root)
+        fs.config.delete_jobs = 8
+        calls = []
+        monkeypatch.setattr(pycheribuild.filesystemutils, "delete_tree", lambda path, jobs: calls.append(jobs))
+        fs._deleteDirectories(root / "foreground")
+        fs._delete_directories_in_background(root / "background")
+        assert calls == [8, 1]
@@ -0,0 +1,127 @@
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.projects.project import Project
+from .setup_test_project import create_test_project, commit_random_files, git, git_dir_size
+
+pytestmark = pytest.mark.skipif(not shutil.which("git"), reason="git is not installed")
+
+
+def _create_bare_repo(root: Path, name: str, subdirs, commits: int) -> "typing.Tuple[Path, str]":
+    """Create a repository with history in all subdirs and a bare copy that allows partial clones"""
+    work = root / (name + "-work")
+    work.mkdir()
+    git("init", "-q", cwd=work)
+    (work / "README").write_text("test\n")
+    commit_random_files(work, commits, subdirs=subdirs, files_per_subdir=4, size=8 * 1024)
+    bare = root / (name + ".git")
+    git("clone", "-q", "--bare", str(work), str(bare))
+    git("config", "uploadpack.allowFilter", "true", cwd=bare)
+    git("config", "uploadpack.allowAnySHA1InWant", "true", cwd=bare)
+    # Partial and shallow clones are not supported for local paths -> use a file:// URL
+    return work, bare.as_uri()
+
+
+class CloneModeProject(Project):
+    doNotAddToTargets = True
+    projectName = "git-clone-modes-test"
+    target = "git-clone-modes-test"
+
+
+def _create_project(root: Path, source_dir: Path, **kwargs) -> CloneModeProject:
+    project = create_test_project(CloneModeProject, root, git_clone_mode="shallow")
+    project.sourceDir = source_dir
+    for k, v in kwargs.items():
+        setattr(project, k, v)
+    return project
+
+
+def test_clone_modes():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        subdirs = ["llvm", "clang", "lld", "compiler-rt"]
+        work, url = _create_bare_repo(root, "llvm-project", subdirs, 20)
+        results = dict()
+        for mode in ("full", "shallow", "blobless", "treeless"):
+            source_dir = root / mode
+            project = _create_project(root, source_dir, git_clone_mode=mode)
+            start = time.time()
+            project._ensureGitRepoIsCloned(srcDir=source_dir, remoteUrl=url, skipSubmodules=True)
+            results[mode] = (git_dir_size(source_dir), time.time() - start)
+            # All modes must check out the full working tree
+            for subdir in subdirs:
+                assert (source_dir / subdir / "file3").read_bytes() == (work / subdir / "file3").read_bytes()
+        print()
+        for mode, (size, duration) in results.items():
+            print("{:>8}: {:6} KiB in {:.2f}s".format(mode, size // 1024, duration))
+        assert git("rev-list", "--count", "HEAD", cwd=root / "shallow") == "1"
+        assert git("rev-list", "--count", "HEAD", cwd=root / "blobless") == "20"
+        full_size = results["full"][0]
+        assert results["shallow"][0] * 2 < full_size
+        assert results["blobless"][0] * 2 < full_size
+        assert results["treeless"][0] * 2 < full_size
+
+        # Updating a blobless clone fetches the new commits (and the blobs needed for the checkout)
+        commit_random_files(work, 1, subdirs=["lld"], files_per_subdir=4, size=8 * 1024)
+        git("push", "-q", url, "HEAD:master", cwd=work)
+        project = _create_project(root, root / "blobless", git_clone_mode="blobless")
+        project._updateGitRepo(root / "blobless", url, skipSubmodules=True)
+        assert (root / "blobless/lld/file0").read_bytes() == (work / "lld/file0").read_bytes()
+        # Old file contents are fetched on demand
+        old_contents = subprocess.check_output(["git", "cat-file", "blob", "HEAD~10:clang/file1"],
+                                               cwd=str(root / "blobless"))
+        assert old_contents == subprocess.check_output(["git", "cat-file", "blob", "HEAD~10:clang/file1"],
+                                                       cwd=str(work))
+
+
+def test_sparse_checkout():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        work, url = _create_bare_repo(root, "llvm-project", ["llvm", "clang", "lld", "compiler-rt"], 2)
+        source_dir = root / "sparse"
+        project = _create_project(root, source_dir, git_clone_mode="blobless", sparse_checkout=["llvm", "clang"])
+        project._updateGitRepo(source_dir, url, skipSubmodules=True)
+        assert (source_dir / "README").exists()
+        assert (source_dir / "llvm/file0").exists()
+        assert (source_dir / "clang/file0").exists()
+        assert not (source_dir / "lld").exists()
+        assert not (source_dir / "compiler-rt").exists()
+        # Changing the profile updates existing sparse checkouts
+        project = _create_project(root, source_dir, sparse_checkout=["llvm", "clang", "lld"])
+        project._updateGitRepo(source_dir, url, skipSubmodules=True)
+        assert (source_dir / "lld/file0").exists()
+        assert not (source_dir / "compiler-rt").exists()
+        # ... but not the other repositories cloned by the same project (e.g. tools/clang for LLVM)
+        other_dir = source_dir / "nested"
+        project._updateGitRepo(other_dir, url, skipSubmodules=True)
+        assert (other_dir / "compiler-rt/file0").exists()
+
+
+def test_shallow_submodules(monkeypatch):
+    # git 2.38.1+ doesn't allow file:// submodules by default
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", "protocol.file.allow")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "always")
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        _, submodule_url = _create_bare_repo(root, "dtc", ["src"], 10)
+        work, url = _create_bare_repo(root, "qemu", ["hw"], 2)
+        git("submodule", "add", "-q", submodule_url, "dtc", cwd=work)
+        git("commit", "-q", "-m", "add submodule", cwd=work)
+        git("push", "-q", url, "HEAD:master", cwd=work)
+
+        project = _create_project(root, root / "deep", git_clone_mode="full")
+        project._updateGitRepo(root / "deep", url)
+        assert git("rev-list", "--count", "HEAD", cwd=root / "deep/dtc") == "10"
+        project = _create_project(root, root / "shallow", git_clone_mode="full", shallow_submodules=True)
+        project._updateGitRepo(root / "shallow", url)
+        assert (root / "shallow/dtc/src/file0").exists()
+        assert git("rev-list", "--count", "HEAD", cwd=root / "shallow/dtc") == "1"
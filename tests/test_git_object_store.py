@@ -0,0 +1,89 @@
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.git_object_store import GitObjectStore
+from pycheribuild.projects.project import Project
+from .setup_test_project import create_test_project, commit_random_files, git, git_dir_size
+
+pytestmark = pytest.mark.skipif(not shutil.which("git"), reason="git is not installed")
+
+
+def _create_related_remotes(root: Path) -> "typing.Tuple[str, str]":
+    """Create a freebsd repository and a cheribsd repository that contains all of freebsd plus some extra commits"""
+    work = root / "work"
+    work.mkdir()
+    git("init", "-q", cwd=work)
+    commit_random_files(work, 50, prefix="freebsd")
+    git("clone", "-q", "--bare", str(work), str(root / "freebsd.git"))
+    commit_random_files(work, 5, prefix="cheri")
+    git("clone", "-q", "--bare", str(work), str(root / "cheribsd.git"))
+    return (root / "freebsd.git").as_uri(), (root / "cheribsd.git").as_uri()
+
+
+class GitCloneProject(Project):
+    doNotAddToTargets = True
+    projectName = "git-clone-test"
+    target = "git-clone-test"
+
+
+def _clone_all(project: Project, source_root: Path, urls) -> float:
+    start = time.time()
+    for name, url in urls:
+        project._ensureGitRepoIsCloned(srcDir=source_root / name, remoteUrl=url, skipSubmodules=True)
+    return time.time() - start
+
+
+def test_remote_names():
+    name1 = GitObjectStore.remote_name("https://github.com/CTSRD-CHERI/cheribsd.git")
+    name2 = GitObjectStore.remote_name("https://github.com/freebsd/freebsd.git")
+    assert name1.startswith("github-com-CTSRD-CHERI-cheribsd-git-")
+    assert name1 != name2
+    assert name1 == GitObjectStore.remote_name("https://github.com/CTSRD-CHERI/cheribsd.git")
+
+
+def test_shared_object_store_saves_space():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        freebsd_url, cheribsd_url = _create_related_remotes(root)
+        urls = [("cheribsd", cheribsd_url), ("freebsd", freebsd_url)]
+
+        # Two independent source roots without a shared store (full clones so that the history is the same)
+        without_store_time = 0.0
+        for source_root in (root / "separate1", root / "separate2"):
+            start = time.time()
+            for name, url in urls:
+                git("clone", "-q", url, str(source_root / name))
+            without_store_time += time.time() - start
+        without_store_size = git_dir_size(root / "separate1") + git_dir_size(root / "separate2")
+
+        store_path = root / "object-store.git"
+        project = create_test_project(GitCloneProject, root, git_object_store=store_path)
+        with_store_time = _clone_all(project, root / "shared1", urls) + _clone_all(project, root / "shared2", urls)
+        store = GitObjectStore(store_path)
+        assert set(store.remotes().values()) == {cheribsd_url, freebsd_url}
+        for source_root in (root / "shared1", root / "shared2"):
+            for name, _ in urls:
+                assert store.is_used_by(source_root / name)
+                assert (source_root / name / "cheri0").exists() == (name == "cheribsd")
+                assert (source_root / name / "freebsd49").exists()
+        with_store_size = git_dir_size(store_path) + git_dir_size(root / "shared1") + \
+            git_dir_size(root / "shared2")
+        print("\nGit directories without shared store: {} KiB in {:.2f}s, with shared store: {} KiB in {:.2f}s".format(
+              without_store_size // 1024, without_store_time, with_store_size // 1024, with_store_time))
+        # Four full copies of the history vs. one copy in the store (cheribsd and freebsd share all freebsd objects)
+        assert with_store_size * 2 < without_store_size
+        # The clones themselves should not contain any of the large objects
+        assert git_dir_size(root / "shared2") < 256 * 1024
+
+        # Maintenance must not remove objects that are only referenced from the clones
+        store.maintenance()
+        subprocess.check_call(["git", "fsck", "--connectivity-only", "--no-dangling"],
+                              cwd=str(root / "shared2/cheribsd"), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -0,0 +1,97 @@
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.projects.project import Project
+from .setup_test_project import create_test_project, commit_file, git
+
+pytestmark = pytest.mark.skipif(not shutil.which("git"), reason="git is not installed")
+
+
+class GitUpdateProject(Project):
+    doNotAddToTargets = True
+    projectName = "git-update-test"
+    target = "git-update-test"
+
+
+def _create_project(root: Path) -> GitUpdateProject:
+    return create_test_project(GitUpdateProject, root, force_update=True, git_clone_mode="full")
+
+
+def _update(project: Project, source_dir: Path, url: str) -> float:
+    # Every cheribuild invocation starts with an empty ls-remote cache
+    project.config.git_update_state.remote_heads.clear()
+    start = time.time()
+    project._updateGitRepo(source_dir, url, skipSubmodules=True)
+    return time.time() - start
+
+
+def test_unchanged_repository_is_skipped():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        work = root / "work"
+        work.mkdir()
+        git("init", "-q", cwd=work)
+        commit_file(work, "file", "1")
+        git("clone", "-q", "--bare", str(work), str(root / "remote.git"))
+        url = (root / "remote.git").as_uri()
+        source_dir = root / "source"
+        project = _create_project(root)
+        state = project.config.git_update_state
+
+        # Just cloned -> nothing to do, not even the check for local changes
+        project._ensureGitRepoIsCloned(srcDir=source_dir, remoteUrl=url)
+        (source_dir / "file").write_text("local change")
+        fast_path_time = _update(project, source_dir, url)
+        assert state.checked == 1
+        assert state.skipped == 1
+        assert (source_dir / "file").read_text() == "local change"
+        assert git("stash", "list", cwd=source_dir) == ""
+
+        # New upstream commit -> full update (with autostash)
+        commit_file(work, "file2", "2")
+        git("push", "-q", url, "HEAD:master", cwd=work)
+        slow_path_time = _update(project, source_dir, url)
+        assert state.checked == 2
+        assert state.skipped == 1
+        assert (source_dir / "file2").read_text() == "2"
+        assert (source_dir / "file").read_text() == "local change"
+        # The duration is stored in the build root and not in the .git/config of the repository
+        assert state.last_update_duration(source_dir) > 0
+        assert "cheribuild." not in git("config", "--list", "--local", cwd=source_dir)
+
+        # Local commits on top of the upstream branch don't require an update either
+        commit_file(source_dir, "file3", "3")
+        _update(project, source_dir, url)
+        assert state.checked == 3
+        assert state.skipped == 2
+        print("\nUnchanged repository: {:.3f}s, full update: {:.3f}s".format(fast_path_time, slow_path_time))
+
+        # The remote branches are only queried once per URL (and cached for all other projects using that URL)
+        assert list(state.remote_heads.keys()) == [url]
+        state.remote_heads[url] = dict()
+        project._updateGitRepo(source_dir, url, skipSubmodules=True)
+        assert state.checked == 4
+        assert state.skipped == 2
+
+
+def test_detached_head_uses_slow_path():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        work = root / "work"
+        work.mkdir()
+        git("init", "-q", cwd=work)
+        commit_file(work, "file", "1")
+        commit_file(work, "file", "2")
+        source_dir = root / "source"
+        git("clone", "-q", str(work), str(source_dir))
+        git("checkout", "-q", "HEAD~1", cwd=source_dir)
+        project = _create_project(root)
+        assert not project._git_upstream_unchanged(source_dir, skipSubmodules=True)
+        assert project.config.git_update_state.skipped == 0
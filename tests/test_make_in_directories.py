@@ -0,0 +1,122 @@
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.projects.project import Project, MakeCommandKind
+from .setup_test_project import create_test_project
+
+MAKEFILE = """
+obj:
+\t@echo creating objdir for {name}
+all:
+\t@sleep {delay}
+\t@echo building {name}
+\t@echo warning from {name} >&2
+\t@touch built
+{extra}
+"""
+
+
+class MakeInDirectoriesProject(Project):
+    doNotAddToTargets = True
+    projectName = "make-in-directories-test"
+    target = "make-in-directories-test"
+    make_kind = MakeCommandKind.DefaultMake
+
+
+def _create_project(root: Path, **config_overrides) -> MakeInDirectoriesProject:
+    config_overrides = dict(dict(quiet=False, noLogfile=False, makeJobs=4, passDashKToMake=False), **config_overrides)
+    project = create_test_project(MakeInDirectoriesProject, root, **config_overrides)
+    project.buildDir = root / "build"
+    project.buildDir.mkdir(parents=True, exist_ok=True)
+    return project
+
+
+def _create_directories(root: Path, count: int, delay: float, extra="") -> "typing.List[Path]":
+    result = []
+    for i in range(count):
+        directory = root / "src" / ("prog" + str(i))
+        directory.mkdir(parents=True)
+        (directory / "Makefile").write_text(MAKEFILE.format(name=directory.name, delay=delay, extra=extra))
+        result.append(directory)
+    return result
+
+
+def test_make_in_directories():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        project = _create_project(root)
+        # Later directories finish first but the output is still in order
+        directories = _create_directories(root, 4, 0)
+        (directories[0] / "Makefile").write_text(MAKEFILE.format(name="prog0", delay=0.5, extra=""))
+        start = time.time()
+        project.run_make_in_directories(directories, "obj", "all", logfileName="build")
+        duration = time.time() - start
+        assert all((d / "built").exists() for d in directories)
+        log = (project.buildDir / "build.log").read_text()
+        positions = [log.index("building prog" + str(i)) for i in range(4)]
+        assert positions == sorted(positions)
+        assert log.index("creating objdir for prog1") < log.index("building prog1")
+        # stderr is written to the log together with stdout and not appended after it
+        assert all("building prog{0}\nwarning from prog{0}\n".format(i) in log for i in range(4))
+        assert duration < 2
+
+
+def test_make_in_directories_failure(capfd):
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        project = _create_project(root, quiet=True)
+        directories = _create_directories(root, 3, 0)
+        (directories[1] / "Makefile").write_text("all:\n\t@echo building prog1\n\t@echo broken build >&2; false\n")
+        with pytest.raises(SystemExit):
+            project.run_make_in_directories(directories, "all", logfileName="build")
+        out, err = capfd.readouterr()
+        assert "failed with exit code 2" in err
+        # The output of the failed command is shown even with --quiet
+        assert "building prog1\nbroken build" in out
+        assert "building prog1\nbroken build" in (project.buildDir / "build.log").read_text()
+        assert (directories[0] / "built").exists()
+
+
+def test_make_in_directories_pretend():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        project = _create_project(root, pretend=True)
+        directories = _create_directories(root, 2, 0)
+        project.run_make_in_directories(directories, "obj", "all", logfileName="build")
+        assert not any((d / "built").exists() for d in directories)
+        assert not (project.buildDir / "build.log").exists()
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_make_in_directories():
+    # Similar to the elftoolchain bmake fallback: 10 program directories that each compile a few C files
+    sources = "".join("src{0}.o: \n\t@printf 'int f{0}(void) {{ return {0}; }}\\n' > src{0}.c && cc -O2 -c src{0}.c\n"
+                      .format(i) for i in range(8))
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        project = _create_project(root, quiet=True, makeJobs=os.cpu_count())
+        directories = []
+        for i in range(10):
+            directory = root / "src" / ("prog" + str(i))
+            directory.mkdir(parents=True)
+            (directory / "Makefile").write_text("obj:\nall: " + " ".join("src%d.o" % j for j in range(8)) + "\n" +
+                                                sources + "clean:\n\trm -f *.o\n")
+            directories.append(directory)
+        start = time.time()
+        for directory in directories:
+            project.runMake("obj", cwd=directory, logfileName="serial", appendToLogfile=True, parallel=False)
+            project.runMake("all", cwd=directory, logfileName="serial", appendToLogfile=True, parallel=False)
+        serial = time.time() - start
+        project.run_make_in_directories(directories, "clean", logfileName="clean")
+        start = time.time()
+        project.run_make_in_directories(directories, "obj", "all", logfileName="concurrent")
+        concurrent = time.time() - start
+        print("\n{} directories with {} CPUs: serial {:.2f}s, concurrent {:.2f}s".format(
+            len(directories), os.cpu_count(), serial, concurrent))
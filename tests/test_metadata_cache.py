@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.filesystemutils import FileSystemUtils
+from pycheribuild.metadata_cache import FileSystemMetadataCache, metadata_cache
+from pycheribuild.utils import runCmd
+from .setup_mock_chericonfig import setup_mock_chericonfig
+
+
+def test_which_matches_shutil_which():
+    cache = FileSystemMetadataCache()
+    for program in ("sh", "python3", "git", "does-not-exist-anywhere", "clang-9", "/bin/sh", "/does/not/exist"):
+        assert cache.which(program) == shutil.which(program), program
+        assert cache.which(program) == shutil.which(program), program
+    assert cache.statistics["hits"] >= 7
+
+
+def test_which_uses_directory_listings(monkeypatch):
+    with tempfile.TemporaryDirectory() as td:
+        dirs = [Path(td, "bin" + str(i)) for i in range(10)]
+        for d in dirs:
+            d.mkdir()
+        (dirs[7] / "tool").write_text("#!/bin/sh\n")
+        (dirs[7] / "tool").chmod(0o755)
+        (dirs[3] / "not-executable").write_text("")
+        (dirs[3] / "a-directory").mkdir()
+        monkeypatch.setenv("PATH", os.pathsep.join(map(str, dirs)))
+        cache = FileSystemMetadataCache()
+        assert cache.which("tool") == str(dirs[7] / "tool")
+        assert cache.which("not-executable") is None
+        assert cache.which("a-directory") is None
+        # Looking up more programs does not list the directories again
+        misses = cache.statistics["misses"]
+        for name in ("clang-" + str(i) for i in range(20)):
+            assert cache.which(name) is None
+        assert cache.statistics["misses"] == misses + 20
+        assert len(cache._listdir) == len(dirs)
+
+
+def test_statistics_are_thread_safe():
+    from concurrent.futures import ThreadPoolExecutor
+    cache = FileSystemMetadataCache()
+    paths = ["/does/not/exist/" + str(i % 50) for i in range(20000)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(cache.exists, paths))
+    assert cache.statistics["hits"] + cache.statistics["misses"] == len(paths)
+
+
+def test_invalidation():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        config = setup_mock_chericonfig(root)
+        config.pretend = False
+        config.verbose = False
+        fs = FileSystemUtils(config)
+        sdk_bin = root / "sdk/bin"
+        metadata_cache.clear()
+        assert not metadata_cache.exists(sdk_bin / "clang")
+        assert not metadata_cache.is_dir(root / "sdk")
+        fs.makedirs(sdk_bin)
+        assert metadata_cache.is_dir(root / "sdk")
+        assert metadata_cache.listdir(sdk_bin) == []
+        fs.writeFile(sdk_bin / "clang", "", overwrite=False, mode=0o755)
+        assert metadata_cache.is_file(sdk_bin / "clang")
+        assert metadata_cache.listdir(sdk_bin) == ["clang"]
+        fs.createSymlink(sdk_bin / "clang", sdk_bin / "cc")
+        assert metadata_cache.listdir(sdk_bin) == ["cc", "clang"]
+        fs.moveFile(sdk_bin / "cc", sdk_bin / "c++")
+        assert metadata_cache.listdir(sdk_bin) == ["c++", "clang"]
+        assert not metadata_cache.exists(sdk_bin / "cc")
+        fs.deleteFile(sdk_bin / "clang")
+        assert not metadata_cache.exists(sdk_bin / "c++")  # dangling symlink
+        fs.cleanDirectory(root / "sdk")
+        assert metadata_cache.listdir(root / "sdk") == []
+        # Commands could have modified anything
+        metadata_cache.stat(root)
+        runCmd("touch", root / "sdk/file")
+        assert metadata_cache.listdir(root / "sdk") == ["file"]
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_pretend_metadata_syscalls():
+    # Count the stat()/access()/listdir() calls made by `cheribuild.py --pretend all` with and without the cache
+    counter = """
+import collections, os, runpy, shutil, sys, atexit
+counts = collections.Counter()
+def wrap(name):
+    orig = getattr(os, name)
+    def counting(*args, **kwargs):
+        counts[name] += 1
+        return orig(*args, **kwargs)
+    setattr(os, name, counting)
+for name in ("stat", "lstat", "listdir", "scandir", "access"):
+    wrap(name)
+if os.getenv("DISABLE_CACHE"):
+    from pycheribuild.metadata_cache import FileSystemMetadataCache
+    FileSystemMetadataCache._lookup = lambda self, cache, key, compute: compute()
+    FileSystemMetadataCache._which_uncached = lambda self, program, path: shutil.which(program)
+atexit.register(lambda: print("SYSCALLS", sum(counts.values()), file=sys.stderr))
+sys.argv = [sys.argv[1]] + sys.argv[2:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+    repo = Path(__file__).parent.parent
+    results = dict()
+    with tempfile.TemporaryDirectory() as td:
+        for name, env in (("uncached", dict(DISABLE_CACHE="1")), ("cached", dict())):
+            env.update(PYTHONPATH=str(repo), HOME=td)
+            result = subprocess.run([sys.executable, "-c", counter, str(repo / "cheribuild.py"), "--pretend",
+                                     "--skip-update", "all"], env=dict(os.environ, **env), cwd=td,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            results[name] = int(result.stderr.decode("utf-8").split("SYSCALLS ")[-1].split()[0])
+    print("\n--pretend all: {uncached} metadata syscalls without the cache, {cached} with the cache".format(**results))
+    assert results["cached"] < results["uncached"]
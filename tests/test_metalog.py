@@ -1,8 +1,12 @@
 import pytest
+import random
+import shlex
 import sys
 import io
 import os
 import tempfile
+import time
+import tracemalloc
 try:
     import typing
 except ImportError:
@@ -11,7 +15,7 @@ from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from pycheribuild.mtree import MtreeFile
+from pycheribuild.mtree import MtreeFile, MtreeEntry, MtreeDiff, MtreeView, mtree_escape, mtree_split
 
 HAVE_LCHMOD = True
 
@@ -266,3 +270,524 @@ def test_symlink_infer_mode(temp_symlink):
 """.format(target=temp_symlink[2], testfile=str(temp_symlink[1]), symlink_perms=symlink_perms)
     assert expected == _get_as_str(mtree)
 
+
+
+def test_mtree_split_matches_shlex():
+    # Without octal escapes the mtree tokenizer must behave exactly like the old shlex.split() based parser
+    rng = random.Random(1234)
+    alphabet = ["a", "b", "/", ".", "=", "-", "_", " ", " ", "\t", "\\", "\\", "\\ ", "\u00e9", "\u00a0", "'", "\""]
+    for _ in range(20000):
+        line = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        try:
+            expected = shlex.split(line)
+        except ValueError:
+            with pytest.raises(ValueError):
+                mtree_split(line)
+            continue
+        assert mtree_split(line) == expected, "Mismatch for " + repr(line)
+
+
+def test_mtree_split_escapes():
+    assert mtree_split("./foo\\040bar type=file") == ["./foo bar", "type=file"]
+    assert mtree_split("./caf\\303\\251 link=a\\\\b\\ c") == ["./caf\u00e9", "link=a\\b c"]
+    assert mtree_split("./tab\\011  type=dir\t mode=0755\n") == ["./tab\t", "type=dir", "mode=0755"]
+    # Only the first three digits are part of the octal escape
+    assert mtree_split("./a\\0401") == ["./a 1"]
+    with pytest.raises(ValueError):
+        mtree_split("./foo\\")
+    entry = MtreeEntry.parse("./usr/share/my\\040file type=file uname=root mode=0644 time=1.5 tags=package=foo")
+    assert entry.path == "./usr/share/my file"
+    assert list(entry.attributes.items()) == [("type", "file"), ("uname", "root"), ("mode", "0644")]
+
+
+def test_escaped_paths_round_trip():
+    assert mtree_escape("./usr/bin/cat") == "./usr/bin/cat"
+    assert mtree_escape("./a b\tc\\d#e\u00e9") == "./a\\040b\\011c\\134d\\043e\\303\\251"
+    metalog = """#mtree 2.0
+./a\\040b type=file uname=root gname=wheel mode=0644 contents=/tmp/x\\040y
+./caf\\303\\251 type=link uname=root gname=wheel mode=0755 link=../a\\040b
+./#comment\\ not type=dir uname=root gname=wheel mode=0755
+./back\\\\slash type=dir uname=root gname=wheel mode=0755
+# END
+"""
+    mtree = MtreeFile(io.StringIO(metalog))
+    assert sorted(e.path for e in mtree) == ["./#comment not", "./a b", "./back\\slash", "./caf\u00e9"]
+    output = _get_as_str(mtree)
+    # Every line must still consist of space-separated fields that makefs can parse
+    assert "./a\\040b type=file uname=root gname=wheel mode=0644 contents=/tmp/x\\040y\n" in output
+    assert "link=../a\\040b" in output
+    assert "./\\043comment\\040not type=dir" in output
+    reparsed = MtreeFile(io.StringIO(output))
+    assert sorted(map(str, reparsed)) == sorted(map(str, mtree))
+    assert _get_as_str(reparsed) == output
+
+
+def _generate_metalog(num_lines: int) -> str:
+    lines = ["#mtree 2.0"]
+    for i in range(num_lines):
+        directory = "./usr/lib/dir" + str(i % 500)
+        if i % 500 == i:
+            lines.append(directory + " type=dir uname=root gname=wheel mode=0755 tags=package=runtime")
+        elif i % 50 == 0:
+            lines.append(directory + "/link" + str(i) + " type=link uname=root gname=wheel mode=0755 "
+                         "link=../../../bin/cheribsdbox tags=package=runtime")
+        else:
+            lines.append(directory + "/file" + str(i) + ".so type=file uname=root gname=wheel mode=0444 size=" +
+                         str(i * 13) + " time=1514764800.123456789 tags=package=runtime,debug")
+    return "\n".join(lines) + "\n"
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_parse_metalog():
+    num_lines = int(os.getenv("CHERIBUILD_BENCHMARK_LINES", "100000"))
+    lines = _generate_metalog(num_lines).splitlines()[1:]
+    start = time.time()
+    for line in lines:
+        shlex.split(line)
+    shlex_time = time.time() - start
+    start = time.time()
+    for line in lines:
+        mtree_split(line)
+    split_time = time.time() - start
+    start = time.time()
+    mtree = MtreeFile(io.StringIO(_generate_metalog(num_lines)))
+    load_time = time.time() - start
+    assert len(mtree) == num_lines
+    print("\nTokenizing {} lines: shlex.split {:.2f}s, mtree_split {:.2f}s; MtreeFile.load {:.2f}s".format(
+        num_lines, shlex_time, split_time, load_time))
+
+
+def test_entry_attributes():
+    entry = MtreeEntry.parse("./bin/cat type=file uname=root gname=wheel mode=0755 contents=./bin/cheribsdbox")
+    other = MtreeEntry.parse("./bin/ls type=file uname=root gname=wheel mode=0755 size=123")
+    # The common attributes are shared between entries
+    assert entry._common is other._common
+    assert not hasattr(entry, "__dict__")
+    assert entry.is_file() and not entry.is_dir()
+    assert entry.attributes["contents"] == "./bin/cheribsdbox"
+    assert entry.attributes.get("size") is None
+    assert dict(other.attributes) == {"type": "file", "uname": "root", "gname": "wheel", "mode": "0755", "size": "123"}
+    entry.attributes["contents"] = "/path/to/cheribsdbox"
+    entry.attributes["mode"] = "0555"
+    assert str(entry) == "./bin/cat type=file uname=root gname=wheel mode=0555 contents=/path/to/cheribsdbox"
+    del entry.attributes["uname"]
+    assert list(entry.attributes) == ["type", "gname", "mode", "contents"]
+    # Attributes in a different order are written back in the same order
+    entry = MtreeEntry.parse("./etc mode=0755 type=dir uname=root")
+    assert str(entry) == "./etc mode=0755 type=dir uname=root"
+    assert entry.is_dir()
+    entry.attributes = {"type": "link", "link": "foo"}
+    assert str(entry) == "./etc type=link link=foo"
+    with pytest.raises(KeyError):
+        del entry.attributes["mode"]
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_metalog_memory():
+    num_lines = int(os.getenv("CHERIBUILD_BENCHMARK_LINES", "100000"))
+    metalog = _generate_metalog(num_lines)
+    start = time.time()
+    mtree = MtreeFile(io.StringIO(metalog))
+    load_time = time.time() - start
+    start = time.time()
+    mtree.write(io.StringIO())
+    write_time = time.time() - start
+    del mtree
+    tracemalloc.start()
+    mtree = MtreeFile(io.StringIO(metalog))
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(mtree) == num_lines
+    print("\n{} entries: load {:.2f}s, write {:.2f}s, {:.1f} MiB retained ({:.1f} MiB peak)".format(
+        num_lines, load_time, write_time, retained / 1024 / 1024, peak / 1024 / 1024))
+
+
+def test_path_normalization():
+    mtree = MtreeFile()
+    mtree.add_dir("usr//lib/./debug/../tests/", mode="0750")
+    mtree.add_dir(".ssh/.config")
+    assert "usr/lib/tests" in mtree
+    assert "usr/lib//tests" in mtree
+    assert "usr/lib/debug" not in mtree
+    assert sorted(mtree._mtree.keys()) == [".", "./.ssh", "./.ssh/.config", "./usr", "./usr/lib", "./usr/lib/tests"]
+    # Parent directories use the same mode if there is no reference directory
+    assert all(e.attributes["mode"] == "0750" for e in mtree if e.path.startswith("./usr"))
+
+
+def test_add_directory():
+    with tempfile.TemporaryDirectory() as td:
+        root = _create_dir(td, "local", 0o755)
+        bin_dir = _create_dir(root, "bin", 0o751)
+        _create_file(bin_dir, "tool", 0o755)
+        _create_symlink(bin_dir, "tool-link", "tool", 0o777)
+        _create_dir(root, "empty", 0o700)
+        ssh_dir = _create_dir(root, ".ssh", 0o755)
+        _create_file(ssh_dir, "id_rsa", 0o644)
+        _create_file(ssh_dir, "id_rsa.pub", 0o644)
+        mtree = MtreeFile()
+        mtree.add_dir("usr", mode="0555")
+        mtree.add_directory(root, "usr/local", print_status=False)
+        expected = """#mtree 2.0
+. type=dir uname=root gname=wheel mode=0555
+./usr type=dir uname=root gname=wheel mode=0555
+./usr/local type=dir uname=root gname=wheel mode=0755
+./usr/local/.ssh type=dir uname=root gname=wheel mode=0700
+./usr/local/.ssh/id_rsa type=file uname=root gname=wheel mode=0600 contents={root}/.ssh/id_rsa
+./usr/local/.ssh/id_rsa.pub type=file uname=root gname=wheel mode=0644 contents={root}/.ssh/id_rsa.pub
+./usr/local/bin type=dir uname=root gname=wheel mode=0751
+./usr/local/bin/tool type=file uname=root gname=wheel mode=0755 contents={root}/bin/tool
+./usr/local/bin/tool-link type=link uname=root gname=wheel mode=0777 link=tool
+./usr/local/empty type=dir uname=root gname=wheel mode=0700
+# END
+""".format(root=root)
+        assert expected == _get_as_str(mtree)
+        # Must be the same as adding the files one by one
+        other = MtreeFile()
+        other.add_dir("usr", mode="0555")
+        for f in ("bin/tool", "bin/tool-link", ".ssh/id_rsa", ".ssh/id_rsa.pub"):
+            other.add_file(root / f, "usr/local/" + f, print_status=False)
+        other.add_dir("usr/local/empty", reference_dir=root / "empty", print_status=False)
+        assert expected == _get_as_str(other)
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_add_files():
+    num_files = int(os.getenv("CHERIBUILD_BENCHMARK_FILES", "200000"))
+    # Something like the kyua test trees: 8 levels of directories with 4 subdirectories each
+    paths = ["usr/tests/" + "/".join("level{}_{}".format(level, (i >> (2 * level)) % 4) for level in range(8)) +
+             "/test" + str(i) for i in range(num_files)]
+    mtree = MtreeFile()
+    start = time.time()
+    for path in paths:
+        mtree.add_file(Path("/path/to/test"), path, mode="0555", parent_dir_mode="0755", print_status=False)
+    add_file_time = time.time() - start
+    entries = len(mtree)
+    with tempfile.TemporaryDirectory() as td:
+        for path in paths:
+            host_path = os.path.join(td, path)
+            os.makedirs(os.path.dirname(host_path), exist_ok=True)
+            os.close(os.open(host_path, os.O_CREAT | os.O_WRONLY, 0o555))
+        mtree = MtreeFile()
+        start = time.time()
+        for path in paths:
+            mtree.add_file(Path(td, path), path, print_status=False)
+        add_host_files_time = time.time() - start
+        mtree = MtreeFile()
+        start = time.time()
+        mtree.add_directory(Path(td, "usr"), "usr", print_status=False)
+        add_directory_time = time.time() - start
+        assert len(mtree) == entries
+    print("\nAdding {} files ({} entries): add_file {:.2f}s, add_file with host files {:.2f}s, "
+          "add_directory {:.2f}s".format(num_files, entries, add_file_time, add_host_files_time, add_directory_time))
+
+
+def test_incremental_sorting_and_changed_entries():
+    mtree = MtreeFile()
+    mtree.add_dir("usr/lib")
+    mtree.add_file(Path("/foo/libc.so"), "usr/lib/libc.so", mode="0444")
+    previous = MtreeFile(io.StringIO(_get_as_str(mtree)))
+    assert previous._sorted_keys() == [".", "./usr", "./usr/lib", "./usr/lib/libc.so"]
+    # New entries are merged into the already sorted keys
+    mtree.add_file(Path("/foo/libc++.so"), "usr/lib/libc++.so", mode="0444")
+    mtree.add_file(Path("/foo/ls"), "bin/ls", mode="0555")
+    mtree.add_file(Path("/foo/libc.so"), "usr/lib/libc.so", mode="0555")  # replaces the existing entry
+    assert mtree._sorted_keys() == [".", "./bin", "./bin/ls", "./usr", "./usr/lib", "./usr/lib/libc++.so",
+                                    "./usr/lib/libc.so"]
+    # Direct modification of _mtree (e.g. by the disk image code) also works
+    del mtree._mtree["./usr/lib/libc++.so"]
+    assert "./usr/lib/libc++.so" not in mtree._sorted_keys()
+    output = io.StringIO()
+    mtree.write(output, changed_since=previous)
+    assert output.getvalue() == """#mtree 2.0
+./bin type=dir uname=root gname=wheel mode=0755
+./bin/ls type=file uname=root gname=wheel mode=0555 contents=/foo/ls
+./usr/lib/libc.so type=file uname=root gname=wheel mode=0555 contents=/foo/libc.so
+# END
+"""
+
+
+def test_streaming():
+    metalog = _generate_metalog(10000)
+    entries = list(MtreeFile.iter_entries(io.StringIO(metalog)))
+    assert len(entries) == 10000
+    assert all(e.attributes.get("time") is None for e in entries)
+    streamed = io.StringIO()
+    MtreeFile.write_entries(streamed, sorted(entries, key=lambda e: e.path), chunk_size=7)
+    assert streamed.getvalue() == _get_as_str(MtreeFile(io.StringIO(metalog)))
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_streaming_metalog():
+    # Filtering a METALOG with iter_entries() and write_entries() only keeps one chunk in memory
+    with tempfile.TemporaryDirectory() as td:
+        results = []
+        for num_lines in (100000, int(os.getenv("CHERIBUILD_BENCHMARK_LINES", "1000000"))):
+            metalog = Path(td, "METALOG")
+            with metalog.open("w") as f:
+                f.write("#mtree 2.0\n")
+                for i in range(num_lines):
+                    f.write("./usr/lib/dir{}/file{}.so type=file uname=root gname=wheel mode=0444 size={} "
+                            "time=1514764800.123456789 tags=package=runtime\n".format(i % 500, i, i * 13))
+            tracemalloc.start()
+            start = time.time()
+            with Path(td, "METALOG.filtered").open("w") as output:
+                MtreeFile.write_entries(output, (e for e in MtreeFile.iter_entries(metalog) if e.is_file()))
+            duration = time.time() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append((num_lines, duration, peak))
+    print()
+    for num_lines, duration, peak in results:
+        print("Streaming {} entries: {:.2f}s, {:.2f} MiB peak".format(num_lines, duration, peak / 1024 / 1024))
+    assert results[1][2] < 2 * results[0][2]
+
+
+def _mtree(*lines) -> MtreeFile:
+    return MtreeFile(io.StringIO("#mtree 2.0\n. type=dir uname=root gname=wheel mode=0755\n" + "\n".join(lines)))
+
+
+def test_diff():
+    old = _mtree("./bin type=dir uname=root gname=wheel mode=0755",
+                 "./bin/ls type=file uname=root gname=wheel mode=0555 size=100 sha256digest=aaa contents=/a/bin/ls",
+                 "./bin/cat type=file uname=root gname=wheel mode=0555 size=50 contents=/a/bin/cat",
+                 "./bin/sh type=link uname=root gname=wheel mode=0755 link=csh",
+                 "./bin/rm type=file uname=root gname=wheel mode=0555 size=70 contents=/a/bin/rm")
+    new = _mtree("./bin type=dir uname=root gname=wheel mode=0755",
+                 "./bin/ls type=file uname=root gname=wheel mode=0555 size=120 sha256digest=bbb contents=/b/bin/ls",
+                 "./bin/cat type=file uname=root gname=wheel mode=0500 size=50 contents=/b/bin/cat",
+                 "./bin/sh type=file uname=root gname=wheel mode=0555 size=10 contents=/b/bin/sh",
+                 "./bin/echo type=file uname=root gname=wheel mode=0555 size=10 contents=/b/bin/echo")
+    assert not old.diff(old)
+    diff = old.diff(new)
+    assert [e.path for e in diff.added] == ["./bin/echo"]
+    assert [e.path for e in diff.removed] == ["./bin/rm"]
+    # A different contents= path doesn't count as a change
+    assert [(c[0].path, c[2]) for c in diff.changed] == [("./bin/cat", ["mode"]),
+                                                          ("./bin/ls", ["sha256digest", "size"]),
+                                                          ("./bin/sh", ["link", "mode", "size", "type"])]
+    assert diff.categories() == {"type": 1, "mode": 2, "size": 2, "digest": 1, "link": 1, "owner": 0, "other": 0}
+    assert diff.summary() == [
+        "1 added, 1 removed, 3 changed (type: 1, mode: 2, size: 2, digest: 1, link: 1)",
+        "+ ./bin/echo (file)",
+        "- ./bin/rm (file)",
+        "M ./bin/cat: mode 0555 -> 0500",
+        "M ./bin/ls: sha256digest changed, size 100 -> 120",
+        "M ./bin/sh: link csh -> <unset>, mode 0755 -> 0555, size <unset> -> 10, type link -> file"]
+    assert diff.summary(max_entries=2)[-1] == "... and 3 more"
+
+
+def test_merge():
+    base = _mtree("./bin type=dir uname=root gname=wheel mode=0755",
+                  "./bin/ls type=file uname=root gname=wheel mode=0555 contents=/base/ls",
+                  "./bin/cat type=file uname=root gname=wheel mode=0555 contents=/base/cat",
+                  "./bin/rm type=file uname=root gname=wheel mode=0555 contents=/base/rm")
+    overlay = _mtree("./bin type=dir uname=root gname=wheel mode=0755",
+                     "./bin/ls type=file uname=root gname=wheel mode=0555 contents=/overlay/ls",
+                     "./usr/local/bin/vim type=file uname=root gname=wheel mode=0555 contents=/overlay/vim")
+    # Two-way merge: add or replace everything
+    merged = _mtree(*[str(e) for e in base if e.path != "."])
+    assert merged.merge(overlay) == []
+    assert merged._mtree["./bin/ls"].attributes["contents"] == "/overlay/ls"
+    assert merged._mtree["./bin/rm"].attributes["contents"] == "/base/rm"
+    assert merged._mtree["./usr/local"].is_dir()  # missing parent directories are added
+    assert merged._mtree["./bin/ls"] is not overlay._mtree["./bin/ls"]
+
+    # Three-way merge: the overlay removed cat and rm (relative to base) and changed ls
+    ours = _mtree("./bin type=dir uname=root gname=wheel mode=0755",
+                  "./bin/ls type=file uname=root gname=wheel mode=0500 contents=/base/ls",
+                  "./bin/cat type=file uname=root gname=wheel mode=0555 contents=/base/cat",
+                  "./bin/rm type=file uname=root gname=wheel mode=0500 contents=/base/rm")
+    assert ours.merge(overlay, base=base) == ["./bin/ls", "./bin/rm"]
+    assert ours._mtree["./bin/ls"].attributes["mode"] == "0555"  # overlay wins for conflicts
+    assert "bin/cat" not in ours
+    assert "bin/rm" in ours  # modified here but removed in the overlay -> kept
+    assert "usr/local/bin/vim" in ours
+    assert ours._sorted_keys() == sorted(ours._mtree.keys())
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_diff_and_merge():
+    results = []
+    for num_lines in (10000, 100000):
+        old = MtreeFile(io.StringIO(_generate_metalog(num_lines)))
+        new = MtreeFile(io.StringIO(_generate_metalog(num_lines).replace("mode=0444 size=1", "mode=0444 size=2")))
+        start = time.time()
+        diff = old.diff(new)
+        diff_time = time.time() - start
+        assert len(diff.changed) > 0
+        start = time.time()
+        old.merge(new, base=MtreeFile(io.StringIO(_generate_metalog(num_lines))))
+        merge_time = time.time() - start
+        assert not old.diff(new)
+        results.append((num_lines, diff_time, merge_time))
+    print()
+    for num_lines, diff_time, merge_time in results:
+        print("{} entries: diff {:.3f}s, three-way merge {:.3f}s".format(num_lines, diff_time, merge_time))
+
+
+def test_deduplicate_files():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        for name, contents in (("lib/libc.so", b"libc"), ("lib32/libc.so", b"libc"), ("tests/a/data", b"libc"),
+                               ("tests/b/data", b"other"), ("tests/c/data", b"other"), ("tests/d/data", b"libx"),
+                               ("tests/empty1", b""), ("tests/empty2", b""), ("tests/e/flags", b"libx"),
+                               ("tests/f/uid", b"libx")):
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_bytes(contents)
+        os.link(str(root / "tests/b/data"), str(root / "tests/hardlink"))
+        mtree = _mtree("./lib/libc.so type=file uname=root gname=wheel mode=0444",
+                       "./lib32/libc.so type=file uname=root gname=wheel mode=0444",
+                       "./tests/a/data type=file uname=root gname=wheel mode=0555",  # different mode
+                       "./tests/b/data type=file uname=root gname=wheel mode=0444",
+                       "./tests/c/data type=file uname=root gname=wheel mode=0444",
+                       "./tests/d/data type=file uname=root gname=wheel mode=0444",
+                       "./tests/empty1 type=file uname=root gname=wheel mode=0444",
+                       "./tests/empty2 type=file uname=root gname=wheel mode=0444",
+                       "./tests/hardlink type=file uname=root gname=wheel mode=0444",
+                       "./tests/link type=link uname=root gname=wheel mode=0444 link=b/data",
+                       # Same contents as d/data, but a hardlink would also share flags/owner
+                       "./tests/e/flags type=file uname=root gname=wheel mode=0444 flags=schg",
+                       "./tests/f/uid type=file uname=root gname=wheel mode=0444 uid=1001")
+        original = MtreeFile(io.StringIO(_get_as_str(mtree)))
+        groups, saved = mtree.deduplicate_files(root, subtrees=["tests/"])
+        assert [[e.path for e in g] for g in groups] == [["./tests/b/data", "./tests/c/data", "./tests/hardlink"]]
+        assert saved == 5  # the hardlink is already deduplicated
+        assert mtree._mtree["./tests/c/data"].attributes["contents"] == str(root / "tests/b/data")
+        assert "contents" not in mtree._mtree["./tests/b/data"].attributes
+        assert [c[0].path for c in original.diff(mtree).changed] == []  # contents= is not a real change
+
+        groups, saved = mtree.deduplicate_files(root)
+        assert [[e.path for e in g] for g in groups] == [["./lib/libc.so", "./lib32/libc.so"],
+                                                          ["./tests/b/data", "./tests/c/data", "./tests/hardlink"]]
+        assert saved == 4  # the files in tests/ already refer to the same file now
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_deduplicate_files():
+    # Similar to a CheriBSD rootfs with the same libraries in /lib, /usr/lib, /usr/libcheri and the test suites
+    num_files = int(os.getenv("CHERIBUILD_BENCHMARK_FILES", "20000"))
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        lines = []
+        for i in range(num_files):
+            name = "usr/tests/dir{}/file{}".format(i % 100, i)
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            # every fifth file is unique, the others come in groups of four
+            data = (b"unique" + str(i).encode()) if i % 5 == 0 else (b"shared" + str(i // 4).encode())
+            (root / name).write_bytes(data * (1 + (i // 4) % 4096))
+            lines.append("./" + name + " type=file uname=root gname=wheel mode=0444")
+        mtree = _mtree(*lines)
+        start = time.time()
+        groups, saved = mtree.deduplicate_files(root)
+        duration = time.time() - start
+        total = sum(os.path.getsize(str(root / line.split()[0])) for line in lines)
+    print("\nDeduplicating {} files ({} MiB): {} groups, {:.1f} MiB saved in {:.2f}s".format(
+        num_files, total // 1024 // 1024, len(groups), saved / 1024 / 1024, duration))
+
+
+def test_metalog_view():
+    with tempfile.TemporaryDirectory() as td:
+        metalog = Path(td, "METALOG")
+        metalog.write_text("""#mtree 2.0
+./usr/lib/libc.so.7 type=file uname=root gname=wheel mode=0444 size=1
+. type=dir uname=root gname=wheel mode=0755
+./usr type=dir uname=root gname=wheel mode=0755
+./usr/lib type=dir uname=root gname=wheel mode=0755
+./usr/libexec type=dir uname=root gname=wheel mode=0755
+./usr/libexec/ld-elf.so.1 type=file uname=root gname=wheel mode=0555
+./usr/lib/libc.so type=link uname=root gname=wheel mode=0755 link=libc.so.7
+# comment
+./usr/lib/my\\040file type=file uname=root gname=wheel mode=0644
+./usr//lib/libc.so.7 type=file uname=root gname=wheel mode=0444 size=2
+""")
+        mtree = MtreeFile(metalog)
+        index_dir = Path(td, "index")
+        with MtreeView(metalog, index_dir=index_dir) as view:
+            assert len(view) == len(mtree) == 8
+            assert "usr/lib" in view
+            assert "/usr/lib/" in view
+            assert "usr/li" not in view
+            assert view.get("usr/bin") is None
+            # The last definition wins (just like MtreeFile)
+            assert view.get("usr/lib/libc.so.7").attributes["size"] == "2"
+            assert view.get("usr/lib/my file").path == "./usr/lib/my file"
+            assert view.get("usr/lib/libc.so").attributes["link"] == "libc.so.7"
+            assert list(view) == sorted(mtree, key=lambda e: e.path)
+            assert [e.path for e in view.entries_below("usr/lib")] == [
+                "./usr/lib", "./usr/lib/libc.so", "./usr/lib/libc.so.7", "./usr/lib/my file"]
+            assert [e.path for e in view.directories()] == [".", "./usr", "./usr/lib", "./usr/libexec"]
+        # The index is cached (but not next to the METALOG since that would add it to the rootfs) and only reused if
+        # the METALOG is unchanged
+        assert sorted(p.name for p in Path(td).iterdir()) == ["METALOG", "index"]
+        assert len(list(index_dir.iterdir())) == 1
+        assert MtreeView(metalog, index_dir=index_dir).get("usr/lib/libc.so.7").attributes["size"] == "2"
+        with metalog.open("a") as f:
+            f.write("./usr/lib/libc.so.7 type=file uname=root gname=wheel mode=0444 size=3\n")
+        assert MtreeView(metalog, index_dir=index_dir).get("usr/lib/libc.so.7").attributes["size"] == "3"
+        assert MtreeView(metalog).get("usr/lib/libc.so.7").attributes["size"] == "3"  # in-memory index only
+        metalog.write_text("")
+        with MtreeView(metalog, index_dir=index_dir) as view:
+            assert len(view) == 0 and "usr" not in view and list(view) == []
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_metalog_view():
+    num_lines = int(os.getenv("CHERIBUILD_BENCHMARK_LINES", "100000"))
+    with tempfile.TemporaryDirectory() as td:
+        metalog = Path(td, "METALOG")
+        metalog.write_text(_generate_metalog(num_lines))
+        lookups = ["usr/lib/dir" + str(i % 500) + "/file" + str(i) + ".so" for i in range(1, num_lines, 97)
+                   if i % 50 != 0 and i >= 500]
+        start = time.time()
+        mtree = MtreeFile(metalog)
+        for path in lookups:
+            assert path in mtree
+        full_time = time.time() - start
+        del mtree
+        start = time.time()
+        with MtreeView(metalog, index_dir=Path(td, "index")) as view:
+            view.get("usr")
+        index_time = time.time() - start
+        start = time.time()
+        with MtreeView(metalog, index_dir=Path(td, "index")) as view:
+            for path in lookups:
+                assert view.get(path) is not None
+        lookup_time = time.time() - start
+        tracemalloc.start()
+        with MtreeView(metalog, index_dir=Path(td, "index")) as view:
+            for path in lookups:
+                view.get(path)
+            _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("\n{} entries, {} lookups: MtreeFile {:.2f}s; MtreeView: build index {:.2f}s, cached index + lookups "
+              "{:.3f}s ({:.1f}us per lookup, {:.2f} MiB peak)".format(
+                  num_lines, len(lookups), full_time, index_time, lookup_time, lookup_time / len(lookups) * 1e6,
+                  peak / 1024 / 1024))
+
+
+def test_fingerprint():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        (root / "bin").mkdir()
+        (root / "bin/cat").write_bytes(b"cat")
+        (root / "entropy").write_bytes(os.urandom(16))
+        mtree = MtreeFile(io.StringIO("""#mtree 2.0
+. type=dir uname=root gname=wheel mode=0755
+./bin type=dir uname=root gname=wheel mode=0755
+./bin/cat type=file uname=root gname=wheel mode=0755
+./boot/entropy type=file uname=root gname=wheel mode=0600 contents=""" + str(root / "entropy") + """
+"""))
+        first = mtree.fingerprint(root, ignore_contents=["boot/entropy"])
+        assert sorted(first.keys()) == [".", "./bin", "./bin/cat", "./boot/entropy"]
+        assert first == mtree.fingerprint(root, ignore_contents=["boot/entropy"])
+        (root / "entropy").write_bytes(os.urandom(16))
+        os.utime(str(root / "bin/cat"), (12345, 12345))  # only the contents matter and not the timestamps
+        assert first == mtree.fingerprint(root, ignore_contents=["boot/entropy"])
+        assert first != mtree.fingerprint(root)
+        (root / "bin/cat").write_bytes(b"new cat")
+        second = mtree.fingerprint(root, ignore_contents=["boot/entropy"])
+        assert [k for k in first if first[k] != second[k]] == ["./bin/cat"]
+        mtree.add_dir("usr", mode="0755")
+        mtree._mtree["./bin"].attributes["mode"] = "0555"
+        third = mtree.fingerprint(root, ignore_contents=["boot/entropy"])
+        assert [k for k in third if first.get(k) != third[k]] == ["./bin", "./bin/cat", "./usr"]
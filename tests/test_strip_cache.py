@@ -0,0 +1,99 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.file_digests import FileDigestCache
+from pycheribuild.strip_cache import StripCache, is_elf_file
+
+LLVM_STRIP = shutil.which("llvm-strip")
+pytestmark = pytest.mark.skipif(not LLVM_STRIP, reason="llvm-strip is not installed")
+
+
+def _elf_binaries(count: int) -> "typing.List[Path]":
+    result = []
+    for name in sorted(os.listdir("/usr/bin")):
+        path = Path("/usr/bin", name)
+        if path.is_file() and is_elf_file(path):
+            result.append(path)
+            if len(result) == count:
+                break
+    return result
+
+
+def test_strip_cache():
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        binaries = _elf_binaries(5)
+        (root / "not-elf").write_text("#!/bin/sh\n")
+        assert not is_elf_file(root / "not-elf")
+        assert not is_elf_file(root / "does-not-exist")
+        files = [(b, root / "out" / b.name) for b in binaries]
+        (root / "out").mkdir()
+        digests = FileDigestCache(root / "digests.json")
+        cache = StripCache(root / "cache", [LLVM_STRIP])
+        cache.strip_files(files, digests=digests, jobs=4)
+        assert (cache.hits, cache.misses) == (0, len(binaries))
+        for src, dest in files:
+            assert is_elf_file(dest)
+            assert dest.stat().st_size <= src.stat().st_size
+            assert os.access(str(dest), os.X_OK)
+            assert dest.stat().st_nlink == 1  # never hardlinked to the cache entry
+        cached = [os.path.join(d, f) for d, _, names in os.walk(str(root / "cache")) for f in names]
+        mtimes = {path: os.stat(path).st_mtime_ns for path in cached}
+
+        # The second build only links the cached files
+        shutil.rmtree(str(root / "out"))
+        (root / "out").mkdir()
+        cache = StripCache(root / "cache", [LLVM_STRIP])
+        cache.strip_files(files, digests=digests, jobs=4)
+        assert (cache.hits, cache.misses) == (len(binaries), 0)
+        assert all(d.stat().st_size > 0 for _, d in files)
+        assert {path: os.stat(path).st_mtime_ns for path in cached} == mtimes
+        # Different flags are a different cache entry
+        cache = StripCache(root / "cache", [LLVM_STRIP, "--strip-debug"])
+        cache.strip_files(files[:1], digests=digests)
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        with pytest.raises(subprocess.CalledProcessError) as e:
+            cache.strip_files([(root / "not-elf", root / "out/not-elf")])
+        assert e.value.output
+        # No temporary files are left in the cache
+        assert len([f for _, _, names in os.walk(str(root / "cache")) for f in names]) == len(binaries) + 1
+
+        # Unused entries are pruned
+        cache.prune(max_age=-1)
+        assert [f for _, _, names in os.walk(str(root / "cache")) for f in names] == []
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_strip_cache():
+    binaries = _elf_binaries(int(os.getenv("CHERIBUILD_BENCHMARK_FILES", "300")))
+    jobs = os.cpu_count()
+    with tempfile.TemporaryDirectory() as td:
+        root = Path(td)
+        for name in ("sequential", "parallel", "cached"):
+            (root / name).mkdir()
+        start = time.time()
+        for b in binaries:
+            subprocess.check_call([LLVM_STRIP, str(b), "-o", str(root / "sequential" / b.name)])
+        sequential_time = time.time() - start
+        digests = FileDigestCache(root / "digests.json")
+        start = time.time()
+        StripCache(root / "cache", [LLVM_STRIP]).strip_files([(b, root / "parallel" / b.name) for b in binaries],
+                                                             digests=digests, jobs=jobs)
+        parallel_time = time.time() - start
+        start = time.time()
+        cache = StripCache(root / "cache", [LLVM_STRIP])
+        cache.strip_files([(b, root / "cached" / b.name) for b in binaries], digests=digests, jobs=jobs)
+        cached_time = time.time() - start
+        assert cache.hits == len(binaries)
+        print("\nStripping {} ELF files: sequential {:.2f}s, {} jobs (empty cache) {:.2f}s, cached {:.2f}s".format(
+            len(binaries), sequential_time, jobs, parallel_time, cached_time))
@@ -0,0 +1,138 @@
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from pycheribuild.mtree import MtreeFile
+from pycheribuild.sysroot import populate_sysroot_from_metalog, sysroot_symlink_target
+
+
+def _create_rootfs(root: Path, extra_files=0) -> MtreeFile:
+    """Create a fake NO_ROOT installworld result and return its METALOG"""
+    lines = ["#mtree 2.0", ". type=dir uname=root gname=wheel mode=0755"]
+
+    def add_dir(path):
+        (root / path).mkdir(parents=True, exist_ok=True)
+        lines.append("./" + path + " type=dir uname=root gname=wheel mode=0755")
+
+    def add_file(path, contents):
+        (root / path).write_text(contents)
+        lines.append("./" + path + " type=file uname=root gname=wheel mode=0444 size=" + str(len(contents)))
+
+    def add_link(path, target):
+        (root / path).symlink_to(target)
+        lines.append("./" + path + " type=link uname=root gname=wheel mode=0755 link=" + target)
+
+    for d in ("bin", "lib", "usr", "usr/include", "usr/include/sys", "usr/lib", "usr/libcheri", "usr/libdata",
+              "usr/libexec"):
+        add_dir(d)
+    add_file("bin/sh", "shell")
+    add_file("lib/libc.so.7", "libc")
+    add_file("usr/include/stdio.h", "stdio")
+    add_file("usr/include/sys/types.h", "types")
+    add_file("usr/lib/libc.a", "libc static")
+    add_file("usr/lib/libfoo.so.1", "libfoo")
+    add_file("usr/libcheri/libc.so.7", "purecap libc")
+    add_file("usr/libexec/ld-elf.so.1", "rtld")
+    add_link("usr/lib/libc.so", "/lib/libc.so.7")
+    add_link("usr/lib/libfoo.so", "libfoo.so.1")
+    add_link("usr/libcheri/libc.so", "/usr/libcheri/libc.so.7")
+    for i in range(extra_files):
+        if i % 1000 == 0:
+            add_dir("usr/include/dir" + str(i // 1000))
+        add_file("usr/include/dir" + str(i // 1000) + "/header" + str(i) + ".h", "x" * (i % 4096))
+    # Not installed (e.g. a stale METALOG entry)
+    lines.append("./usr/include/missing.h type=file uname=root gname=wheel mode=0444")
+    # Also not part of METALOG but present in the rootfs:
+    (root / "usr/lib/unlisted.a").write_text("unlisted")
+    return MtreeFile(io.StringIO("\n".join(lines) + "\n"))
+
+
+def test_symlink_target():
+    assert sysroot_symlink_target("usr/lib/libc.so", "/lib/libc.so.7") == "../../lib/libc.so.7"
+    assert sysroot_symlink_target("usr/lib/libfoo.so", "libfoo.so.1") == "libfoo.so.1"
+    assert sysroot_symlink_target("lib/libc.so", "/lib/libc.so.7") == "libc.so.7"
+    assert sysroot_symlink_target("usr/lib/debug/x", "/usr/libcheri/y") == "../../libcheri/y"
+
+
+def test_populate_sysroot():
+    with tempfile.TemporaryDirectory() as td:
+        rootfs = Path(td, "rootfs")
+        metalog = _create_rootfs(rootfs)
+        sysroot = Path(td, "sysroot")
+        # Like bsdtar @METALOG missing files are an error (but only after copying everything else)
+        with pytest.raises(FileNotFoundError) as e:
+            populate_sysroot_from_metalog(metalog, rootfs, sysroot, jobs=4)
+        assert "usr/include/missing.h" in str(e.value)
+        assert (sysroot / "usr/include/sys/types.h").is_file()
+        shutil.rmtree(str(sysroot))
+        stats = populate_sysroot_from_metalog(metalog, rootfs, sysroot, jobs=4, missing_ok=True)
+        assert dict(stats) == dict(files=7, hardlinked=0, symlinks=3, fixed_symlinks=2, missing=1)
+        assert (sysroot / "usr/include/sys/types.h").read_text() == "types"
+        assert (sysroot / "usr/libcheri/libc.so.7").read_text() == "purecap libc"
+        assert (sysroot / "usr/libdata").is_dir()
+        assert not (sysroot / "bin").exists()
+        assert not (sysroot / "usr/libexec").exists()
+        assert not (sysroot / "usr/lib/unlisted.a").exists()
+        assert os.readlink(str(sysroot / "usr/lib/libc.so")) == "../../lib/libc.so.7"
+        assert os.readlink(str(sysroot / "usr/lib/libfoo.so")) == "libfoo.so.1"
+        assert (sysroot / "usr/lib/libc.so").read_text() == "libc"
+        assert (sysroot / "usr/libcheri/libc.so").read_text() == "purecap libc"
+
+        # Unchanged files are hardlinked from the previous sysroot, changed ones copied
+        previous = Path(td, "sysroot.previous")
+        sysroot.rename(previous)
+        time.sleep(0.01)
+        (rootfs / "lib/libc.so.7").write_text("new libc")
+        stats = populate_sysroot_from_metalog(metalog, rootfs, sysroot, previous_sysroot=previous, missing_ok=True)
+        assert stats["hardlinked"] == 5
+        assert (sysroot / "lib/libc.so.7").read_text() == "new libc"
+        assert (previous / "lib/libc.so.7").read_text() == "libc"
+        assert os.path.samefile(str(sysroot / "usr/lib/libc.a"), str(previous / "usr/lib/libc.a"))
+        assert not os.path.samefile(str(sysroot / "lib/libc.so.7"), str(previous / "lib/libc.so.7"))
+
+
+@pytest.mark.skipif(not os.getenv("CHERIBUILD_RUN_BENCHMARKS"), reason="set CHERIBUILD_RUN_BENCHMARKS to run")
+def test_benchmark_populate_sysroot():
+    num_files = int(os.getenv("CHERIBUILD_BENCHMARK_FILES", "20000"))
+    with tempfile.TemporaryDirectory(dir=os.getenv("CHERIBUILD_BENCHMARK_DIR")) as td:
+        rootfs = Path(td, "rootfs")
+        metalog = _create_rootfs(rootfs, extra_files=num_files)
+        metalog_paths = [e.path for e in metalog if e.attributes.get("type") != "dir" and e.path.startswith(
+            ("./lib/", "./usr/include/", "./usr/lib/", "./usr/libcheri/", "./usr/libdata/")) and
+            os.path.lexists(str(rootfs / e.path))]
+        file_list = Path(td, "files.txt")
+        file_list.write_text("\n".join(metalog_paths) + "\n")
+        # Approximation of the old pipeline (GNU tar doesn't support @METALOG so pass the list of files instead)
+        tar_sysroot = Path(td, "tar-sysroot")
+        tar_sysroot.mkdir()
+        start = time.time()
+        with subprocess.Popen(["tar", "cf", "-", "-T", str(file_list)], stdout=subprocess.PIPE,
+                              cwd=str(rootfs)) as tar:
+            subprocess.check_call(["tar", "xf", "-"], stdin=tar.stdout, cwd=str(tar_sysroot))
+        for link in (tar_sysroot / "usr/lib").iterdir():
+            if link.is_symlink() and os.readlink(str(link)).startswith("/"):
+                target = "../.." + os.readlink(str(link))
+                link.unlink()
+                link.symlink_to(target)
+        tar_time = time.time() - start
+
+        start = time.time()
+        populate_sysroot_from_metalog(metalog, rootfs, Path(td, "sysroot"), missing_ok=True)
+        python_time = time.time() - start
+        Path(td, "sysroot").rename(Path(td, "previous"))
+        start = time.time()
+        stats = populate_sysroot_from_metalog(metalog, rootfs, Path(td, "sysroot"), previous_sysroot=Path(td, "previous"),
+                                              missing_ok=True)
+        rebuild_time = time.time() - start
+        assert stats["hardlinked"] == stats["files"] - stats["missing"]
+        print("\n{} files: tar pipeline {:.2f}s, in-process {:.2f}s, in-process with previous sysroot {:.2f}s".format(
+            len(metalog_paths), tar_time, python_time, rebuild_time))